@@ -1,60 +1,273 @@
+import asyncio
+import functools
 import json
 import logging
-from typing import List, Dict, Any, Set
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Set
 from data_model import Constraint
 from graph_state import GraphState, ThoughtNode
 from environment import GraphEnvironment
 from critic import StatisticalCritic
+from speculation import SpeculativeExecutor
+from budget import BudgetExceeded, QueryBudget, budget_scope, run_in_context, usage_scope
+from wikidata_service import QueryCancelled, cancellable
+from tracing import traced, current_span
+from log_pipeline import log_event
 
 logger = logging.getLogger(__name__)
 
+# 决策规则、动作列表和输出格式：与具体查询无关，多轮模式下作为稳定的 system 前缀 (便于服务端 Prompt Caching)
+DECISION_INSTRUCTIONS = """
+        === Decision Instructions ===
+        1. **ANALYZE HISTORY**: Look at the "Current Graph State". Which constraints have ALREADY been applied?
+        2. **CHECK COMPLETION**: 
+           - Do the current remaining candidates satisfy ALL "Constraint Definitions"? 
+           - If you have 1-5 candidates left and you have applied all necessary filters, output "FINISH".
+        3. **AVOID LOOPS**: Do NOT apply a constraint (FILTER/SEARCH) if it has already been applied in the current path.
+        4. **NEXT STEP**: If constraints remain unfulfilled, choose the best one based on the Critic's advice.
+        5.**HANDLE DEAD ENDS**: If a FILTER returns 0 entities, implies missing data or strict constraints. You MUST use 'RELAX_CONSTRAINT' on that constraint.
+
+        Available Actions:
+        1. SEARCH_ANCHOR(constraint_id): Start a new search path (Only if no good path exists).
+        2. FILTER(parent_node_id, constraint_id): Apply a constraint to narrow down results.
+        3. INTERSECT(node_id_1, node_id_2): Intersect two sets of candidates.
+        4. FINISH(final_node_id): Return the final answer.
+        5.RELAX_CONSTRAINT(constraint_id): **CRITICAL**. Use this if a FILTER yielded 0 results. It changes the constraint to 'IGNORE' so you can proceed.
+
+        Batching: you may return several actions at once as an ordered "actions" list.
+        New nodes are named node_<constraint_id> (INTERSECT: merge_<id1>_<id2>; a suffix such as _2 is added
+        if the name is already taken). Later actions in the list can use these base names as parents,
+        e.g. SEARCH_ANCHOR c1, SEARCH_ANCHOR c2, then INTERSECT(node_c1, node_c2).
+        Actions that do not depend on each other are executed in parallel.
+
+        Output JSON (keep this key order: action and params first, reasoning last):
+        {
+            "action": "ACTION_NAME",
+            "params": { ... },
+            "reasoning": "Step-by-step reasoning: 1. I see constraints A, B, C are done. 2. Candidate count is X. 3. Therefore I will..."
+        }
+        or, for a batch:
+        {
+            "actions": [{"action": "ACTION_NAME", "params": { ... }}, ...],
+            "reasoning": "..."
+        }
+"""
+
+SYSTEM_PROMPT = """
+        Role: You are an autonomous Graph of Thoughts Agent.
+        Goal: Find the entity that satisfies ALL user constraints.
+
+        The first user message gives the query, the constraint definitions and the initial graph state.
+        Each later user message only contains what CHANGED since your last decision
+        (new graph nodes, redefined constraints, new critic advice). Keep track of the full state yourself.
+""" + DECISION_INSTRUCTIONS
+
 
 class GoTAgent:
-    def __init__(self, llm, tools: GraphEnvironment, critic: StatisticalCritic):
+    def __init__(self, llm, tools: GraphEnvironment, critic: StatisticalCritic, plan_fast_path: bool = False,
+                 multi_turn: bool = True, llm_timeout: float = None, speculate: int = 0, max_parallel: int = 4,
+                 release_memory: bool = False, beam_width: int = 1, beam_budget: float = 60.0,
+                 budget_limits: Dict[str, Any] = None, pool: ThreadPoolExecutor = None, streaming: bool = False):
         self.llm = llm
         self.tools = tools
         self.critic = critic
-        self.state = GraphState()
+        # release_memory: 长时间求解时释放死节点 (被放弃的分支、被支配的路径) 的候选集，见 GraphState.release_dead
+        self.state = GraphState(release_unreachable=release_memory)
         self.max_steps = 15  # 稍微增加步数上限，以防复杂推理
-
-    def solve(self, user_query: str, constraints: List[Constraint]):
+        # 快速路径 (默认关闭)：直接执行 Optimizer 的计划 (Anchor + 依次 Filter)，
+        # 只在死路或计划不明确 (前两个 Anchor 分数接近) 时才交给 LLM
+        self.plan_fast_path = plan_fast_path
+        # [SETTING] 第二名与第一名 Anchor 的分数相差不到该比例时视为并列，由 LLM 选择
+        self.PLAN_TIE_MARGIN = 0.05
+        self.metrics = {
+            "llm_calls": 0,  # 实际发生的 LLM 决策调用
+            "llm_calls_saved": 0,  # 由确定性计划代替的决策步数 (含 FINISH)，计划中途交给 LLM 时不计
+            "plan_steps": 0,
+            "plan_completed": False,
+        }
+        # 多轮对话模式：稳定的 system 前缀 + 每步只发送状态增量
+        self.multi_turn = multi_turn and hasattr(llm, "chat_json")
+        self.messages: List[Dict[str, str]] = []
+        self._node_cursor = 0  # state.node_log 中已经发给 LLM 的位置
+        self._sent_definitions: Dict[str, str] = {}
+        self._sent_advice = None
+        # 每一步 LLM 调用的 token / 延迟记录
+        self.step_metrics: List[Dict[str, Any]] = []
+        # 流式决策 (默认关闭)：action/params 一解析完就开始执行工具，不等 reasoning (要求 llm 提供 achat_json / aclose)
+        if streaming and not (hasattr(llm, "achat_json") and hasattr(llm, "aclose")):
+            raise ValueError("streaming=True requires an LLM with achat_json() and aclose(); pass streaming=False.")
+        self.streaming = streaming
+        self.llm_timeout = llm_timeout  # 单步 LLM 调用的超时 (秒)
+        # 推测执行 (默认关闭，会额外消耗 SPARQL 请求)：LLM 思考期间提前执行 Critic 排名最高的 speculate 个动作 (0 表示关闭)
+        self.speculate = speculate
+        self.speculator = None
+        # 批量动作中相互独立的步骤并行执行
+        self.max_parallel = max_parallel
+        # pool: 调用方提供的常驻线程池 (服务模式下多个 Agent 共用)，求解结束时不关闭
+        self._pool = pool
+        self._owns_pool = pool is None
+        # 束搜索：beam_width > 1 时同时沿前 k 个 Anchor 并行推进，代替单路径的计划快速路径
+        # beam_budget 为束搜索阶段的墙钟时间上限 (秒)，超时后交给 LLM
+        self.beam_width = beam_width
+        self.beam_budget = beam_budget
+        # 单次 solve 的成本预算 (QueryBudget 的参数)；solve 未显式传入 budget 时据此创建
+        self.budget_limits = budget_limits
+        self.budget = None
+
+    def solve(self, user_query: str, constraints: List[Constraint], timeout: float = None,
+              budget: QueryBudget = None):
+        """
+        同步入口；timeout 为整个求解过程的时间上限 (秒)，budget 为本次查询的成本预算。
+        每次调用都在新的事件循环中运行，结束前关闭该循环上的异步 LLM 客户端。
+        """
+        async def run():
+            try:
+                return await self.solve_async(user_query, constraints, timeout=timeout, budget=budget)
+            finally:
+                if self.streaming:
+                    await self.llm.aclose()
+
+        return asyncio.run(run())
+
+    async def solve_async(self, user_query: str, constraints: List[Constraint], timeout: float = None,
+                          budget: QueryBudget = None):
+        if budget is None and self.budget_limits:
+            budget = QueryBudget(**self.budget_limits)
+        self.budget = budget
+        # 预算对本次求解中的工具 / 探测 / LLM 调用生效 (通过上下文传递到工作线程)
+        with budget_scope(budget):
+            if budget:
+                timeout = budget.clip_timeout(timeout)
+            try:
+                return await asyncio.wait_for(self._solve_loop(user_query, constraints), timeout)
+            except asyncio.TimeoutError:
+                # 超时：取消进行中的 LLM 流，返回当前最佳节点作为兜底
+                logger.warning(f"[Agent] Solve timed out after {timeout}s. Returning best partial result.")
+                return self._best_candidates()
+            except BudgetExceeded as e:
+                # 工具调用时预算耗尽：同样以当前最佳节点结束，而不是把失败的动作当作空结果继续
+                logger.warning(f"[Agent] Budget exceeded during a tool call ({e}). Returning best partial result.")
+                return self._best_candidates()
+            finally:
+                if budget:
+                    self.metrics["budget"] = budget.summary()
+
+    def _best_candidates(self) -> Set[str]:
+        """降级结束时的最佳结果：非空叶子中路径覆盖约束最多、候选最少的节点"""
+        leaves = [n for n in self._leaf_nodes() if n.candidates]
+        if not leaves:
+            return set()
+        best = max(leaves, key=lambda n: (len(self._path_constraints(n)), -len(n.candidates)))
+        self.state.history.append(f"Step {self.metrics['plan_steps']}: [Budget] FINISH with best node {best.node_id}.")
+        return best.candidates
+
+    def _path_constraints(self, node: ThoughtNode) -> Set[str]:
+        """沿父节点回溯，收集该路径上已经施加过的约束"""
+        applied, stack, seen = set(), [node.node_id], set()
+        while stack:
+            nid = stack.pop()
+            if nid in seen:
+                continue
+            seen.add(nid)
+            current = self.state.get_node(nid)
+            if not current:
+                continue
+            if current.constraint_id:
+                applied.add(current.constraint_id)
+            stack.extend(current.parent_ids)
+        return applied
+
+    def _leaf_nodes(self) -> List[ThoughtNode]:
+        return self.state.get_leaves()
+
+    async def _solve_loop(self, user_query: str, constraints: List[Constraint]):
+        if self.speculate > 0:
+            self.speculator = SpeculativeExecutor(max_workers=self.speculate)
+        try:
+            return await self._run_steps(user_query, constraints)
+        finally:
+            if self.speculator:
+                self.speculator.shutdown()
+                self.metrics["speculation"] = dict(self.speculator.stats)
+            if self._pool and self._owns_pool:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    @traced("agent.solve")
+    async def _run_steps(self, user_query: str, constraints: List[Constraint]):
+        loop = asyncio.get_running_loop()
         # 初始化节点：Root
         self.state.add_node(ThoughtNode("root", "Start", set()))
         constraint_map = {c.id: c for c in constraints}
+
+        # 0. 快速路径：计划明确时无需 LLM (束搜索模式下同时推进多条路径)
+        if self.beam_width > 1:
+            final_candidates = await loop.run_in_executor(None, run_in_context(self._execute_beam),
+                                                          constraints, constraint_map)
+            if final_candidates is not None:
+                return final_candidates
+        elif self.plan_fast_path:
+            final_candidates = await loop.run_in_executor(None, run_in_context(self._execute_plan),
+                                                          constraints, constraint_map)
+            if final_candidates is not None:
+                return final_candidates
+
         step = 0
         while step < self.max_steps:
+            # 预算不足：不再调用 LLM，直接用当前最佳节点结束
+            if self.budget and self.budget.is_short():
+                logger.warning(f"[Agent] Budget running short at step {step} ({self.budget.summary()}). "
+                               f"Finishing with the best node.")
+                return self._best_candidates()
+
             # 1. Observe: 获取当前状态
             graph_summary = self.state.get_summary()
 
             # 获取当前最新的节点信息，用于判断是否为空
-            current_leaf_nodes = [node for node in self.state.nodes.values() if
-                                  not any(edge[0] == node.node_id for edge in self.state.edges)]
-            current_candidates_count = sum(len(n.candidates) for n in current_leaf_nodes) if current_leaf_nodes else 0
+            current_leaf_nodes = self._leaf_nodes()
+            current_candidates_count = sum(n.size for n in current_leaf_nodes) if current_leaf_nodes else 0
 
             # 2. Critic: 依然让 Critic 提供建议，但传入所有约束，让 Critic 评估整体优先级
             # 注意：Critic 还是基于数学计算优先级的，这对 LLM 决策很有帮助
             critic_advice = self.critic.evaluate_constraints(constraints)
 
-            # 3. Think: 构建 Prompt
-            # 关键修改：不再传入 partial list，而是传入所有 constraints，让 LLM 自己对照 History 判断
-            prompt = self._build_prompt(user_query, graph_summary, critic_advice, constraints, step)
-
-            # 4. Decide: LLM 决策
-            action_json = self.llm.generate_json(prompt)
-
-            # 5. Act: 执行工具
+            # 3 & 4 & 5. Think + Decide + Act: LLM 决策并执行工具
             # 注意：这里传入的是由 id 索引的完整约束字典
-
-            result_node = self._execute_action(action_json, constraint_map)
-
-            if result_node:
-                self.state.add_node(result_node)
-                self.state.history.append(f"Step {step}: {action_json.get('reasoning')}")
-
-                # 终止条件：LLM 主动 FINISH
-                if action_json.get("action") == "FINISH":
-                    logger.info(f"Agent decided to FINISH at step {step}.")
-                    return result_node.candidates
+            if self.multi_turn:
+                # 多轮模式：只追加本步的状态增量
+                self.messages.append({"role": "user", "content": self._build_delta_message(
+                    user_query, graph_summary, critic_advice, constraints, step)})
+                messages = self.messages
+            else:
+                # 关键修改：不再传入 partial list，而是传入所有 constraints，让 LLM 自己对照 History 判断
+                prompt = self._build_prompt(user_query, graph_summary, critic_advice, constraints, step)
+                messages = [{"role": "user", "content": prompt}]
+
+            if self.speculator:
+                self.speculator.start(self._predict_actions(constraints),
+                                      lambda action: self._execute_action(action, constraint_map))
+
+            action_json, actions, result_nodes = await self._decide_and_act(messages, constraint_map, step)
+            if self.multi_turn:
+                self.messages.append({"role": "assistant", "content": json.dumps(action_json, ensure_ascii=False)})
+
+            if any(result_nodes):
+                # 终止条件：LLM 主动 FINISH (必须是批次中的最后一个动作)
+                if actions[-1].get("action") == "FINISH" and result_nodes[-1]:
+                    self.state.add_nodes([n for n in result_nodes[:-1] if n])
+                    self.state.history.append(f"Step {self.metrics['plan_steps'] + step}: {action_json.get('reasoning')}")
+                    log_event(logger, "agent.finish", "Agent decided to FINISH at step {step}.", step=step,
+                              rows=len(result_nodes[-1].candidates))
+                    return result_nodes[-1].candidates
+
+                # 本步产生的所有节点一次性加入图中
+                self.state.add_nodes([n for n in result_nodes if n])
+                self.state.history.append(f"Step {self.metrics['plan_steps'] + step}: {action_json.get('reasoning')}")
+                if len(actions) > 1:
+                    log_event(logger, "agent.batch", "Step {step}: batch of {actions} actions, {succeeded} succeeded.",
+                              step=step, actions=len(actions), succeeded=sum(1 for n in result_nodes if n))
             else:
                 # 如果执行失败（例如 Action 解析错误），记录日志但不 crash
                 logger.warning(f"Step {step} action failed or returned None.")
@@ -69,6 +282,252 @@ class GoTAgent:
 
         return set()
 
+    @traced("agent.step")
+    async def _decide_and_act(self, messages: List[Dict[str, str]], constraint_map: dict, step: int):
+        """
+        调用 LLM 决策并执行对应动作，返回 (action_json, actions, result_nodes)。
+        流式模式下，action/params (或 actions 列表) 一解析完成就在线程池中开始执行工具，与剩余 reasoning 的生成并行。
+        """
+        current_span().set(step=step)
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        early = {}
+
+        def on_fields(fields):
+            if "future" in early:
+                return
+            early["actions"] = self._normalize_actions(fields)
+            early["future"] = self._run_actions(early["actions"], constraint_map)
+            log_event(logger, "agent.early_actions", "[Agent] Step {step}: early actions {actions} after {after:.2f}s",
+                      step=step, actions=[a['action'] for a in early['actions']], after=time.time() - start_time)
+
+        # 本步的 token 用量按请求收集 (同一个 LLMService 被并发请求共用，不能读服务上的共享状态)
+        with usage_scope() as usage:
+            try:
+                if self.streaming:
+                    action_json = await self.llm.achat_json(messages, on_fields=on_fields, timeout=self.llm_timeout)
+                elif self.multi_turn:
+                    action_json = await asyncio.wait_for(
+                        loop.run_in_executor(None, run_in_context(self.llm.chat_json), messages), self.llm_timeout)
+                else:
+                    action_json = await asyncio.wait_for(
+                        loop.run_in_executor(None, run_in_context(self.llm.generate_json), messages[0]["content"]), self.llm_timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"[Agent] Step {step} LLM call timed out after {self.llm_timeout}s.")
+                action_json = {}
+
+        self.metrics["llm_calls"] += 1
+        self._record_step_metrics(step, time.time() - start_time, usage)
+
+        if "future" in early:
+            # 流已经给出了动作：沿用提前执行的结果 (即使最终 JSON 解析失败)
+            actions = early["actions"]
+            result_nodes = await early["future"]
+            if not action_json:
+                action_json = {"actions": actions} if len(actions) > 1 else dict(actions[0])
+        else:
+            actions = self._normalize_actions(action_json)
+            result_nodes = await self._run_actions(actions, constraint_map)
+        return action_json, actions, result_nodes
+
+    @staticmethod
+    def _normalize_actions(action_json: dict) -> List[dict]:
+        """单个动作与 actions 列表统一为有序的动作列表"""
+        if isinstance(action_json.get("actions"), list):
+            actions = [{"action": a.get("action"), "params": a.get("params") or {}}
+                       for a in action_json["actions"] if isinstance(a, dict)]
+            if actions:
+                return actions
+        return [{"action": action_json.get("action"), "params": action_json.get("params") or {}}]
+
+    def _run_actions(self, actions: List[dict], constraint_map: dict) -> asyncio.Future:
+        """执行一批动作：命中推测的动作复用后台结果，其余在线程池中执行；未采用的推测全部丢弃"""
+        loop = asyncio.get_running_loop()
+        prefetched = {}
+        if self.speculator:
+            for i, action in enumerate(actions):
+                future = self.speculator.take(action)
+                if future is not None:
+                    prefetched[i] = future
+            self.speculator.discard()
+        return loop.run_in_executor(None, functools.partial(run_in_context(self._execute_action), actions,
+                                                            constraint_map, prefetched=prefetched))
+
+    def _predict_actions(self, constraints: List[Constraint]) -> List[dict]:
+        """
+        预测 LLM 最可能选择的下一步 (按 Optimizer 的排序)：
+        - 还没有 Anchor 时：对排名最高的约束 SEARCH_ANCHOR；
+        - 否则：在最近一个非空节点上 FILTER 路径中尚未施加的约束。
+        """
+        frontier = None
+        for node_id in reversed(self.state.node_log):
+            node = self.state.get_node(node_id)
+            if node and node.node_id != "root" and node.candidates:
+                frontier = node
+                break
+
+        usable = [c for c in constraints if c.operator != "IGNORE"]
+        if frontier is None:
+            return [{"action": "SEARCH_ANCHOR", "params": {"constraint_id": c.id}} for c in usable]
+
+        applied = self._path_constraints(frontier)
+
+        return [{"action": "FILTER", "params": {"parent_node_id": frontier.node_id, "constraint_id": c.id}}
+                for c in usable if c.id not in applied]
+
+    @traced("agent.plan")
+    def _execute_plan(self, constraints: List[Constraint], constraint_map: dict):
+        """
+        确定性执行 Optimizer 的计划：以排序第一的约束为 Anchor，再按顺序 FILTER 其余约束。
+        全部成功时直接返回候选集 (省去每一步的 LLM 调用)；
+        计划不明确 (没有可用 Anchor) 或某一步返回 0 个候选时返回 None，已生成的节点保留在图中交给 LLM 继续。
+        """
+        if not constraints:
+            return None
+
+        constraints = self._ensure_ranked(constraints)
+        anchor = constraints[0]
+        selective, anchor_desc = self._anchor_gate(anchor)
+        if not selective:
+            logger.info(f"[Plan] No selective anchor (best '{anchor.property_label}' = {anchor_desc}). "
+                        f"Handing over to LLM.")
+            return None
+        runner_up = next((c for c in constraints[1:] if c.operator != "IGNORE"), None)
+        if runner_up is not None and self._anchors_tied(anchor, runner_up):
+            logger.info(f"[Plan] Ambiguous anchor: '{anchor.property_label}' and '{runner_up.property_label}' "
+                        f"score within {self.PLAN_TIE_MARGIN:.0%}. Handing over to LLM.")
+            return None
+
+        actions = [{"action": "SEARCH_ANCHOR", "params": {"constraint_id": anchor.id},
+                    "reasoning": f"[Plan] Anchor on '{anchor.property_label}' ({anchor_desc})."}]
+        for c in constraints[1:]:
+            actions.append({"action": "FILTER", "params": {"constraint_id": c.id},
+                            "reasoning": f"[Plan] Filter by '{c.property_label}'."})
+
+        current_node = None
+        for action in actions:
+            if self.budget and self.budget.is_short():
+                logger.warning("[Plan] Budget running short. Handing over.")
+                return None
+            # FILTER 的父节点是上一步的结果
+            if current_node is not None:
+                action["params"]["parent_node_id"] = current_node.node_id
+
+            result_node = self._execute_action(action, constraint_map)
+            if not result_node:
+                logger.warning(f"[Plan] {action['action']} failed. Handing over to LLM.")
+                return None
+
+            self.state.add_node(result_node)
+            self.state.history.append(f"Step {self.metrics['plan_steps']}: {action['reasoning']}")
+            self.metrics["plan_steps"] += 1
+            current_node = result_node
+
+            if not result_node.candidates:
+                logger.info(f"[Plan] Dead end at {result_node.node_id} (0 candidates). Handing over to LLM.")
+                return None
+
+        # 计划完整执行：直接 FINISH，省下的是每个计划步骤加上 FINISH 的决策调用
+        self.metrics["llm_calls_saved"] += len(actions) + 1
+        self.metrics["plan_completed"] = True
+        self.state.history.append(f"Step {self.metrics['plan_steps']}: [Plan] All constraints applied. "
+                                  f"FINISH with {current_node.node_id}.")
+        log_event(logger, "agent.plan_done", "[Plan] Completed without LLM: {rows} candidates "
+                  "({saved} LLM calls saved).", rows=len(current_node.candidates),
+                  saved=self.metrics['llm_calls_saved'])
+        return current_node.candidates
+
+    def _ensure_ranked(self, constraints: List[Constraint]) -> List[Constraint]:
+        """确保已经探测 (或由模型打分) 过"""
+        if constraints[0].estimated_rows == -1 and constraints[0].anchor_score is None:
+            constraints = self.critic.optimizer.optimize(constraints)
+        return constraints
+
+    def _anchor_gate(self, c: Constraint):
+        """
+        计划快速路径与束搜索共用的 Anchor 门槛，返回 (是否足够有选择性, 描述)：
+        模型打分时要求 anchor_score >= 阈值，否则要求 0 < estimated_rows <= PROBE_LIMIT 且不是探测下界。
+        """
+        optimizer = self.critic.optimizer
+        if c.operator == "IGNORE":
+            return False, "IGNORE"
+        if c.estimated_rows == -1 and c.anchor_score is not None:
+            # 本地锚点模型打分 (无在线探测)
+            return c.anchor_score >= optimizer.ranker.threshold, f"model score {c.anchor_score:.2f}"
+        # 探测提前终止得到的下界不能证明锚点足够小
+        selective = 0 < c.estimated_rows <= optimizer.PROBE_LIMIT and not c.rows_lower_bound
+        return selective, f"{'>= ' if c.rows_lower_bound else ''}{c.estimated_rows} rows"
+
+    def _anchors_tied(self, anchor: Constraint, runner_up: Constraint) -> bool:
+        """
+        前两个 Anchor 是否并列：都由锚点模型打分时比较好锚点概率，否则比较 priority_score
+        (探测下界不算并列，它已经确定比第一名大)。
+        """
+        if anchor.anchor_score is not None and runner_up.anchor_score is not None:
+            best, second = anchor.anchor_score, runner_up.anchor_score
+        elif runner_up.rows_lower_bound or runner_up.estimated_rows <= 0:
+            return False
+        else:
+            best, second = anchor.priority_score, runner_up.priority_score
+        return best > 0 and second >= best * (1 - self.PLAN_TIE_MARGIN)
+
+    def _build_delta_message(self, query, graph, advice, constraints: List[Constraint], current_step: int) -> str:
+        """
+        多轮模式的 user 消息：第一次发送完整上下文，之后只发送新节点、变化的约束定义和变化的 Critic 建议。
+        """
+        definitions = {c.id: f"- {c.id}: {c.property_label} {c.operator} {c.value}" for c in constraints}
+
+        if not self.messages:
+            self.messages.append({"role": "system", "content": SYSTEM_PROMPT})
+            self._sent_definitions = dict(definitions)
+            self._sent_advice = advice
+            self._node_cursor = len(self.state.node_log)
+            definitions_str = "\n".join(definitions.values())
+            return f"""
+        User Query: "{query}"
+
+        === Constraint Definitions (Reference) ===
+        {definitions_str}
+
+        === Current Graph State (History) ===
+        {graph}
+
+        === Statistical Critic Advice ===
+        {advice}
+
+        Step {current_step}: decide the next action.
+        """
+
+        parts = [f"=== Update for Step {current_step} ==="]
+
+        new_nodes = self.state.get_delta(self._node_cursor)
+        self._node_cursor = len(self.state.node_log)
+        parts.append("New graph nodes:\n" + new_nodes if new_nodes else "New graph nodes: (none, last action failed)")
+
+        changed = [line for cid, line in definitions.items() if self._sent_definitions.get(cid) != line]
+        if changed:
+            parts.append("Redefined constraints:\n" + "\n".join(changed))
+            self._sent_definitions.update(definitions)
+
+        if advice != self._sent_advice:
+            parts.append("Updated critic advice:\n" + advice)
+            self._sent_advice = advice
+
+        parts.append("Decide the next action.")
+        return "\n".join(parts)
+
+    def _record_step_metrics(self, step: int, latency: float, usage: Dict[str, Any]):
+        record = {
+            "step": step,
+            "latency": round(latency, 3),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+        }
+        self.step_metrics.append(record)
+        log_event(logger, "agent.llm_step", "[Agent] Step {step} LLM: {latency}s, prompt={prompt_tokens} "
+                  "(cached {cached_tokens}), completion={completion_tokens} tokens", **record)
+
     def _build_prompt(self, query, graph, advice, constraints: List[Constraint], current_step: int) -> str:
         # 列出所有约束的定义，作为"工具书"供 LLM 参考
         definitions = "\n".join([f"- {c.id}: {c.property_label} {c.operator} {c.value}" for c in constraints])
@@ -88,54 +547,273 @@ class GoTAgent:
         === Statistical Critic Advice ===
         {advice}
 
-        === Decision Instructions ===
-        1. **ANALYZE HISTORY**: Look at the "Current Graph State". Which constraints have ALREADY been applied?
-        2. **CHECK COMPLETION**: 
-           - Do the current remaining candidates satisfy ALL "Constraint Definitions"? 
-           - If you have 1-5 candidates left and you have applied all necessary filters, output "FINISH".
-        3. **AVOID LOOPS**: Do NOT apply a constraint (FILTER/SEARCH) if it has already been applied in the current path.
-        4. **NEXT STEP**: If constraints remain unfulfilled, choose the best one based on the Critic's advice.
-        5.**HANDLE DEAD ENDS**: If a FILTER returns 0 entities, implies missing data or strict constraints. You MUST use 'RELAX_CONSTRAINT' on that constraint.
+        {DECISION_INSTRUCTIONS}
+        """
 
-        Available Actions:
-        1. SEARCH_ANCHOR(constraint_id): Start a new search path (Only if no good path exists).
-        2. FILTER(parent_node_id, constraint_id): Apply a constraint to narrow down results.
-        3. INTERSECT(node_id_1, node_id_2): Intersect two sets of candidates.
-        4. FINISH(final_node_id): Return the final answer.
-        5.RELAX_CONSTRAINT(constraint_id): **CRITICAL**. Use this if a FILTER yielded 0 results. It changes the constraint to 'IGNORE' so you can proceed.
-        Output JSON:
-        {{
-            "reasoning": "Step-by-step reasoning: 1. I see constraints A, B, C are done. 2. Candidate count is X. 3. Therefore I will...",
-            "action": "ACTION_NAME",
-            "params": {{ ... }}
-        }}
+    @staticmethod
+    def _action_output_id(action: dict) -> Optional[str]:
+        """动作执行成功后产生的节点 ID (与 _execute_action 中的命名保持一致)"""
+        act_type = action.get("action")
+        params = action.get("params") or {}
+        if act_type in ("SEARCH_ANCHOR", "FILTER"):
+            return f"node_{params.get('constraint_id')}"
+        if act_type == "RELAX_CONSTRAINT":
+            return f"relax_{params.get('constraint_id')}"
+        if act_type == "INTERSECT":
+            return f"merge_{params.get('node_id_1')}_{params.get('node_id_2')}"
+        return None
+
+    def _action_dependencies(self, actions: List[dict], i: int) -> Set[int]:
+        """
+        actions[i] 依赖的前序动作下标：
+        - 输入节点 (parent_node_id / node_id_1 / node_id_2) 由前序动作产生；
+        - 作用于同一个约束 (RELAX 会修改约束，需保持原有顺序)；
+        - FINISH 依赖之前的全部动作。
         """
+        action = actions[i]
+        if action.get("action") == "FINISH":
+            return set(range(i))
+        params = action.get("params") or {}
+        inputs = {params.get(k) for k in ("parent_node_id", "node_id_1", "node_id_2")} - {None}
+        cid = params.get("constraint_id")
+        deps = set()
+        for j in range(i):
+            other = actions[j].get("params") or {}
+            if self._action_output_id(actions[j]) in inputs or (cid is not None and other.get("constraint_id") == cid):
+                deps.add(j)
+        return deps
+
+    def _execute_actions(self, actions: List[dict], constraint_map: dict,
+                         prefetched: Dict[int, Any] = None) -> List[Optional[ThoughtNode]]:
+        """
+        按依赖关系分轮执行一批动作：每一轮把依赖已满足的动作同时提交到线程池。
+        依赖失败的动作直接跳过。返回与 actions 一一对应的节点列表 (失败为 None)，节点不会写入 GraphState。
+        prefetched: {下标: concurrent.futures.Future}，推测执行已经在跑的动作。
+        """
+        prefetched = dict(prefetched or {})
+        # 推测执行用的是批次开始前的约束：同一批次中排在前面的 RELAX 改写了该约束时，预取结果作废
+        relaxed = set()
+        for i, action in enumerate(actions):
+            cid = (action.get("params") or {}).get("constraint_id")
+            if i in prefetched and cid in relaxed:
+                prefetched.pop(i).cancel()
+                logger.info(f"[Agent] Discarded prefetched {action.get('action')} on {cid}: relaxed earlier in the batch.")
+            if action.get("action") == "RELAX_CONSTRAINT":
+                relaxed.add(cid)
+        pool = self._get_pool()
+        deps = [self._action_dependencies(actions, i) for i in range(len(actions))]
+        results: List[Optional[ThoughtNode]] = [None] * len(actions)
+        produced: Dict[str, ThoughtNode] = {}  # 本批次内产生、尚未写入 GraphState 的节点
+        finished, failed = set(), set()
+        remaining = list(range(len(actions)))
+
+        while remaining:
+            ready = [i for i in remaining if deps[i] <= finished | failed]
+            for i in ready:
+                if deps[i] & failed:
+                    logger.warning(f"Skipping {actions[i].get('action')}: a dependency in the batch failed.")
+                    failed.add(i)
+
+            futures = {}
+            for i in ready:
+                if i in failed:
+                    continue
+                futures[i] = prefetched.get(i) or pool.submit(
+                    run_in_context(self._execute_action), actions[i], constraint_map, pending=dict(produced))
+
+            for i, future in futures.items():
+                try:
+                    node = future.result()
+                except BudgetExceeded:
+                    raise
+                except QueryCancelled:
+                    node = None
+                except Exception as e:
+                    logger.error(f"Action Execution Failed: {e}")
+                    node = None
+                results[i] = node
+                if node:
+                    # 批次内的后续动作可以用基础名称 (node_<cid>) 引用，即使实际 ID 带有去重后缀
+                    produced[node.node_id] = node
+                    base_id = self._action_output_id(actions[i])
+                    if base_id:
+                        produced[base_id] = node
+                    finished.add(i)
+                else:
+                    failed.add(i)
+
+            remaining = [i for i in remaining if i not in ready]
+        return results
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="action")
+        return self._pool
+
+    @traced("agent.beam")
+    def _execute_beam(self, constraints: List[Constraint], constraint_map: dict):
+        """
+        束搜索：以 Optimizer 排名前 beam_width 的约束分别作为 Anchor，每条路径按排序依次 FILTER 剩余约束。
+        每一轮把所有存活路径的下一步同时提交到线程池；
+        空结果的路径淘汰，被支配的路径剪枝 (另一条路径覆盖的约束更多且候选不更多)；
+        第一条施加完全部约束且仍有候选的路径胜出。超出 beam_budget 或全部路径失败时返回 None 交给 LLM。
+        """
+        usable = [c for c in constraints if c.operator != "IGNORE"]
+        if not usable:
+            return None
+        usable = self._ensure_ranked(usable)
+        # 与计划快速路径相同的门槛：只用足够有选择性的约束做种子 Anchor
+        seeds = [c for c in usable if self._anchor_gate(c)[0]][:self.beam_width]
+        if not seeds:
+            logger.info(f"[Beam] No selective anchor (best '{usable[0].property_label}' = "
+                        f"{self._anchor_gate(usable[0])[1]}). Handing over to LLM.")
+            return None
+        beam_budget = self.budget.clip_timeout(self.beam_budget) if self.budget else self.beam_budget
+        deadline = time.time() + beam_budget
+        pool = self._get_pool()
+        all_ids = {c.id for c in usable}
+        self.metrics.update({"beam_rounds": 0, "beam_pruned": 0, "beam_completed": False})
+
+        # 路径: {"node": 当前节点 (None 表示尚未 Anchor), "applied": 已施加的约束, "anchor": Anchor 约束}
+        paths = [{"node": None, "applied": set(), "anchor": c} for c in seeds]
+        # 预算耗尽时 set：仍在运行的动作在下一次 SPARQL 调用前抛出 QueryCancelled，结果也不会写入图
+        stop = threading.Event()
+
+        while paths:
+            self.metrics["beam_rounds"] += 1
+            futures = {}
+            for path in paths:
+                if path["node"] is None:
+                    action = {"action": "SEARCH_ANCHOR", "params": {"constraint_id": path["anchor"].id}}
+                else:
+                    nxt = next(c for c in usable if c.id not in path["applied"])
+                    action = {"action": "FILTER", "params": {"parent_node_id": path["node"].node_id,
+                                                             "constraint_id": nxt.id}}
+                futures[pool.submit(run_in_context(self._execute_cancellable), stop, action,
+                                    constraint_map)] = (path, action)
+
+            # 等待本轮全部完成或预算耗尽
+            done, not_done = wait(list(futures), timeout=max(deadline - time.time(), 0))
+            if not_done:
+                # 未开始的直接取消；已在运行的通过 stop 尽快结束，其结果被丢弃
+                stop.set()
+                for f in not_done:
+                    f.cancel()
+                self.metrics["beam_stragglers"] = len(not_done)
+                logger.warning(f"[Beam] Budget of {beam_budget:.1f}s exhausted after "
+                               f"{self.metrics['beam_rounds']} rounds. Handing over to LLM.")
+                return None
+
+            advanced, round_nodes = [], []
+            for future, (path, action) in futures.items():
+                try:
+                    node = future.result()
+                except BudgetExceeded:
+                    raise
+                except Exception as e:
+                    logger.error(f"[Beam] {action['action']} failed: {e}")
+                    node = None
+                if not node:
+                    continue
+                # 并行执行的动作可能取到同一个 ID，加入图之前重新分配
+                node.node_id = self.state.unique_id(node.node_id, taken={n.node_id for n in round_nodes})
+                round_nodes.append(node)
+                if node.candidates:
+                    advanced.append({"node": node, "applied": path["applied"] | {action["params"]["constraint_id"]},
+                                     "anchor": path["anchor"]})
+
+            self.state.add_nodes(round_nodes)
+            self.state.history.append(f"Step {self.metrics['plan_steps']}: [Beam] Round {self.metrics['beam_rounds']}: "
+                                      + ", ".join(f"{n.node_id}={len(n.candidates)}" for n in round_nodes))
+            self.metrics["plan_steps"] += 1
+
+            # 胜出：覆盖全部约束 (按 Anchor 排名取第一条)
+            finished = [p for p in advanced if p["applied"] >= all_ids]
+            if finished:
+                winner = finished[0]["node"]
+                self.metrics["beam_completed"] = True
+                self.state.history.append(f"Step {self.metrics['plan_steps']}: [Beam] All constraints applied. "
+                                          f"FINISH with {winner.node_id}.")
+                logger.info(f"[Beam] {winner.node_id} satisfies all constraints: {len(winner.candidates)} candidates "
+                            f"after {self.metrics['beam_rounds']} rounds.")
+                return winner.candidates
+
+            paths = self._prune_beam(advanced)
+
+        logger.info("[Beam] All paths dead-ended. Handing over to LLM.")
+        return None
+
+    def _execute_cancellable(self, stop: threading.Event, action: dict, constraint_map: dict):
+        with cancellable(stop):
+            return self._execute_action(action, constraint_map)
+
+    def _prune_beam(self, paths: List[dict]) -> List[dict]:
+        """剪掉被支配的路径：另一条路径已施加的约束是其超集，且候选数不更多"""
+        kept = []
+        for i, p in enumerate(paths):
+            dominated = any(
+                j != i and q["applied"] >= p["applied"] and len(q["node"].candidates) <= len(p["node"].candidates)
+                and (q["applied"] != p["applied"] or len(q["node"].candidates) < len(p["node"].candidates) or j < i)
+                for j, q in enumerate(paths))
+            if dominated:
+                self.metrics["beam_pruned"] += 1
+                logger.info(f"[Beam] Pruned dominated path at {p['node'].node_id}.")
+            else:
+                kept.append(p)
+        return kept[:self.beam_width]
+
+    @traced("agent.action")
+    def _execute_action(self, action, constraint_map: dict, pending: Dict[str, ThoughtNode] = None,
+                        prefetched: Dict[int, Any] = None):
+        """
+        执行单个动作并返回新节点；传入动作列表时按依赖关系批量执行，返回节点列表 (见 _execute_actions)。
+        pending: (单个动作) 同一批次中已产生但尚未写入 GraphState 的节点。
+        prefetched: (动作列表) {下标: Future}，推测执行已经在跑的动作。
+        """
+        if isinstance(action, list):
+            current_span().set(batch=len(action))
+            return self._execute_actions(action, constraint_map, prefetched)
 
-    def _execute_action(self, action: dict, constraint_map: dict):
         act_type = action.get("action")
+        current_span().set(action=act_type)
         params = action.get("params", {})
+        pending = pending or {}
+
+        def get_node(node_id):
+            node = pending.get(node_id) or self.state.get_node(node_id)
+            if node is not None and node.released:
+                # 候选集已被释放：拒绝执行，而不是当作空集继续 (那样会被误判为死路)
+                logger.warning(f"Node {node_id} was released (abandoned branch); it cannot be used as input.")
+                return None
+            return node
+
+        def new_id(base):
+            # 同名节点不再互相覆盖：已被占用时追加 _2, _3 ...
+            return self.state.unique_id(base, taken={n.node_id for n in pending.values()})
 
         try:
             if act_type == "SEARCH_ANCHOR":
                 cid = params["constraint_id"]
                 cons = constraint_map[cid]  # 注意这里变量名修正为 constraint_map 更好
                 candidates = self.tools.tool_search_anchor(cons)
-                return ThoughtNode(f"node_{cid}", f"Search {cons.property_label}", candidates, parent_ids=["root"])
+                return ThoughtNode(new_id(f"node_{cid}"), f"Search {cons.property_label}", candidates,
+                                   parent_ids=["root"], constraint_id=cid)
 
             elif act_type == "FILTER":
                 pid = params["parent_node_id"]
                 cid = params["constraint_id"]
-                parent = self.state.get_node(pid)
+                parent = get_node(pid)
                 cons = constraint_map[cid]
                 if not parent:
                     logger.error(f"Parent node {pid} not found for FILTER.")
                     return None
                 candidates = self.tools.tool_filter(parent.candidates, cons)
                 return ThoughtNode(
-                    f"node_{cid}",
+                    new_id(f"node_{cid}"),
                     f"Filter {cons.property_label}",
                     candidates,
-                    parent_ids=[pid]
+                    parent_ids=[parent.node_id],
+                    constraint_id=cid
                 )
 
             elif act_type == "RELAX_CONSTRAINT":
@@ -150,7 +828,7 @@ class GoTAgent:
                 target_constraint.value = relaxed_constraint.value
 
                 return ThoughtNode(
-                    f"relax_{cid}",
+                    new_id(f"relax_{cid}"),
                     f"Relaxed {cid} ({target_constraint.property_label}) -> {target_constraint.operator}",
                     set(),  # 这里不需要候选集，因为下一步通常是重试 Filter
                     parent_ids=[]
@@ -159,27 +837,29 @@ class GoTAgent:
             elif act_type == "INTERSECT":
                 id1 = params["node_id_1"]
                 id2 = params["node_id_2"]
-                n1 = self.state.get_node(id1)
-                n2 = self.state.get_node(id2)
+                n1 = get_node(id1)
+                n2 = get_node(id2)
 
                 if not n1 or not n2:
                     return None
 
                 candidates = self.tools.tool_intersect(n1.candidates, n2.candidates)
-                return ThoughtNode(f"merge_{id1}_{id2}", "Intersection", candidates, parent_ids=[id1, id2])
+                return ThoughtNode(new_id(f"merge_{n1.node_id}_{n2.node_id}"), "Intersection", candidates,
+                                   parent_ids=[n1.node_id, n2.node_id])
 
             # === [修复] 新增 FINISH 处理逻辑 ===
             elif act_type == "FINISH":
                 # 获取 LLM 指定的最终节点 ID
                 final_node_id = params.get("final_node_id")
-                target_node = self.state.get_node(final_node_id)
+                target_node = get_node(final_node_id)
 
                 # 如果 LLM 没传 ID 或 ID 错误，尝试使用最近的一个节点作为兜底
                 if not target_node:
                     logger.warning(f"FINISH called with invalid node_id '{final_node_id}'. Using last node.")
-                    if self.state.nodes:
-                        last_id = list(self.state.nodes.keys())[-1]
-                        target_node = self.state.nodes[last_id]
+                    if pending:
+                        target_node = list(pending.values())[-1]
+                    elif self.state.node_log:
+                        target_node = self.state.get_node(self.state.node_log[-1])
 
                 return target_node
             # ===================================
@@ -188,6 +868,8 @@ class GoTAgent:
                 logger.warning(f"Unknown action type: {act_type}")
                 return None
 
+        except (BudgetExceeded, QueryCancelled):
+            raise
         except Exception as e:
             logger.error(f"Action Execution Failed: {e}", exc_info=True)
             return None
\ No newline at end of file
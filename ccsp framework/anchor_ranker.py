@@ -0,0 +1,193 @@
+# anchor_ranker.py
+import json
+import logging
+import math
+import random
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 与 model_train/build_traindataset.py 写出的 text 字段格式对应：
+# "Constraint: {label} ({pid}) {op} '{value}'. Stats: ..."
+TRAIN_TEXT_PATTERN = re.compile(r"^Constraint: .*?\((P\d+)\) (=|>=|<=|>|<|is|contains) '(.*)'\. Stats:")
+
+FEATURE_NAMES = [
+    "log_cnt",  # 属性总三元组数 (log10)
+    "log_unique",  # 不同取值个数 (log10)
+    "cr",  # 取值多样性 unique / total
+    "log_rows_per_value",  # 平均每个取值对应的主语数 (log10)，等值约束的期望结果规模
+    "is_unknown_property",
+    "op_eq",
+    "op_range",
+    "op_contains",
+    "val_entity",  # QID 或实体标签 (训练数据中等值约束的值是标签，推理时是 QID，两者视为同一类)
+    "val_date",
+    "val_number",
+]
+
+
+def parse_training_text(text: str) -> Optional[Tuple[str, str, str]]:
+    """从 train_data_pointwise.jsonl 的 text 字段解析 (pid, operator, value)"""
+    m = TRAIN_TEXT_PATTERN.match(text)
+    if not m:
+        return None
+    pid, op, value = m.groups()
+    return pid, ("=" if op == "is" else op), value
+
+
+def property_counts(meta: Dict) -> Tuple[float, float, float]:
+    """
+    统一两种元数据格式，返回 (total, unique, cr)：
+    download_wiki2.py (训练用) 写 cnt / cr / stats，download_Wiki.py (推理用) 只写 stats 和 CR。
+    """
+    stats = meta.get("stats") or {}
+    cnt = float(stats.get("total") or meta.get("cnt") or 0)
+    unique = float(stats.get("unique") or 0)
+    cr = meta.get("cr", meta.get("CR"))
+    cr = float(cr) if cr is not None else (unique / cnt if cnt else 0.0)
+    return cnt, unique, cr
+
+
+def prepare_properties(properties: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    训练与推理共用的属性表：只保留 Pxxx (去掉空 PID 等非属性谓词的汇总行)。
+    属性表非空但没有任何可用计数时抛出 ValueError，避免计数特征全部为 0 的模型静默上线。
+    """
+    usable = {pid: meta for pid, meta in properties.items() if re.match(r'^P\d+$', str(pid))}
+    if usable and not any(property_counts(meta)[0] for meta in usable.values()):
+        raise ValueError("Property metadata has no stats.total / cnt counts; anchor ranker features would be zero.")
+    return usable
+
+
+def extract_features(pid: str, operator: str, value, properties: Dict[str, Dict]) -> List[float]:
+    """只依赖离线属性统计和约束本身，推理时不需要任何在线请求；properties 应先经过 prepare_properties"""
+    meta = properties.get(pid) or {}
+    cnt, unique, cr = property_counts(meta)
+
+    val_str = str(value).strip()
+    is_date = bool(re.match(r'^-?\d{4}(-\d{2}-\d{2}.*)?$', val_str))
+    is_number = not is_date and bool(re.match(r'^-?\d+(\.\d+)?$', val_str))
+
+    return [
+        math.log10(cnt + 1),
+        math.log10(unique + 1),
+        cr,
+        math.log10(cnt / unique + 1) if unique else 0.0,
+        0.0 if meta else 1.0,
+        1.0 if operator == "=" else 0.0,
+        1.0 if operator in (">", "<", ">=", "<=") else 0.0,
+        1.0 if operator == "contains" else 0.0,
+        1.0 if not is_date and not is_number else 0.0,
+        1.0 if is_date else 0.0,
+        1.0 if is_number else 0.0,
+    ]
+
+
+class AnchorRanker:
+    """
+    轻量的 CPU 锚点打分模型 (标准化特征上的逻辑回归)。
+    score() 返回约束作为好锚点 (结果数在 [1, 1000] 之间) 的概率，纯 Python 计算，单次只需几微秒。
+    """
+
+    def __init__(self, weights: List[float], bias: float, mean: List[float], std: List[float],
+                 properties: Optional[Dict[str, Dict]] = None, threshold: float = 0.5,
+                 feature_names: Sequence[str] = FEATURE_NAMES):
+        if len(weights) != len(feature_names):
+            raise ValueError(f"Expected {len(feature_names)} weights, got {len(weights)}.")
+        self.weights = weights
+        self.bias = bias
+        self.mean = mean
+        self.std = std
+        self.properties = prepare_properties(properties or {})
+        self.threshold = threshold
+        self.feature_names = list(feature_names)
+
+    def _logit(self, features: List[float]) -> float:
+        z = self.bias
+        for w, x, m, s in zip(self.weights, features, self.mean, self.std):
+            z += w * (x - m) / s
+        return z
+
+    def score_features(self, features: List[float]) -> float:
+        z = self._logit(features)
+        # 数值稳定的 sigmoid
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        e = math.exp(z)
+        return e / (1.0 + e)
+
+    def score(self, constraint) -> float:
+        if constraint.operator == "IGNORE":
+            return 0.0
+        return self.score_features(
+            extract_features(constraint.property_id, constraint.operator, constraint.value, self.properties))
+
+    def rank(self, constraints: List) -> List[Tuple[object, float]]:
+        """按好锚点概率从高到低排序"""
+        scored = [(c, self.score(c)) for c in constraints]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored
+
+    # --- 训练 ---
+    @classmethod
+    def train(cls, samples: List[Tuple[List[float], float]], properties: Optional[Dict[str, Dict]] = None,
+              epochs: int = 300, lr: float = 0.1, l2: float = 1e-3, seed: int = 13) -> "AnchorRanker":
+        """
+        samples: [(特征, 标签 0/1)]。全批量梯度下降，正负样本按频率反向加权 (好锚点是少数类)。
+        """
+        if not samples:
+            raise ValueError("No training samples.")
+        if all(x[FEATURE_NAMES.index("log_cnt")] == 0 for x, _ in samples):
+            raise ValueError("log_cnt is zero for every sample; check that the metadata has property counts.")
+        n_feat = len(samples[0][0])
+        n = len(samples)
+        mean = [sum(x[i] for x, _ in samples) / n for i in range(n_feat)]
+        std = []
+        for i in range(n_feat):
+            var = sum((x[i] - mean[i]) ** 2 for x, _ in samples) / n
+            std.append(math.sqrt(var) or 1.0)
+        data = [([(x[i] - mean[i]) / std[i] for i in range(n_feat)], y) for x, y in samples]
+
+        n_pos = sum(1 for _, y in data if y >= 0.5)
+        w_pos = n / (2.0 * n_pos) if n_pos else 1.0
+        w_neg = n / (2.0 * (n - n_pos)) if n - n_pos else 1.0
+
+        rng = random.Random(seed)
+        weights = [rng.uniform(-0.01, 0.01) for _ in range(n_feat)]
+        bias = 0.0
+        for _ in range(epochs):
+            grad_w = [0.0] * n_feat
+            grad_b = 0.0
+            for x, y in data:
+                z = bias + sum(w * v for w, v in zip(weights, x))
+                p = 1.0 / (1.0 + math.exp(-max(min(z, 30.0), -30.0)))
+                err = (p - y) * (w_pos if y >= 0.5 else w_neg)
+                for i in range(n_feat):
+                    grad_w[i] += err * x[i]
+                grad_b += err
+            weights = [w - lr * (g / n + l2 * w) for w, g in zip(weights, grad_w)]
+            bias -= lr * grad_b / n
+
+        return cls(weights, bias, mean, std, properties=properties)
+
+    # --- 持久化 ---
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "feature_names": self.feature_names,
+                "weights": self.weights,
+                "bias": self.bias,
+                "mean": self.mean,
+                "std": self.std,
+                "threshold": self.threshold,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, properties: Optional[Dict[str, Dict]] = None) -> "AnchorRanker":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("feature_names") != FEATURE_NAMES:
+            raise ValueError(f"{path} was trained with a different feature set.")
+        return cls(data["weights"], data["bias"], data["mean"], data["std"], properties=properties,
+                   threshold=data.get("threshold", 0.5))
@@ -0,0 +1,96 @@
+import json
+import os
+import re
+import sys
+import time
+
+from fast_parser import FastPathParser
+
+# ================= 配置区域 =================
+# 默认读仓库 datasets/ 下的改写问题集，也可以用第一个命令行参数指定
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets",
+                            "complex_constraint_dataset_rewrite_queries.json")
+# ===========================================
+
+# constraint_logic 形如 "(P577 < 1981.25) AND (P31 is 'written work')"
+GOLD_PATTERN = re.compile(r"\((P\d+) (is|<|>|=) (?:'([^']*)'|([-\d.]+))\)")
+
+
+def parse_gold(logic):
+    gold = []
+    for pid, op, text_val, num_val in GOLD_PATTERN.findall(logic):
+        gold.append((pid, "=" if op == "is" else op, text_val or num_val))
+    return gold
+
+
+def value_matches(pred, gold):
+    try:
+        p, g = float(pred), float(gold)
+        # 年份在数据集中是小数年份 (1981.25)，问题里只写整数年份
+        return abs(p - g) <= max(abs(g) * 0.01, 1.0)
+    except ValueError:
+        return pred.strip().lower() == gold.strip().lower()
+
+
+def implicit(item, entry, gold):
+    """
+    constraint_logic 不包含问题的隐含约束：答案类型 (P31，除非 gold 本身有 P31) 和种子问题里的主题实体
+    ('what movies does taylor lautner play in?' 中的 Taylor Lautner)。这类预测单独计数，不算作误报。
+    """
+    if item["property_id"] == "P31":
+        return not any(g[0] == "P31" for g in gold)
+    return str(item["value"]).lower() in entry.get("original_question", "").lower()
+
+
+def main():
+    dataset_path = sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        dataset = json.load(f)
+
+    parser = FastPathParser()
+    latencies = []
+    covered = tp = n_pred = n_gold = value_ok = n_implicit = 0
+    per_pid_hits = {}
+
+    for entry in dataset:
+        start = time.perf_counter()
+        items = parser.parse(entry["complex_question"])
+        latencies.append(time.perf_counter() - start)
+        if items is None:
+            continue
+        covered += 1
+
+        gold = parse_gold(entry.get("constraint_logic", ""))
+        n_gold += len(gold)
+        remaining = list(gold)
+        for item in items:
+            n_pred += 1
+            for g in remaining:
+                if (item["property_id"], item["operator"]) == g[:2]:
+                    tp += 1
+                    value_ok += int(value_matches(str(item["value"]), g[2]))
+                    per_pid_hits[g[0]] = per_pid_hits.get(g[0], 0) + 1
+                    remaining.remove(g)
+                    break
+            else:
+                if implicit(item, entry, gold):
+                    n_pred -= 1
+                    n_implicit += 1
+
+    latencies.sort()
+    total = len(dataset)
+    print(f"Questions: {total}")
+    print(f"Fast-path coverage: {covered}/{total} ({covered / total:.1%}); the rest fall back to the LLM")
+    print(f"Latency: mean {sum(latencies) / total * 1e6:.1f} µs, p50 {latencies[total // 2] * 1e6:.1f} µs, "
+          f"p99 {latencies[int(total * 0.99)] * 1e6:.1f} µs")
+    if covered:
+        print(f"On covered questions vs constraint_logic (property + operator):")
+        print(f"   precision {tp / max(n_pred, 1):.3f}, recall {tp / max(n_gold, 1):.3f}, "
+              f"value agreement {value_ok / max(tp, 1):.3f}")
+        print(f"   implicit constraints not in constraint_logic (answer type, seed entity): {n_implicit}")
+        print("   matched constraints by property: " +
+              ", ".join(f"{pid}={n}" for pid, n in sorted(per_pid_hits.items(), key=lambda x: -x[1])))
+
+
+if __name__ == "__main__":
+    main()
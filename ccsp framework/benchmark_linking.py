@@ -0,0 +1,74 @@
+import json
+import os
+import re
+import time
+
+from entity_linker import EntityLinker
+from wikidata_service import WikidataService
+
+# ================= 配置区域 =================
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets",
+                            "complex_constraint_dataset_rewrite_queries.json")
+ENTITY_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "entity_index.sqlite")
+# 在线 API 对照只取前 N 个实体字符串，避免被限流
+LIVE_LIMIT = 200
+LIVE_INTERVAL = 0.2  # 在线请求之间的间隔 (秒)
+# ===========================================
+
+# constraint_logic 中的实体约束形如 "(P31 is 'written work')"
+ENTITY_PATTERN = re.compile(r"\(P\d+ is '([^']+)'\)")
+
+
+def load_entity_strings(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        dataset = json.load(f)
+    strings = []
+    for entry in dataset:
+        strings.extend(ENTITY_PATTERN.findall(entry.get("constraint_logic", "")))
+    return list(dict.fromkeys(strings))
+
+
+def time_calls(fn, items, interval=0.0):
+    results, latencies = {}, []
+    for text in items:
+        start = time.perf_counter()
+        results[text] = fn(text)
+        latencies.append(time.perf_counter() - start)
+        if interval:
+            time.sleep(interval)
+    return results, latencies
+
+
+def report(name, results, latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    linked = sum(1 for v in results.values() if v)
+    print(f"[{name}] {len(results)} strings, linked {linked} ({linked / max(len(results), 1):.1%})")
+    print(f"   mean {total / len(latencies) * 1e3:.3f} ms, p50 {latencies[len(latencies) // 2] * 1e3:.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.3f} ms, {len(latencies) / total:.0f} QPS")
+
+
+def main():
+    strings = load_entity_strings(DATASET_PATH)
+    print(f"Loaded {len(strings)} distinct entity strings from {DATASET_PATH}")
+
+    linker = EntityLinker(ENTITY_INDEX_PATH)
+    offline, offline_lat = time_calls(linker.link, strings)
+    report("Offline", offline, offline_lat)
+
+    # 在线对照：未启用离线索引的 WikidataService，即原来的 wbsearchentities Top-1
+    sample = strings[:LIVE_LIMIT]
+    live, live_lat = time_calls(WikidataService().search_entity, sample, LIVE_INTERVAL)
+    report("Live API", live, live_lat)
+
+    both = [s for s in sample if live[s] and offline[s]]
+    agree = sum(1 for s in both if live[s] == offline[s])
+    print(f"Agreement with live API: {agree}/{len(both)} ({agree / max(len(both), 1):.1%}) "
+          f"on strings linked by both")
+    for s in both:
+        if live[s] != offline[s]:
+            print(f"   '{s}': offline={offline[s]} live={live[s]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+import zlib
+
+from budget import record_llm_usage
+from optimizer import ConstraintOptimizer
+from solver_server import SolverService, _percentile
+from wikidata_service import WikidataService
+
+# ================= 配置区域 =================
+REQUESTS = 64
+CONCURRENCY = 16
+LLM_LATENCY = 0.2  # 替身 LLM 每次调用的延迟 (秒)
+SPARQL_LATENCY = 0.05  # 替身 Wikidata 每次请求的延迟 (秒)
+QUERY_TEMPLATE = "Which film starring Actor {i} was released after {year}?"
+# ===========================================
+
+# 替身 LLM 在用量里写入的 prompt_tokens = 请求编号 * USAGE_STRIDE + 步数，用来核对每个响应拿到的是自己的用量
+USAGE_STRIDE = 1000
+QUERY_RE = re.compile(r"Actor (\d+) was released after (\d{4})")
+
+
+class StandInLLM:
+    """
+    LLM 替身：按问题文本确定性地返回解析结果与动作 (一步批量完成 SEARCH_ANCHOR -> FILTER -> FINISH)，
+    并按请求编号记录 token 用量。同时提供同步与流式接口，可用于 streaming=True / False 两种 Agent。
+    """
+
+    def __init__(self, latency: float = LLM_LATENCY):
+        self.latency = latency
+
+    @staticmethod
+    def _request_no(text: str) -> int:
+        m = QUERY_RE.search(text)
+        return int(m.group(1)) if m else 0
+
+    def _parse(self, prompt: str):
+        m = QUERY_RE.search(prompt)
+        if not m:
+            return {"constraints": []}
+        return {"constraints": [
+            {"property_label": "cast member", "operator": "=", "value": f"Actor {m.group(1)}", "unit": None},
+            {"property_label": "publication date", "operator": ">", "value": f"{m.group(2)}-12-31", "unit": None},
+        ]}
+
+    def _decide(self, messages):
+        text = "\n".join(m["content"] for m in messages)
+        step = sum(1 for m in messages if m.get("role") == "assistant") + 1
+        record_llm_usage(prompt_tokens=self._request_no(text) * USAGE_STRIDE + step, completion_tokens=step)
+        return {"actions": [
+            {"action": "SEARCH_ANCHOR", "params": {"constraint_id": "c1"}},
+            {"action": "FILTER", "params": {"parent_node_id": "node_c1", "constraint_id": "c2"}},
+            {"action": "FINISH", "params": {"final_node_id": "node_c2"}},
+        ], "reasoning": "stand-in"}
+
+    def generate_json(self, prompt: str):
+        time.sleep(self.latency)
+        if "Semantic Parser" in prompt:
+            record_llm_usage()
+            return self._parse(prompt)
+        return self._decide([{"role": "user", "content": prompt}])
+
+    def chat_json(self, messages):
+        time.sleep(self.latency)
+        return self._decide(messages)
+
+    async def achat_json(self, messages, on_fields=None, early_fields=None, timeout=None):
+        await asyncio.sleep(self.latency / 2)
+        data = self._decide(messages)
+        if on_fields:
+            on_fields(data)
+        await asyncio.sleep(self.latency / 2)
+        return data
+
+    def generate_text(self, prompt: str) -> str:
+        return "stand-in report"
+
+    async def aclose(self):
+        pass
+
+
+class StandInWikidata(WikidataService):
+    """Wikidata 替身：所有网络请求换成固定延迟 + 确定性结果，探测、链接与过滤逻辑本身照常执行"""
+
+    def __init__(self, latency: float = SPARQL_LATENCY):
+        super().__init__()
+        self.latency = latency
+
+    def _search_wikidata(self, label: str, type_filter: str) -> str:
+        time.sleep(self.latency)
+        if type_filter == "property":
+            return {"cast member": "P161", "publication date": "P577"}.get(label)
+        return f"Q{zlib.crc32(label.encode()) % 10_000_000}"
+
+    def _search_wikidata_api(self, query: str, type_filter: str) -> str:
+        return self._search_wikidata(query, type_filter)
+
+    def execute_sparql(self, query: str, retries=3):
+        time.sleep(self.latency)
+        listed = re.findall(r"wd:(Q\d+)", query.split("VALUES", 1)[1]) if "VALUES" in query else []
+        # 过滤查询保留输入的一半；锚点查询返回一组固定候选
+        qids = listed[::2] if listed else [f"Q{zlib.crc32(query.encode()) % 1000 * 100 + i}" for i in range(40)]
+        return [{"item": {"value": f"http://www.wikidata.org/entity/{q}"}} for q in qids]
+
+    def probe_query_count(self, query: str, timeout_sec=2.0) -> int:
+        time.sleep(self.latency)
+        return 40
+
+    def probe_bounded_count(self, query: str, timeout_sec=1.0) -> int:
+        return self.probe_query_count(query, timeout_sec)
+
+    def probe_tagged_counts(self, query: str, timeout_sec=2.0):
+        time.sleep(self.latency)
+        return {tag: 40 for tag in re.findall(r'"(c\d+)"', query)}
+
+    def get_cardinality(self, query: str, timeout_sec=0.5) -> int:
+        return self.probe_query_count(query, timeout_sec)
+
+
+class StandInLabels:
+    fetched = 0
+
+    def get_labels(self, qids):
+        return {q: q for q in qids}
+
+    def save(self):
+        pass
+
+
+async def _post(port: int, query: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"query": query}).encode("utf-8")
+    writer.write(f"POST /solve HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                 + body)
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+async def run(args):
+    wiki = StandInWikidata(args.sparql_latency)
+    service = SolverService(StandInLLM(args.llm_latency), wiki, ConstraintOptimizer(wiki),
+                            label_service=StandInLabels(), max_concurrent=args.concurrency,
+                            agent_options={"streaming": not args.no_streaming})
+    server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        query = QUERY_TEMPLATE.format(i=i + 1, year=2000 + i % 20)
+        async with gate:
+            start = time.perf_counter()
+            status, payload = await _post(port, query)
+            return i + 1, status, payload, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one(i) for i in range(args.requests)])
+    wall = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    service.close()
+
+    failed = [r for r in results if r[1] != 200]
+    # 每个响应的逐步用量必须来自它自己的 LLM 调用，而不是同时在跑的其他请求
+    mixed = [no for no, status, payload, _ in results if status == 200 and any(
+        step["prompt_tokens"] // USAGE_STRIDE != no for step in payload.get("llm_steps", []))]
+    latencies = [r[3] * 1e3 for r in results]
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"{'streaming' if not args.no_streaming else 'non-streaming'} agent: "
+          f"{wall:.2f}s wall, {args.requests / wall:.1f} req/s")
+    print(f"   latency ms  p50 {_percentile(latencies, 0.5)}  p95 {_percentile(latencies, 0.95)}  "
+          f"p99 {_percentile(latencies, 0.99)}  mean {statistics.mean(latencies):.1f}")
+    print(f"   failed: {len(failed)}, responses with another request's LLM usage: {len(mixed)}")
+    for no, status, payload, _ in failed[:3]:
+        print(f"   request {no}: HTTP {status} {payload.get('error')}")
+    return 1 if failed or mixed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent /solve load against the solver server with stand-in LLM and Wikidata endpoints")
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY)
+    parser.add_argument("--sparql-latency", type=float, default=SPARQL_LATENCY)
+    parser.add_argument("--no-streaming", action="store_true", help="use the agent's synchronous LLM path")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# ================= 配置区域 =================
+QUERY = "Which comedy film starring Taylor Lautner was released after 2009 and has a runtime of less than 122.5 minutes?"
+RUNS = 5
+TOP_IMPORTS = 15
+# ===========================================
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 在全新的解释器中执行：分别计时 import main -> init_services -> 第一个查询，结果以 JSON 打印到 stdout
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+llm, wiki, optimizer = main.init_services()
+t2 = time.perf_counter()
+constraints = main.parse_query_to_constraints(QUERY, llm, wiki, fast_parser=main.FastPathParser() if FAST else None)
+constraints = main.UnitNormalizer().normalize(constraints)
+if FULL:
+    from agent_brain import GoTAgent
+    constraints = optimizer.optimize(constraints)
+    agent = GoTAgent(llm, main.GraphEnvironment(wiki), main.StatisticalCritic(optimizer))
+    agent.solve(QUERY, constraints)
+t3 = time.perf_counter()
+heavy = [m for m in ("openai", "requests", "SPARQLWrapper", "numpy", "pandas") if m in sys.modules]
+print("__STARTUP__" + json.dumps({"import": t1 - t0, "init": t2 - t1, "first_query": t3 - t2,
+                                  "constraints": len(constraints), "heavy_modules": heavy}))
+"""
+
+
+def run_once(full: bool, fast: bool):
+    code = f"QUERY = {QUERY!r}\nFULL = {full!r}\nFAST = {fast!r}\n" + CHILD
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    line = next((l for l in proc.stdout.splitlines() if l.startswith("__STARTUP__")), None)
+    if line is None:
+        raise RuntimeError(f"Child process failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(line[len("__STARTUP__"):])
+    result["wall"] = wall
+    return result
+
+
+def top_imports(limit):
+    """python -X importtime 的累计耗时 (微秒) 最高的模块"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=HERE,
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.*)$", line)
+        if m:
+            rows.append((int(m.group(2)), m.group(3).rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start to first query in fresh interpreters")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--full", action="store_true",
+                        help="also run optimize + agent (needs LLM and Wikidata access)")
+    parser.add_argument("--fast-parser", action="store_true",
+                        help="parse with the rule-based fast path (off by default, as in main/evaluate/server)")
+    args = parser.parse_args()
+
+    runs = [run_once(args.full, args.fast_parser) for _ in range(args.runs)]
+    print(f"Cold start over {args.runs} fresh interpreters ({'full solve' if args.full else 'parse only'}):")
+    for phase in ("import", "init", "first_query", "wall"):
+        values = sorted(r[phase] for r in runs)
+        print(f"   {phase:<12} median {statistics.median(values) * 1e3:8.1f} ms, "
+              f"min {values[0] * 1e3:8.1f} ms, max {values[-1] * 1e3:8.1f} ms")
+    print(f"   heavy modules loaded by the first query: {runs[-1]['heavy_modules'] or 'none'}")
+
+    print(f"\nSlowest imports for 'import main' (cumulative):")
+    for cumulative, name in top_imports(TOP_IMPORTS):
+        print(f"   {cumulative / 1e3:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# budget.py
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class BudgetExceeded(Exception):
+    """单个查询的时间 / SPARQL 次数 / LLM token 预算已用完"""
+
+
+class QueryBudget:
+    """
+    单个查询的成本预算：墙钟截止时间、SPARQL 调用次数上限、LLM token 上限 (均可为 None 表示不限)。
+    - charge_* 记账，超出上限时抛出 BudgetExceeded (请求不会发出)。
+    - is_short() 表示任一维度剩余不足 low_water 比例，调用方应主动降级 (停止探测、用最佳节点结束)。
+    计数在多个工作线程之间共享，操作加锁。
+    """
+
+    def __init__(self, deadline_sec: Optional[float] = None, max_sparql_calls: Optional[int] = None,
+                 max_llm_tokens: Optional[int] = None, low_water: float = 0.1):
+        self.start_time = time.time()
+        self.deadline_sec = deadline_sec
+        self.deadline = self.start_time + deadline_sec if deadline_sec is not None else None
+        self.max_sparql_calls = max_sparql_calls
+        self.max_llm_tokens = max_llm_tokens
+        self.low_water = low_water
+        self.sparql_calls = 0
+        self.llm_tokens = 0
+        self._lock = threading.Lock()
+
+    # --- 时间 ---
+    def time_left(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def clip_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        """把单次请求的超时截断到剩余时间以内"""
+        left = self.time_left()
+        if left is None:
+            return timeout
+        return left if timeout is None else min(timeout, left)
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    # --- 记账 ---
+    def charge_sparql(self, calls: int = 1):
+        with self._lock:
+            if self.expired():
+                raise BudgetExceeded("deadline reached")
+            if self.max_sparql_calls is not None and self.sparql_calls + calls > self.max_sparql_calls:
+                raise BudgetExceeded(f"SPARQL call budget ({self.max_sparql_calls}) exhausted")
+            self.sparql_calls += calls
+
+    def check_llm(self):
+        """LLM 调用前检查：token 已用完或已超时则不再调用"""
+        if self.expired():
+            raise BudgetExceeded("deadline reached")
+        if self.max_llm_tokens is not None and self.llm_tokens >= self.max_llm_tokens:
+            raise BudgetExceeded(f"LLM token budget ({self.max_llm_tokens}) exhausted")
+
+    def charge_tokens(self, tokens: int):
+        with self._lock:
+            self.llm_tokens += tokens or 0
+
+    # --- 降级判断 ---
+    def is_short(self) -> bool:
+        if self.expired():
+            return True
+        if self.deadline_sec and self.time_left() < self.deadline_sec * self.low_water:
+            return True
+        if self.max_sparql_calls is not None and \
+                self.max_sparql_calls - self.sparql_calls <= self.max_sparql_calls * self.low_water:
+            return True
+        if self.max_llm_tokens is not None and \
+                self.max_llm_tokens - self.llm_tokens <= self.max_llm_tokens * self.low_water:
+            return True
+        return False
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "elapsed": round(time.time() - self.start_time, 3),
+            "sparql_calls": self.sparql_calls,
+            "llm_tokens": self.llm_tokens,
+        }
+
+
+# === 当前查询的预算：通过 contextvars 传递，跨线程时由调用方复制上下文 (见 run_in_context) ===
+_current_budget: contextvars.ContextVar = contextvars.ContextVar("query_budget", default=None)
+
+
+def current_budget() -> Optional[QueryBudget]:
+    return _current_budget.get()
+
+
+@contextmanager
+def budget_scope(budget: Optional[QueryBudget]):
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def run_in_context(fn):
+    """把 fn 绑定到调用方的上下文 (含当前预算)，用于提交到线程池"""
+    ctx = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+# === 当前作用域的 LLM 用量：收集器是可变 dict，随上下文复制传给线程池任务和子任务，那里记的账调用方同样可见 ===
+_current_usage: contextvars.ContextVar = contextvars.ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def usage_scope():
+    """收集作用域内所有 LLM 调用的 token 用量与延迟；并发的请求各用各的收集器，不会互相覆盖"""
+    usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "latency": 0.0}
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def record_llm_usage(prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0,
+                     latency: float = 0.0):
+    """把一次 LLM 调用记到当前的 usage_scope (不在作用域内时忽略)"""
+    usage = _current_usage.get()
+    if usage is None:
+        return
+    usage["calls"] += 1
+    usage["prompt_tokens"] += prompt_tokens
+    usage["completion_tokens"] += completion_tokens
+    usage["cached_tokens"] += cached_tokens
+    usage["latency"] += latency
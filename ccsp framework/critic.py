@@ -10,14 +10,22 @@ class StatisticalCritic:
         [Refactored] 基于探测到的真实行数生成建议
         """
         # 确保已经探测过
-        if constraints and constraints[0].estimated_rows == -1:
+        if constraints and constraints[0].estimated_rows == -1 and constraints[0].anchor_score is None:
              constraints = self.optimizer.optimize(constraints)
 
         advice = "Dynamic Probing Analysis:\n"
 
         # 1. 最佳切入点
         best = constraints[0]
-        if best.estimated_rows < 1000:
+        if best.estimated_rows == -1 and best.anchor_score is not None:
+            # 未探测，由本地锚点模型打分
+            if best.anchor_score >= self.optimizer.ranker.threshold:
+                advice += f"  1. [MODEL ANCHOR] '{best.property_label}' is predicted to be a selective anchor (p={best.anchor_score:.2f}).\n"
+            else:
+                advice += f"  1. [CAUTION] No confident anchor. Best model score is '{best.property_label}' (p={best.anchor_score:.2f}).\n"
+        elif best.rows_lower_bound:
+            advice += f"  1. [UNCERTAIN ANCHOR] '{best.property_label}' yields at least {best.estimated_rows} results (probe stopped early).\n"
+        elif best.estimated_rows < 1000:
             advice += f"  1. [STRONG ANCHOR] '{best.property_label}' is excellent. It yields only {best.estimated_rows} results.\n"
         elif best.estimated_rows < 10000:
             advice += f"  1. [ACCEPTABLE ANCHOR] '{best.property_label}' yields {best.estimated_rows} results. Use it if no better option.\n"
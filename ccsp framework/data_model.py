@@ -1,3 +1,4 @@
+import re
 from dataclasses import dataclass, field
 from typing import Optional, Dict, Any
 
@@ -17,13 +18,37 @@ class Constraint:
     # === [NEW] 动态探测结果 ===
     # -1 表示未探测，999999999 表示超时/代价无穷大
     estimated_rows: int = -1
+    # True 表示 estimated_rows 只是下界 (渐进式探测因已有更小的锚点而提前终止)，实际行数可能远大于它
+    rows_lower_bound: bool = False
 
     # 最终排序分 (基于 estimated_rows 计算)
     priority_score: float = 0.0
 
+    # 锚点模型给出的"好锚点"概率；None 表示没有用模型打分 (行数来自探测或本地统计)
+    anchor_score: Optional[float] = None
+
+    def signature(self) -> str:
+        """
+        约束的规范签名 (pid|operator|value[|unit])，用于跨查询共享探测结果。
+        只做不改变查询语义的归一化：年份 "2009" 与数值 "2009.0" 生成的 SPARQL 不同，因此不合并。
+        数值约束带上换算后的单位 QID，单位表变化后旧的探测结果不会被误用。
+        """
+        val_str = str(self.value).strip()
+        if re.match(r'^[qQ]\d+$', val_str):
+            val_str = val_str.upper()
+        elif re.match(r'^-?\d+$', val_str):
+            val_str = str(int(val_str)) if len(val_str.lstrip('-')) != 4 else val_str
+        elif re.match(r'^-?\d*\.\d+$', val_str):
+            val_str = repr(float(val_str))
+        elif self.operator == "contains":
+            val_str = val_str.lower()
+        signature = f"{self.property_id}|{self.operator}|{val_str}"
+        return f"{signature}|{self.unit}" if self.unit else signature
+
     def __repr__(self):
+        rows = f">={self.estimated_rows}" if self.rows_lower_bound else str(self.estimated_rows)
         return (f"<Constraint {self.property_label} {self.operator} {self.value} | "
-                f"Rows={self.estimated_rows}, Score={self.priority_score:.3f}>")
+                f"Rows={rows}, Score={self.priority_score:.3f}>")
 
 
 @dataclass
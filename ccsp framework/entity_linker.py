@@ -0,0 +1,158 @@
+# entity_linker.py
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE names (name TEXT NOT NULL, qid INTEGER NOT NULL, is_label INTEGER NOT NULL, popularity INTEGER NOT NULL);
+CREATE VIRTUAL TABLE names_fts USING fts5(name, content='names', content_rowid='rowid', tokenize='trigram', detail='none');
+CREATE VIRTUAL TABLE names_vocab USING fts5vocab(names_fts, 'row');
+"""
+
+
+def normalize_entity(text: str) -> str:
+    """大小写折叠、去重音、非字母数字转空格：'Beyoncé Knowles' -> 'beyonce knowles'"""
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)} or {text}
+
+
+class EntityLinker:
+    """
+    离线 Entity Linker：基于 truthy dump 英文 Label / 别名的 SQLite 索引 (download_Wiki.py 生成)。
+    - 规范化名称完全匹配走 B-Tree 索引，同名时 Label 优先，再按实体流行度 (被引用次数) 排序；
+    - 否则取查询中最稀有的几个 trigram，在 FTS5 倒排索引中投票召回候选，
+      按 trigram Dice 相似度重排，得分不低于 min_score 才采纳。
+    连接按线程各自打开 (只读)，可在线程池中并发使用。
+    """
+
+    def __init__(self, path: str, min_score: float = 0.8, max_candidates: int = 50, max_terms: int = 6,
+                 max_postings: int = 5000):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.max_terms = max_terms
+        self.max_postings = max_postings
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def search(self, text: str, top_k: int = 5) -> List[Tuple[str, float]]:
+        """返回 [(QID, 相似度)]，完全匹配的相似度为 1.0"""
+        query = normalize_entity(text)
+        if not query:
+            return []
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT qid FROM names WHERE name = ? ORDER BY is_label DESC, popularity DESC LIMIT ?",
+            (query, top_k)).fetchall()
+        if rows:
+            return [(f"Q{qid}", 1.0) for qid, in rows]
+        if len(query) < 3:
+            return []
+
+        # 模糊匹配 (n-gram 版近似近邻)：按文档频率挑最稀有的 max_terms 个 trigram，
+        # 每个 trigram 的倒排表各取至多 max_postings 条，按命中 trigram 数投票，只对得票最多的候选精排
+        query_grams = trigrams(query)
+        placeholders = ",".join("?" * len(query_grams))
+        df = dict(conn.execute(f"SELECT term, doc FROM names_vocab WHERE term IN ({placeholders})",
+                               list(query_grams)).fetchall())
+        terms = sorted((g for g in query_grams if g in df), key=df.get)[:self.max_terms]
+        votes = Counter()
+        try:
+            for g in terms:
+                phrase = '"' + g.replace('"', '""') + '"'
+                votes.update(rowid for rowid, in conn.execute(
+                    "SELECT rowid FROM names_fts WHERE names_fts MATCH ? LIMIT ?", (phrase, self.max_postings)))
+        except sqlite3.OperationalError as e:
+            logger.warning(f"[EntityLinker] Fuzzy search failed for '{text}': {e}")
+            return []
+        rowids = [rowid for rowid, _ in votes.most_common(self.max_candidates)]
+        if not rowids:
+            return []
+        candidates = conn.execute(
+            f"SELECT name, qid, is_label, popularity FROM names WHERE rowid IN ({','.join('?' * len(rowids))})",
+            rowids).fetchall()
+
+        best = {}
+        for name, qid, is_label, popularity in candidates:
+            name_grams = trigrams(name)
+            sim = 2 * len(query_grams & name_grams) / (len(query_grams) + len(name_grams))
+            key = (round(sim, 6), is_label, popularity)
+            if qid not in best or key > best[qid]:
+                best[qid] = key
+        ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        return [(f"Q{qid}", key[0]) for qid, key in ranked]
+
+    def link(self, text: str) -> Optional[str]:
+        """得分达到 min_score 时返回 QID，否则返回 None (调用方应回退到在线搜索)"""
+        results = self.search(text, top_k=1)
+        if results and results[0][1] >= self.min_score:
+            return results[0][0]
+        return None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- 构建 ---
+    @staticmethod
+    def build(path: str, rows: Iterable[Tuple[int, str, int, int]], batch_size: int = 200_000) -> int:
+        """
+        rows: (QID 数字部分, 英文名称, 是否为 Label, 流行度)。名称在写入前规范化并去重，
+        按 (QID, is_label DESC) 排序输入时，同一实体规范化后与 Label 重名的别名只保留 Label。
+        返回写入的名称数。
+        """
+        start = time.time()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + SCHEMA)
+
+        total = 0
+        batch, seen = [], set()
+        for qid, name, is_label, popularity in rows:
+            name = normalize_entity(name)
+            if not name or (qid, name) in seen:
+                continue
+            seen.add((qid, name))
+            batch.append((name, qid, int(is_label), int(popularity)))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO names VALUES (?, ?, ?, ?)", batch)
+                total += len(batch)
+                batch, seen = [], set()
+        if batch:
+            conn.executemany("INSERT INTO names VALUES (?, ?, ?, ?)", batch)
+            total += len(batch)
+
+        conn.execute("CREATE INDEX names_name ON names(name, is_label, popularity)")
+        conn.execute("INSERT INTO names_fts(names_fts) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        os.replace(tmp_path, path)
+        logger.info(f"[EntityLinker] Built {path} with {total} names in {time.time() - start:.1f}s "
+                    f"({os.path.getsize(path) / 2 ** 20:.1f} MiB).")
+        return total
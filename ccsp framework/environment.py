@@ -1,14 +1,19 @@
 # environment.py
 import re
 import copy
+import hashlib
 from typing import Set, Dict, List
 import logging
-from wikidata_service import WikidataService
+from wikidata_service import WikidataService, QueryCancelled
+from budget import BudgetExceeded
 from data_model import Constraint
-import math  # <--- 新增
 import re
 import copy
 from graph_state import GraphState, ThoughtNode
+from persistent_cache import JsonFileStore
+from tracing import traced, current_span
+from log_pipeline import log_event
+from unit_utils import PROPERTY_UNITS, quantity_triple
 
 logger = logging.getLogger(__name__)
 
@@ -19,19 +24,50 @@ class GraphEnvironment:
     负责具体的 SPARQL 构造、执行和结果解析。
     """
 
-    def __init__(self, wiki_service: WikidataService):
+    def __init__(self, wiki_service: WikidataService, memo_max_entries: int = 2000, memo_path: str = None):
         self.service = wiki_service
+        # 工具结果备忘：key = 工具 + 输入候选集指纹 + 约束签名，value = 排序后的 QID 列表
+        # 同一个 GraphEnvironment 被多个 Agent 复用时，跨 Agent 运行共享
+        self.memo = JsonFileStore(memo_path, max_entries=memo_max_entries)
+
+    @staticmethod
+    def fingerprint(candidates: Set[str]) -> str:
+        """候选集指纹：与集合的迭代顺序无关"""
+        return hashlib.sha1("\n".join(sorted(candidates)).encode("utf-8")).hexdigest()
+
+    def _memo_get(self, key: str):
+        cached = self.memo.get(key)
+        if cached is None:
+            return None
+        current_span().set(memo_hit=True)
+        log_event(logger, "tool.memo_hit", "  -> [Memo] Reusing {rows} results ({tool}).",
+                  rows=len(cached), tool=key.split('|')[0])
+        return set(cached)
+
+    def _memo_put(self, key: str, result: Set[str]):
+        self.memo.put(key, sorted(result))
+
+    def memo_stats(self) -> Dict[str, int]:
+        return self.memo.stats()
 
     # --- Tool 1: Generate (生成思维) ---
+    @traced("tool.search_anchor")
     def tool_search_anchor(self, constraint: Constraint) -> Set[str]:
         """
         对应 GoT 的 Generate 操作：从无到有生成候选集。
         """
-        logger.info(
-            f"[Tool: Anchor] Searching {constraint.property_label} (ID: {constraint.property_id}) {constraint.operator} {constraint.value}")
+        current_span().set(constraint=constraint.id, property=constraint.property_id)
+        log_event(logger, "tool.anchor", "[Tool: Anchor] Searching {label} (ID: {pid}) {op} {value}",
+                  label=constraint.property_label, pid=constraint.property_id, op=constraint.operator,
+                  value=constraint.value)
         if constraint.operator == "IGNORE":
             logger.warning(f"[Tool: Anchor] Cannot search with IGNORE operator on {constraint.property_label}.")
             return set()
+
+        memo_key = f"anchor|{constraint.signature()}"
+        cached = self._memo_get(memo_key)
+        if cached is not None:
+            return cached
         try:
             val_str = str(constraint.value)
             pid = constraint.property_id
@@ -41,10 +77,20 @@ class GraphEnvironment:
                 # ?item wdt:Pxxx wd:Qxxx
                 where_clause = f"?item wdt:{pid} wd:{val_str} ."
 
+            # === 数值属性：按 UnitNormalizer 换算后的单位比较 (物理量取 SI 归一化值)，4 位数也不当作年份 ===
+            elif pid in PROPERTY_UNITS and re.match(r'^-?\d+(\.\d+)?$', val_str):
+                log_event(logger, "tool.anchor_literal", "  -> Detected Quantity Literal: {value} {unit}",
+                          kind="quantity", value=val_str, unit=PROPERTY_UNITS[pid])
+                where_clause = f"""
+                    {quantity_triple(pid)}
+                    FILTER(?v {constraint.operator} {val_str})
+                """
+
             # === [FIX] 2. 针对 日期/数值 的查询 (Datatype Property) ===
             # 如果是日期格式 YYYY-MM-DD 或 YYYY
             elif re.match(r'^\d{4}(-\d{2}-\d{2})?$', val_str):
-                logger.info(f"  -> Detected Date Literal: {val_str}")
+                log_event(logger, "tool.anchor_literal", "  -> Detected Date Literal: {value}",
+                          kind="date", value=val_str)
 
                 # Wikidata 日期通常是 xsd:dateTime 格式 (e.g. "1974-12-31T00:00:00Z"^^xsd:dateTime)
                 # 针对 Anchor，我们通常做精确匹配或基于 Operator 的匹配
@@ -73,7 +119,8 @@ class GraphEnvironment:
 
             # === [FIX] 3. 针对 纯数值 的查询 ===
             elif re.match(r'^-?\d+(\.\d+)?$', val_str):
-                logger.info(f"  -> Detected Number Literal: {val_str}")
+                log_event(logger, "tool.anchor_literal", "  -> Detected Number Literal: {value}",
+                          kind="number", value=val_str)
                 where_clause = f"""
                     ?item wdt:{pid} ?v .
                     FILTER(?v {constraint.operator} {val_str})
@@ -81,7 +128,8 @@ class GraphEnvironment:
 
             # === [FIX] 4. 针对 字符串标签 的查询 (Fallback) ===
             else:
-                logger.info(f"Fallback: Searching by label match for '{val_str}' on property {pid}")
+                log_event(logger, "tool.anchor_literal", "Fallback: Searching by label match for '{value}' "
+                          "on property {pid}", kind="label", value=val_str, pid=pid)
                 # 只有当 Object 是 Entity 时才查 label
                 # ?item -> ?target_entity -> [Label == "Value"]
                 where_clause = f"""
@@ -111,154 +159,29 @@ class GraphEnvironment:
                 if "entity/" in url:
                     qids.add(url.split("/")[-1])
 
-            logger.info(f"  -> Found {len(qids)} candidates.")
+            log_event(logger, "tool.anchor_done", "  -> Found {rows} candidates.", rows=len(qids))
+            # 只缓存成功的结果 (异常分支不会走到这里)
+            self._memo_put(memo_key, qids)
             return qids
 
+        except (BudgetExceeded, QueryCancelled):
+            # 预算耗尽 / 被取消不是"没有结果"：交给 Agent 处理 (用当前最佳节点结束或丢弃该动作)
+            raise
         except Exception as e:
             logger.error(f"[Tool: Anchor] Execution failed: {e}")
             return set()
 
-    # environment.py -> class GraphEnvironment
-
-    def _align_magnitude(self, constraint: Constraint, parent_candidates: Set[str] = None,
-                         sample_limit=10) -> Constraint:
-        """
-        [Robust] 稳健的动态数量级对齐逻辑。
-        策略：
-        1. 采样：获取 10 个样本的中位数 (Median)，避免被 AVG 的异常值误导。
-        2. 比率分析：计算 Ratio = DB_Median / User_Value。
-        3. 语义匹配：优先匹配时间因子 (60, 3600) 和数量级因子 (10^3, 10^6)。
-        """
-        # 1. 前置检查：只处理数值类型的 > 或 < 操作
-        if constraint.operator not in [">", "<"]:
-            return constraint
-
-        try:
-            user_val = float(constraint.value)
-            if user_val == 0: return constraint
-        except ValueError:
-            return constraint
-
-        try:
-            pid = constraint.property_id
-
-            # === [CORE FIX] 构造探测查询 ===
-            # 策略：如果提供了候选集，只探测这些候选实体的属性值 (局部探测)
-            # 这能避免"全局随机抽样"带来的巨大方差 (例如同时抽到 1分钟的短视频 和 120分钟的电影)
-
-            if parent_candidates and len(parent_candidates) > 0:
-                # 为了性能，如果候选集太大，只取前 20 个做样本
-                sample_qids = list(parent_candidates)[:20]
-                values_str = " ".join([f"wd:{qid}" for qid in sample_qids])
-
-                sparql = f"""
-                        SELECT ?v WHERE {{
-                          VALUES ?item {{ {values_str} }}
-                          ?item wdt:{pid} ?v .
-                          FILTER(isNumeric(?v))
-                        }} LIMIT {sample_limit}
-                        """
-            else:
-                # Fallback: 如果没有候选集（极少情况，如Anchor阶段），才用全局随机探测
-                sparql = f"""
-                        SELECT ?v WHERE {{
-                          ?item wdt:{pid} ?v .
-                          FILTER(isNumeric(?v))
-                        }} LIMIT {sample_limit}
-                        """
-
-            results = self.service.execute_sparql(sparql)
-            if not results:
-                return constraint
-
-            # 提取数值并过滤
-            values = []
-            for r in results:
-                try:
-                    v = float(r['v']['value'])
-                    if v > 0: values.append(v)
-                except:
-                    pass
-
-            if not values:
-                return constraint
-
-            # 3. 计算中位数 (Median) - 比平均值更稳健
-            values.sort()
-            mid_idx = len(values) // 2
-            db_median = values[mid_idx]
-
-            # 计算比率
-            ratio = db_median / user_val
-
-            logger.info(
-                f"[Auto-Align] Probing {constraint.property_label}: User={user_val}, DB_Median={db_median}, Ratio={ratio:.4f}")
-
-            # 如果比率接近 1 (例如 0.5 ~ 2.0)，说明单位一致，无需调整
-            if 0.5 <= ratio <= 2.0:
-                return constraint
-
-            factor = 1.0
-            aligned_reason = ""
-
-            # === 4. 语义因子匹配逻辑 (Semantic Factor Matching) ===
-
-            # 辅助函数：判断 ratio 是否在 target 的容忍范围内 (+/- 50%)
-            # 容忍度设大一点，因为"平均电影"和"特定电影"的时长本身就有差异
-            def is_close_to(val, target, tolerance=0.5):
-                return (target * (1 - tolerance)) < val < (target * (1 + tolerance))
-
-            # --- A. 时间/单位换算检查 (60进制) ---
-
-            # 场景: 库里是秒(大)，用户是分(小) -> Ratio ~ 60
-            if is_close_to(ratio, 60.0):
-                factor = 60.0
-                aligned_reason = "Minute -> Second (x60)"
-
-            # 场景: 库里是分(小)，用户是秒(大) -> Ratio ~ 1/60 (0.0166)
-            elif is_close_to(ratio, 1 / 60.0):
-                factor = 1 / 60.0
-                aligned_reason = "Second -> Minute (x1/60)"
-
-            # 场景: 库里是秒，用户是小时 -> Ratio ~ 3600
-            elif is_close_to(ratio, 3600.0):
-                factor = 3600.0
-                aligned_reason = "Hour -> Second (x3600)"
-
-            # --- B. 数量级检查 (10进制: k, M, B) ---
-
-            # 如果没命中时间单位，再看是不是数量级搞错了 (Million/Billion)
-            else:
-                log_diff = math.log10(ratio)
-                round_log = round(log_diff)
-
-                # 只有当差异超过 2 个数量级 (100倍) 时才介入
-                # 且 log_diff 必须接近整数 (误差 < 0.4)，避免误伤正常的数据波动
-                if abs(round_log) >= 2 and abs(log_diff - round_log) < 0.4:
-                    factor = 10 ** round_log
-                    aligned_reason = f"Magnitude Correction (10^{round_log})"
-
-            # 5. 应用修正
-            if factor != 1.0:
-                new_c = copy.deepcopy(constraint)
-                new_c.value = str(user_val * factor)
-                logger.warning(
-                    f"[Auto-Align] FIXED {constraint.property_label}: {user_val} -> {new_c.value} ({aligned_reason})")
-                return new_c
-
-        except Exception as e:
-            logger.warning(f"[Auto-Align] Logic error for {constraint.property_label}: {e}")
-
-        return constraint
-
     # --- Tool 2: Filter (剪枝/过滤 - 增强版) ---
+    @traced("tool.filter")
     def tool_filter(self, parent_candidates: Set[str], constraint: Constraint) -> Set[str]:
         """
         对应 GoT 的 Filter 操作：在现有集合上施加新约束。
         [Upgrade] 支持 Subclass (P279) 推理。
         [Upgrade] 支持 IGNORE 操作符。
-        [Upgrade] 支持动态数量级对齐 (Dynamic Magnitude Alignment)。
+        数值约束假定已由 UnitNormalizer 换算到 unit_utils.PROPERTY_UNITS 中的单位 (物理量为 SI，比较归一化值)。
         """
+        current_span().set(constraint=constraint.id, property=constraint.property_id,
+                           input_rows=len(parent_candidates))
         # 1. IGNORE 检查
         if constraint.operator == "IGNORE":
             logger.info(f"[Tool: Filter] Constraint '{constraint.property_label}' is IGNORE. Skipping.")
@@ -266,21 +189,18 @@ class GraphEnvironment:
 
         if not parent_candidates:
             return set()
-        # === [NEW] 动态对齐调用 ===
-        # 在构造 SPARQL 之前，先检查并修正数值单位
-        # 只有当包含数值比较时才触发，避免浪费时间
-        # 这里的 align_constraint 是一个新的临时对象，不会污染原始 constraints 列表
-        align_constraint = self._align_magnitude(constraint, parent_candidates)
 
-        # 记录日志方便调试
-        if align_constraint.value != constraint.value:
-            logger.info(f"[Tool: Filter] aligned value {constraint.value} -> {align_constraint.value}")
+        # 属性标签也会影响 SPARQL 的构造 (年份过滤只对日期类属性生效)，一并放进 key
+        memo_key = (f"filter|{self.fingerprint(parent_candidates)}|{constraint.signature()}|"
+                    f"{constraint.property_label.lower()}")
+        cached = self._memo_get(memo_key)
+        if cached is not None:
+            return cached
 
-        # 使用对齐后的约束对象进行后续操作
-        constraint = align_constraint
-
-        logger.info(
-            f"[Tool: Filter] Filtering {len(parent_candidates)} items by {constraint.property_label} {constraint.operator} {constraint.value}")
+        # 数值约束的单位已在解析阶段由 UnitNormalizer 换算好 (物理量为 SI 单位)，这里直接比较，无需采样对齐
+        log_event(logger, "tool.filter", "[Tool: Filter] Filtering {input_rows} items by {label} {op} {value}",
+                  input_rows=len(parent_candidates), label=constraint.property_label, pid=constraint.property_id,
+                  op=constraint.operator, value=constraint.value)
 
         try:
             # 构造 VALUES 子句
@@ -293,9 +213,12 @@ class GraphEnvironment:
             is_date_full = False
             is_number = False
 
-            # 优先级：QID > 年份 > 完整日期 > 浮点数
+            # 优先级：QID > 数值属性 > 年份 > 完整日期 > 浮点数
+            is_quantity = constraint.property_id in PROPERTY_UNITS
             if re.match(r'^Q\d+$', val_str):
                 is_qid = True
+            elif is_quantity and re.match(r'^-?\d+(\.\d+)?$', val_str):
+                is_number = True
             elif re.match(r'^\d{4}$', val_str):
                 is_year = True
             elif re.match(r'^\d{4}-\d{2}-\d{2}', val_str):
@@ -321,7 +244,10 @@ class GraphEnvironment:
                 """
             else:
                 # === 非 QID (数值/日期/字符串) ===
-                triple = f"?item wdt:{constraint.property_id} ?val ."
+                if is_quantity and is_number:
+                    triple = quantity_triple(constraint.property_id, var="?val")
+                else:
+                    triple = f"?item wdt:{constraint.property_id} ?val ."
 
                 # 注意：这里根据上面计算的 flag 进行分支，不再重复正则
                 if is_year and (
@@ -360,27 +286,34 @@ class GraphEnvironment:
                 url = r['item']['value']
                 valid_qids.add(url.split("/")[-1])
 
-            logger.info(f"  -> {len(valid_qids)} items remain after filtering.")
+            log_event(logger, "tool.filter_done", "  -> {rows} items remain after filtering.", rows=len(valid_qids))
+            self._memo_put(memo_key, valid_qids)
             return valid_qids
 
+        except (BudgetExceeded, QueryCancelled):
+            # 预算耗尽 / 被取消不是"没有结果"：交给 Agent 处理 (用当前最佳节点结束或丢弃该动作)
+            raise
         except Exception as e:
             logger.error(f"[Tool: Filter] Execution failed: {e}")
             return set()
 
     # --- Tool 3: Aggregate (聚合思维) ---
+    @traced("tool.intersect")
     def tool_intersect(self, set_a: Set[str], set_b: Set[str]) -> Set[str]:
         """
         对应 GoT 的 Aggregate 操作：多路思维合并 (求交集)
         """
         try:
             result = set_a.intersection(set_b)
-            logger.info(f"[Tool: Intersect] Merging {len(set_a)} and {len(set_b)} sets -> {len(result)} remaining")
+            log_event(logger, "tool.intersect", "[Tool: Intersect] Merging {left} and {right} sets -> {rows} remaining",
+                      left=len(set_a), right=len(set_b), rows=len(result))
             return result
         except Exception as e:
             logger.error(f"[Tool: Intersect] Failed: {e}")
             return set()
 
     # --- Tool 4: Refine (精炼/修正思维) ---
+    @traced("tool.relax")
     def tool_relax_constraint(self, constraint: Constraint) -> Constraint:
         """
         对应 GoT 的 Refine 操作：当结果为空时，根据 Softness 放宽条件。
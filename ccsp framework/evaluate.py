@@ -8,50 +8,43 @@ from tqdm import tqdm
 from typing import Set
 
 # === 1. 从 main.py 导入必要的类和函数 ===
-from main import LLMService, parse_query_to_constraints
+from main import init_services, parse_query_to_constraints, setup_logging as main_setup_logging
 
 # === 2. 导入其他组件 ===
-from wikidata_service import WikidataService
-from optimizer import ConstraintOptimizer
+from budget import QueryBudget, budget_scope
+from tracing import tracer
 from agent_brain import GoTAgent
 from environment import GraphEnvironment
 from critic import StatisticalCritic
 from unit_utils import UnitNormalizer  # 务必导入这个
+from fast_parser import fast_parser_from_env
 
-# === 配置日志 ===
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("evaluation.log", mode='w', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("Evaluator")
 
 
+def setup_logging():
+    """配置日志 (只在脚本入口调用，导入本模块不创建日志文件)：与 main.py 相同的非阻塞管线，写 evaluation.jsonl"""
+    main_setup_logging("evaluation.jsonl")
+
+
 class Evaluator:
-    def __init__(self, dataset_path, limit):
+    def __init__(self, dataset_path, limit, budget_limits=None):
         self.dataset_path = dataset_path
         self.limit = limit
+        # 单个查询的成本预算，如 {"deadline_sec": 120, "max_sparql_calls": 200, "max_llm_tokens": 50000}
+        self.budget_limits = budget_limits
 
-        # === 初始化服务 (模拟 main.py 中的初始化逻辑) ===
+        # === 初始化服务 (与 main.py 共用 init_services) ===
         # 请确保环境变量已设置，或者在这里硬编码用于测试
-        api_key = os.getenv("LLM_API_KEY")
-        base_url = os.getenv("LLM_BASE_URL")
-        model_name = os.getenv("model_name")
-
-        if not api_key:
+        if not os.getenv("LLM_API_KEY"):
             logger.warning("Environment variables for LLM not found. Please ensure LLM_API_KEY is set.")
 
-        self.llm_service = LLMService(api_key, base_url, model_name)
-        self.wiki_service = WikidataService()
-
-        # 初始化核心组件
-        self.optimizer = ConstraintOptimizer(self.wiki_service)
+        # 评估重跑时大量 Prompt 完全相同，设置 LLM_CACHE_PATH 即可复用上一次的响应
+        self.llm_service, self.wiki_service, self.optimizer = init_services(os.getenv("LLM_CACHE_PATH"))
         self.env = GraphEnvironment(self.wiki_service)
         self.critic = StatisticalCritic(self.optimizer)
         self.normalizer = UnitNormalizer()  # 初始化单位标准化器
+        self.fast_parser = fast_parser_from_env()  # 规则快速通道 (CCSP_FAST_PARSER=1 启用)，覆盖不了的问题才交给 LLM 解析
 
     def load_data(self):
         logger.info(f"Loading dataset from {self.dataset_path}")
@@ -97,33 +90,41 @@ class Evaluator:
             start_time = time.time()
             error_msg = None
             pred_qids = set()
+            agent_metrics = {}
+            budget = QueryBudget(**self.budget_limits) if self.budget_limits else None
 
             try:
                 # ==========================================================
                 # 核心处理管线 (Pipeline) - 必须与 main.py 逻辑保持一致
                 # ==========================================================
 
-                # 1. Phase 1: Parsing
-                constraints = parse_query_to_constraints(query, self.llm_service, self.wiki_service)
-
-                # 2. Phase 1.5: Unit Normalization (关键步骤！)
-                if constraints:
-                    constraints = self.normalizer.normalize(constraints)
-
-                # 3. Phase 2: Optimization
-                # optimize 方法内部会进行探测(Probe)
-                constraints = self.optimizer.optimize(constraints)
-
-                if not constraints:
-                    pred_qids = set()  # 解析失败或无有效约束
-                else:
-                    # 4. Phase 3: Agent Execution
-                    # 每次重新实例化 Agent 以清除上一题的状态 (History)
-                    agent = GoTAgent(self.llm_service, self.env, self.critic)
-                    final_candidates = agent.solve(query, constraints)
-
-                    if final_candidates:
-                        pred_qids = set(final_candidates)
+                # 整个查询 (解析 + 探测 + Agent) 共用一个预算；启用追踪时每个问题是一条 trace
+                with budget_scope(budget), tracer.trace("query", query=query, index=idx):
+                    # 1. Phase 1: Parsing
+                    constraints = parse_query_to_constraints(query, self.llm_service, self.wiki_service,
+                                                             fast_parser=self.fast_parser)
+
+                    # 2. Phase 1.5: Unit Normalization (关键步骤！)
+                    if constraints:
+                        constraints = self.normalizer.normalize(constraints)
+
+                    # 3. Phase 2: Optimization
+                    # optimize 方法内部会进行探测(Probe)
+                    constraints = self.optimizer.optimize(constraints)
+
+                    if not constraints:
+                        pred_qids = set()  # 解析失败或无有效约束
+                    else:
+                        # 4. Phase 3: Agent Execution
+                        # 每次重新实例化 Agent 以清除上一题的状态 (History)
+                        agent = GoTAgent(self.llm_service, self.env, self.critic)
+                        final_candidates = agent.solve(query, constraints, budget=budget)
+                        agent_metrics = dict(agent.metrics)
+                        agent_metrics["prompt_tokens"] = sum(m["prompt_tokens"] for m in agent.step_metrics)
+                        agent_metrics["llm_latency"] = sum(m["latency"] for m in agent.step_metrics)
+
+                        if final_candidates:
+                            pred_qids = set(final_candidates)
 
             except Exception as e:
                 error_msg = str(e)
@@ -147,6 +148,16 @@ class Evaluator:
                 "f1": m["f1"],
                 "em": m["em"],
                 "duration": duration,
+                "llm_calls": agent_metrics.get("llm_calls", 0),
+                "llm_calls_saved": agent_metrics.get("llm_calls_saved", 0),
+                "plan_completed": agent_metrics.get("plan_completed", False),
+                "agent_prompt_tokens": agent_metrics.get("prompt_tokens", 0),
+                "agent_llm_latency": agent_metrics.get("llm_latency", 0.0),
+                "spec_hits": agent_metrics.get("speculation", {}).get("hits", 0),
+                "spec_misses": agent_metrics.get("speculation", {}).get("misses", 0),
+                "spec_time_saved": agent_metrics.get("speculation", {}).get("time_saved", 0.0),
+                "sparql_calls": budget.sparql_calls if budget else None,
+                "llm_tokens": budget.llm_tokens if budget else None,
                 "error": error_msg
             }
             results.append(record)
@@ -170,7 +181,24 @@ class Evaluator:
         print(f"Avg Recall:    {avg_r:.4f}")
         print(f"Avg F1 Score:  {avg_f1:.4f}")
         print(f"Exact Match:   {avg_em:.4f}")
+        print(f"Avg LLM Calls (agent):  {np.mean([r['llm_calls'] for r in results]):.2f}")
+        print(f"Avg LLM Calls Saved:    {np.mean([r['llm_calls_saved'] for r in results]):.2f}")
+        print(f"Plan Completed w/o LLM: {np.mean([r['plan_completed'] for r in results]):.2%}")
+        spec_hits = sum(r['spec_hits'] for r in results)
+        spec_decisions = spec_hits + sum(r['spec_misses'] for r in results)
+        if spec_decisions:
+            print(f"Speculation Hit Rate:   {spec_hits / spec_decisions:.2%} ({spec_hits}/{spec_decisions}), "
+                  f"{sum(r['spec_time_saved'] for r in results):.1f}s tool latency hidden")
+        memo = self.env.memo_stats()
+        print(f"Tool Memo: {memo['hits']} hits, {memo['misses']} misses ({memo['entries']} entries)")
+        if self.fast_parser is not None:
+            fast = self.fast_parser.stats
+            print(f"Fast-Path Parser: {fast['parsed']} parsed without LLM, {fast['fallback']} fell back to LLM")
+        if self.llm_service.cache is not None:
+            stats = self.llm_service.cache_stats
+            print(f"LLM Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['tokens_saved']} tokens saved")
         print("=" * 30)
+        self.llm_service.flush_cache()
 
         # 保存为 CSV
         df = pd.DataFrame(results)
@@ -180,6 +208,8 @@ class Evaluator:
 
 
 if __name__ == "__main__":
+    setup_logging()
+    tracer.configure(os.getenv("CCSP_TRACE_FILE"))
     # 请修改为您本地的数据集路径
     DATASET_PATH = r"D:\GitHub\CCSP\datasets\complex_constraint_dataset_rewrite_queries.json"
 
@@ -188,4 +218,5 @@ if __name__ == "__main__":
     else:
         # 建议先跑 10 条测试一下
         evaluator = Evaluator(DATASET_PATH, limit=300)
-        evaluator.run_evaluation()
\ No newline at end of file
+        evaluator.run_evaluation()
+        tracer.flush()
@@ -0,0 +1,214 @@
+# fast_parser.py
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 比较词 -> 运算符。年份与数值分开：'over 2009' 不常见，'after 100 minutes' 没有意义
+YEAR_OPS = {"after": ">", "since": ">", "later than": ">", "before": "<", "prior to": "<", "earlier than": "<",
+            "in": "="}
+NUM_OPS = {"more than": ">", "greater than": ">", "longer than": ">", "larger than": ">", "higher than": ">",
+           "taller than": ">", "heavier than": ">", "over": ">", "above": ">", "exceeding": ">",
+           "less than": "<", "fewer than": "<", "shorter than": "<", "smaller than": "<", "lower than": "<",
+           "lighter than": "<", "under": "<", "below": "<"}
+SCALES = {"thousand": 1e3, "k": 1e3, "million": 1e6, "m": 1e6, "billion": 1e9, "b": 1e9}
+# 单字母量级 ('$5m') 与单位缩写冲突 ('500 m' 是米)：属性的单位正则能匹配时按单位处理
+SHORT_SCALES = {"k", "m", "b"}
+
+
+def _alt(words) -> str:
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+YEAR_OP_RE = _alt(YEAR_OPS)
+NUM_OP_RE = _alt(NUM_OPS)
+NUMBER_RE = r"\$?\s?(?P<num>\d[\d,]*(?:\.\d+)?)\s?(?P<scale>thousand|million|billion|[kmb](?=\b))?"
+# 实体值的右边界：标点 (句点只认句末，避免截断 'C.V. Wood')、连接词、或下一个约束的提示词
+VALUE_END = (r"(?=\s*(?:[,?;]|\.\s*$|$)|\s+(?:and|or|but|who|that|which|whose|where|with|was|were|is|are|has|"
+             r"had|have|released|published|founded|established|born|died|directed|starring|featuring|performed|"
+             r"headquartered|located|in the|before|after|since|during)\b)")
+ENTITY_RE = r"(?:the\s+|an?\s+)?(?P<val>[^,?;]+?)" + VALUE_END
+
+# 与 datasetsConstruction/buildConstraint.py 的 PROP_CONFIG 对应：数据集问题由这些属性短语改写而来，
+# 每个属性第一个短语即 PROP_CONFIG 中的 label，其余为改写后常见的说法
+YEAR_PHRASES = {
+    "P577": ("released date", ["released", "published", "came out", "release date", "released date",
+                               "publication date"]),
+    "P571": ("founded in", ["founded", "established", "formed", "created", "inception", "founded in"]),
+    "P569": ("born year", ["born", "birth year", "born year"]),
+    "P570": ("died in", ["died", "dying", "passed away", "death year"]),
+}
+# (label, 关键词, 单位正则, 默认单位)
+QUANTITY_PHRASES = {
+    "P2047": ("duration", ["runtime", "running time", "duration", "length"], r"minutes?|mins?|hours?", "minutes"),
+    "P2142": ("box office", ["box office gross", "box office revenue", "box office"], r"dollars|usd", "USD"),
+    "P2130": ("budget", ["budget"], r"dollars|usd", "USD"),
+    "P1082": ("population", ["population"], r"people|inhabitants|residents", None),
+    "P2046": ("area", ["area", "land area", "total area"],
+              r"square kilomet(?:er|re)s?|sq\.? ?km|km2|km²|square miles?", "square kilometers"),
+    "P2044": ("elevation", ["elevation", "altitude"], r"met(?:er|re)s?|m\b|feet|ft", "meters"),
+    "P2048": ("height", ["height", "tall"], r"met(?:er|re)s?|m\b|centimet(?:er|re)s?|cm|feet|ft|inches", "meters"),
+    "P2067": ("mass", ["mass", "weight"], r"kilograms?|kg|grams?|g\b|pounds?|lbs?", "kilograms"),
+    "P1128": ("employees", ["employees", "number of employees", "workforce", "staff"], r"employees|people", None),
+}
+ENTITY_PHRASES = {
+    "P161": ("starring", ["starring", "featuring", "stars"]),
+    "P57": ("directed by", ["directed by"]),
+    "P175": ("performed by", ["performed by", "sung by", "recorded by"]),
+    "P159": ("headquartered in", ["headquartered in", "based in", "with headquarters in"]),
+    "P112": ("founded by", ["founded by", "established by", "co-founded by"]),
+    "P69": ("educated at", ["educated at", "studied at", "graduated from"]),
+    "P166": ("award received", ["received the", "won the", "received", "won", "awarded the", "awarded"]),
+    "P186": ("made of", ["made of", "made from"]),
+    "P61": ("discovered by", ["discovered by"]),
+    "P1376": ("capital of", ["capital of"]),
+    "P279": ("is a subclass of", ["is a subclass of", "subclass of a", "subclass of an", "subclass of"]),
+    "P106": ("occupation", ["occupation as", "occupation of", "works as a", "works as an", "worked as a"]),
+    "P27": ("citizenship", ["citizenship of", "citizen of", "citizenship in"]),
+    "P118": ("league", ["plays in the", "part of the", "member of the", "competes in the", "league"]),
+    "P17": ("country", ["in the country of", "country of"]),
+}
+# 只能取有限取值的属性：直接用枚举匹配，避免把任意 "in X" 当成约束
+CONTINENTS = ["North America", "South America", "Europe", "Asia", "Africa", "Oceania", "Antarctica", "Australia"]
+GENDERS = ["male", "female"]
+
+# 剩余文本 (没被任何规则消费的部分) 只能由这些虚词 / 连接词组成，否则说明还有约束没解析出来 -> 交给 LLM。
+# 白名单而不是黑名单：剩余文本中任何其他词 ('is a black comedy', 'where Portuguese is spoken') 都可能是约束
+RESIDUAL_FILLER = frozenset("""
+    a an the and also both which what who whose that this these those it its
+    is are was were be been has have had does do did
+    """.split())
+RESIDUAL_TOKEN = re.compile(r"[\w'-]+")
+# 取值是专名的实体属性：值里出现小写的实词 ('Chuck Norris received the Genesis Award') 说明吞进了后面的从句，
+# 这条规则不采纳，留在剩余文本里让整句交给 LLM
+NAME_PIDS = frozenset(pid for pid in ENTITY_PHRASES if pid not in ("P106", "P186", "P279"))
+NAME_PARTICLES = frozenset("of the and for de del della da das do dos di du des van von der den la le y al bin"
+                           .split())
+# 否定、析取、区间与下限改变了约束的语义，规则无法表达：出现在整句任何位置 (包括已被规则消费的部分) 都交给 LLM
+LOGIC_CUES = re.compile(r"\b(?:not|or|between|at least)\b", re.IGNORECASE)
+HEAD_RE = re.compile(r"^\s*(?:which|what)\s+(?P<val>.+?)(?=\s+(?:is|was|are|were|has|had|did|does|do|that|who|"
+                     r"whose|in|on|by|of|from|with|for|to|and|located|" + "|".join(
+                         re.escape(w) for _, words in list(YEAR_PHRASES.values()) + list(ENTITY_PHRASES.values())
+                         for w in words) + r")\b|\s*[,?])", re.IGNORECASE)
+
+
+def _is_filler(residual: str) -> bool:
+    return all(token.lower() in RESIDUAL_FILLER for token in RESIDUAL_TOKEN.findall(residual))
+
+
+def _number(num: str, scale: Optional[str]) -> str:
+    value = float(num.replace(",", "")) * SCALES.get((scale or "").lower(), 1.0)
+    return str(int(value)) if value.is_integer() else str(round(value, 6))
+
+
+def fast_parser_from_env() -> Optional["FastPathParser"]:
+    """设置 CCSP_FAST_PARSER=1 时启用规则快速通道；默认关闭，所有问题都交给 LLM 解析"""
+    if os.getenv("CCSP_FAST_PARSER", "").lower() in ("1", "true", "yes"):
+        return FastPathParser()
+    return None
+
+
+class FastPathParser:
+    """
+    确定性的约束解析快速通道：一组与属性短语绑定的预编译正则，直接输出与 LLM 解析相同格式的条目
+    (property_label / operator / value / unit，外加已确定的 property_id)。
+    只有整句都被规则覆盖 (剩余文本只剩 RESIDUAL_FILLER 中的虚词，整句没有否定 / 析取 / 区间) 时才返回结果，
+    否则返回 None 交给 LLM。默认不启用，见 fast_parser_from_env。
+    """
+
+    def __init__(self):
+        self.rules: List[Tuple[str, str, re.Pattern, str]] = []  # (pid, label, pattern, kind)
+        for pid, (label, words) in YEAR_PHRASES.items():
+            self.rules.append((pid, label, re.compile(
+                rf"\b(?:{_alt(words)})\s+(?P<op>{YEAR_OP_RE})\s+(?:the\s+year\s+)?(?P<year>-?\d{{3,4}})\b",
+                re.IGNORECASE), "year"))
+        for pid, (label, words, unit_re, _) in QUANTITY_PHRASES.items():
+            # "runtime of less than 122.5 minutes" / "a population of more than 10.3 million"
+            self.rules.append((pid, label, re.compile(
+                rf"\b(?:{_alt(words)})(?:\s+(?:of|is|was|gross\s+of))?\s+(?P<op>{NUM_OP_RE})\s+{NUMBER_RE}"
+                rf"(?:\s*(?P<unit>{unit_re}))?", re.IGNORECASE), "quantity"))
+            # "more than 5,000 employees" / "longer than 99.5 minutes" (关键词在数值之后)
+            self.rules.append((pid, label, re.compile(
+                rf"\b(?P<op>{NUM_OP_RE})\s+{NUMBER_RE}\s*(?P<unit>{unit_re})?\s+(?:of\s+|in\s+)?(?:{_alt(words)})\b",
+                re.IGNORECASE), "quantity"))
+        for pid, (label, words) in ENTITY_PHRASES.items():
+            self.rules.append((pid, label, re.compile(rf"\b(?:{_alt(words)})\s+{ENTITY_RE}", re.IGNORECASE),
+                               "entity"))
+        self.rules.append(("P136", "genre", re.compile(
+            r"\b(?:in|of|belongs to|belonging to|associated with)\s+the\s+(?P<val>[\w' -]+?)\s+genre\b"
+            r"|\bgenre\s+(?:of\s+)?" + ENTITY_RE.replace("?P<val>", "?P<val2>"), re.IGNORECASE), "entity"))
+        self.rules.append(("P407", "language", re.compile(
+            r"\b(?:in|written in)\s+(?:the\s+)?(?P<val>[A-Z][\w-]+)\s+language\b", re.IGNORECASE), "entity"))
+        self.rules.append(("P30", "continent", re.compile(rf"\b(?:in|on)\s+(?:the\s+continent\s+of\s+)?"
+                                                           rf"(?P<val>{_alt(CONTINENTS)})\b"), "entity"))
+        self.rules.append(("P21", "gender", re.compile(rf"\b(?P<val>{_alt(GENDERS)})\b", re.IGNORECASE), "entity"))
+        self.stats = {"parsed": 0, "fallback": 0}
+
+    def _item(self, pid: str, label: str, kind: str, m: re.Match) -> Optional[Dict]:
+        groups = m.groupdict()
+        if kind == "year":
+            return {"property_id": pid, "property_label": label, "operator": YEAR_OPS[groups["op"].lower()],
+                    "value": groups["year"], "unit": None}
+        if kind == "quantity":
+            _, _, unit_re, default_unit = QUANTITY_PHRASES[pid]
+            unit, scale = groups.get("unit"), groups.get("scale")
+            if unit is None and scale and scale.lower() in SHORT_SCALES and re.fullmatch(unit_re, scale, re.IGNORECASE):
+                unit, scale = scale, None
+            if "$" in m.group(0) or unit is None:
+                unit = default_unit
+            return {"property_id": pid, "property_label": label, "operator": NUM_OPS[groups["op"].lower()],
+                    "value": _number(groups["num"], scale), "unit": unit}
+        value = (groups.get("val") or groups.get("val2") or "").strip()
+        if not value:
+            return None
+        if pid in NAME_PIDS and any(token.islower() and token not in NAME_PARTICLES
+                                    for token in RESIDUAL_TOKEN.findall(value)):
+            return None
+        return {"property_id": pid, "property_label": label, "operator": "=", "value": value, "unit": None}
+
+    def parse_partial(self, question: str) -> Tuple[List[Dict], str]:
+        """返回 (解析出的条目, 未被任何规则覆盖的剩余文本)"""
+        text = " ".join(question.strip().split())
+        consumed = [False] * len(text)
+        items = []
+
+        def free(span):
+            return not any(consumed[span[0]:span[1]])
+
+        def take(span):
+            for i in range(*span):
+                consumed[i] = True
+
+        for pid, label, pattern, kind in self.rules:
+            for m in pattern.finditer(text):
+                if not free(m.span()):
+                    continue
+                item = self._item(pid, label, kind, m)
+                if item:
+                    items.append(item)
+                    take(m.span())
+
+        # 疑问词后的名词短语作为类型约束 (P31)。带修饰语的短语 ('comedy film', 'American television sitcom')
+        # 可能是类型也可能是体裁 (P136)，规则分不清，不消费它，整句交给 LLM
+        head = HEAD_RE.match(text)
+        value = re.sub(r"^(?:an?|the)\s+", "", head.group("val"), flags=re.IGNORECASE) if head else ""
+        if head and free(head.span("val")) and len(value.split()) == 1:
+            items.insert(0, {"property_id": "P31", "property_label": "is a", "operator": "=", "value": value,
+                             "unit": None})
+            take(head.span())
+
+        residual = "".join(ch if not consumed[i] else " " for i, ch in enumerate(text))
+        return items, " ".join(residual.split())
+
+    def parse(self, question: str) -> Optional[List[Dict]]:
+        items, residual = self.parse_partial(question)
+        if (not items or all(item["property_id"] == "P31" for item in items) or not _is_filler(residual)
+                or LOGIC_CUES.search(question)):
+            self.stats["fallback"] += 1
+            return None
+        self.stats["parsed"] += 1
+        for i, item in enumerate(items):
+            item["id"] = f"c{i + 1}"
+        return items
@@ -1,7 +1,10 @@
 # graph_state.py
-from typing import List, Set, Dict, Optional, Any
+import logging
+from typing import List, Set, Dict, Optional, Any, FrozenSet
 from data_model import Constraint
 
+logger = logging.getLogger(__name__)
+
 
 class ThoughtNode:
     """
@@ -9,43 +12,180 @@ class ThoughtNode:
     对应 GoT 中的顶点 (Vertex)。
     """
 
-    def __init__(self, node_id: str, description: str, candidates: Set[str], parent_ids: List[str] = None):
+    def __init__(self, node_id: str, description: str, candidates: Set[str], parent_ids: List[str] = None,
+                 constraint_id: str = None):
         self.node_id = node_id
         self.description = description  # 语义描述，如 "Movies starring Chester"
         self.candidates = candidates  # 实体集合 (QIDs)
         self.parent_ids = parent_ids or []  # 依赖的前置节点 ID
+        self.constraint_id = constraint_id  # 产生该节点时施加的约束 (SEARCH_ANCHOR / FILTER)
         self.score = 0.0  # 节点的质量评分 (基于 Optimizer)
         self.is_terminal = False  # 是否是最终答案候选
+        self.released = False  # 候选集是否已被释放 (只保留数量)
+        self._released_size = 0
+
+    @property
+    def size(self) -> int:
+        return self._released_size if self.released else len(self.candidates)
+
+    def release(self):
+        """释放候选集以节省内存，保留数量供摘要使用"""
+        if not self.released:
+            self._released_size = len(self.candidates)
+            self.candidates = set()
+            self.released = True
 
     def __repr__(self):
-        return f"<Node {self.node_id}: {len(self.candidates)} candidates | {self.description}>"
+        return f"<Node {self.node_id}: {self.size} candidates | {self.description}>"
 
 
 class GraphState:
     """
     图状态：维护当前的推理全景图。
+    - children / parents 邻接索引与叶子集合随 add_node 增量维护，查询叶子为 O(1)。
+    - 摘要按节点缓存描述行，只在图变化后重新拼接一次。
+    - release_unreachable=True 时，释放"死"节点的候选集 (定义见 release_dead)。
     """
 
-    def __init__(self):
+    def __init__(self, release_unreachable: bool = False):
         self.nodes: Dict[str, ThoughtNode] = {}
         self.edges: List[tuple] = []  # (parent, child)
         self.history: List[str] = []  # 记录 Agent 的操作历史
+        self.node_log: List[str] = []  # 按加入顺序记录节点 ID (含被覆盖的同名节点)，用于增量汇报
+        self.children: Dict[str, Set[str]] = {}
+        self.parents: Dict[str, List[str]] = {}
+        self.coverage: Dict[str, FrozenSet[str]] = {}  # 从 root 到该节点的路径上施加过的约束
+        self._leaves: Dict[str, None] = {}  # 有序集合 (顺序与 nodes 一致)
+        self._holding: Dict[str, None] = {}  # 仍持有候选集的节点，release_dead 只扫描这些节点
+        self._summary_lines: Dict[str, str] = {}
+        self._summary_cache: Optional[str] = None
+        self.release_unreachable = release_unreachable
 
     def add_node(self, node: ThoughtNode):
-        self.nodes[node.node_id] = node
+        self._add(node)
+        if self.release_unreachable:
+            self.release_dead()
+
+    def _add(self, node: ThoughtNode):
+        nid = node.node_id
+        self.nodes[nid] = node
+        self.node_log.append(nid)
+        self.parents[nid] = list(node.parent_ids)
+        covered = set()
         for pid in node.parent_ids:
-            self.edges.append((pid, node.node_id))
+            self.edges.append((pid, nid))
+            self.children.setdefault(pid, set()).add(nid)
+            self._leaves.pop(pid, None)
+            covered |= self.coverage.get(pid, frozenset())
+        if node.constraint_id:
+            covered.add(node.constraint_id)
+        self.coverage[nid] = frozenset(covered)
+        if not self.children.get(nid):
+            self._leaves[nid] = None
+        if node.candidates and not node.released:
+            self._holding[nid] = None
+
+        self._summary_lines[nid] = self.describe_node(node)
+        self._summary_cache = None
+
+    def add_nodes(self, nodes: List[ThoughtNode]):
+        """一次性加入同一步产生的多个节点 (批量动作)，整批加入后才检查一次死节点"""
+        for node in nodes:
+            self._add(node)
+        if self.release_unreachable and nodes:
+            self.release_dead()
 
     def get_node(self, node_id: str) -> Optional[ThoughtNode]:
         return self.nodes.get(node_id)
 
+    def unique_id(self, base: str, taken=()) -> str:
+        """base 未被占用时直接使用，否则依次尝试 base_2, base_3 ...，避免同名节点互相覆盖"""
+        if base not in self.nodes and base not in taken:
+            return base
+        n = 2
+        while f"{base}_{n}" in self.nodes or f"{base}_{n}" in taken:
+            n += 1
+        return f"{base}_{n}"
+
+    def get_leaves(self) -> List[ThoughtNode]:
+        """没有子节点的节点 (按加入顺序)"""
+        return [self.nodes[nid] for nid in self._leaves]
+
+    def frontier(self) -> List[str]:
+        """
+        Agent 仍可能继续推进的节点：
+        - 每个叶子：非空叶子本身；空叶子 (死路) 则取其仍有候选的父节点 (放松约束后从这里重试)；已释放的节点不再计入；
+        - 去掉被支配的节点：另一个节点覆盖的约束是其超集且候选不更多 (与束搜索的剪枝规则一致，并列时保留先加入的)。
+        """
+        def usable(node):
+            return node is not None and not node.released and node.candidates
+
+        points: Dict[str, None] = {}
+        for nid in self._leaves:
+            if usable(self.nodes[nid]):
+                points[nid] = None
+            elif not self.nodes[nid].released:
+                for pid in self.parents.get(nid, []):
+                    if usable(self.nodes.get(pid)):
+                        points[pid] = None
+
+        ordered = list(points)
+        kept = []
+        for i, nid in enumerate(ordered):
+            cov, size = self.coverage[nid], self.nodes[nid].size
+            dominated = any(
+                j != i and self.coverage[o] >= cov and self.nodes[o].size <= size
+                and (self.coverage[o] != cov or self.nodes[o].size < size or j < i)
+                for j, o in enumerate(ordered))
+            if not dominated:
+                kept.append(nid)
+        return kept
+
+    def release_dead(self) -> int:
+        """
+        释放死节点的候选集，返回本次释放的节点数。
+        死节点：不在任何一条 root -> frontier() 节点的路径上 (即被放弃的分支和被支配的路径)。
+        只扫描仍持有候选集的节点，已释放的节点不会重复检查。被释放的节点不能再作为动作的输入。
+        """
+        live = set()
+        stack = self.frontier()
+        while stack:
+            nid = stack.pop()
+            if nid in live:
+                continue
+            live.add(nid)
+            stack.extend(self.parents.get(nid, []))
+
+        released = 0
+        for nid in [n for n in self._holding if n not in live]:
+            node = self.nodes.get(nid)
+            del self._holding[nid]
+            if node is None or node.released:
+                continue
+            node.release()
+            self._summary_lines[nid] = self.describe_node(node)
+            self._summary_cache = None
+            released += 1
+            logger.debug(f"[GraphState] Released candidates of dead node {nid} ({node.size}).")
+        return released
+
     def get_summary(self) -> str:
         """生成供 LLM 阅读的图状态摘要"""
-        summary = "Current Graph State:\n"
-        if not self.nodes:
-            return summary + "  (Empty Graph)\n"
-
-        for nid, node in self.nodes.items():
-            parents = f" <- {node.parent_ids}" if node.parent_ids else " (Root)"
-            summary += f"  - [{nid}] {node.description}: Found {len(node.candidates)} entities.{parents}\n"
-        return summary
\ No newline at end of file
+        if self._summary_cache is None:
+            summary = "Current Graph State:\n"
+            if not self.nodes:
+                summary += "  (Empty Graph)\n"
+            else:
+                summary += "".join(self._summary_lines.values())
+            self._summary_cache = summary
+        return self._summary_cache
+
+    @staticmethod
+    def describe_node(node: ThoughtNode) -> str:
+        parents = f" <- {node.parent_ids}" if node.parent_ids else " (Root)"
+        released = " [released: abandoned branch, cannot be used as input]" if node.released else ""
+        return f"  - [{node.node_id}] {node.description}: Found {node.size} entities.{parents}{released}\n"
+
+    def get_delta(self, since: int) -> str:
+        """node_log[since:] 中新增节点的摘要 (供多轮对话只发送增量)"""
+        return "".join(self.describe_node(self.nodes[nid]) for nid in self.node_log[since:] if nid in self.nodes)
\ No newline at end of file
@@ -0,0 +1,97 @@
+# json_stream.py
+import json
+from typing import Any, Dict
+
+
+class IncrementalJSONParser:
+    """
+    增量解析流式返回的顶层 JSON 对象。
+    每个顶层字段的值一结束 (字符串闭合、对象/数组闭合、或标量后遇到 ',' / '}') 就放进 fields，
+    不必等待整个对象传输完毕。会跳过 '{' 之前的任何内容 (如 ```json 代码块标记)。
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self._text = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._state = "start"  # start -> key -> colon -> value -> after_value -> key ...
+        self._key = None
+        self._token_start = None
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        for ch in chunk:
+            self._text.append(ch)
+            self._consume(ch, self._pos)
+            self._pos += 1
+        return self.fields
+
+    def _raw(self, start: int, end: int) -> str:
+        return "".join(self._text[start:end])
+
+    def _finish_value(self, end: int):
+        try:
+            self.fields[self._key] = json.loads(self._raw(self._token_start, end))
+        except ValueError:
+            pass
+        self._state = "after_value"
+        self._token_start = None
+
+    def _consume(self, ch: str, pos: int):
+        if self.complete:
+            return
+
+        if self._state == "start":
+            if ch == "{":
+                self._depth = 1
+                self._state = "key"
+            return
+
+        # --- 字符串内部 ---
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1 and self._state == "key":
+                    self._key = json.loads(self._raw(self._token_start, pos + 1))
+                    self._state = "colon"
+                elif self._depth == 1 and self._state == "value":
+                    # 字符串值在闭合引号处结束
+                    self._finish_value(pos + 1)
+            return
+
+        # --- 字符串外部 ---
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._state in ("key", "value") and self._token_start is None:
+                self._token_start = pos
+        elif ch == ":" and self._depth == 1 and self._state == "colon":
+            self._state = "value"
+            self._token_start = None
+        elif ch in "{[":
+            if self._depth == 1 and self._state == "value" and self._token_start is None:
+                self._token_start = pos
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._state == "value":
+                # 嵌套对象/数组值在闭合括号处结束
+                self._finish_value(pos + 1)
+            elif self._depth == 0:
+                if self._state == "value" and self._token_start is not None:
+                    self._finish_value(pos)
+                self.complete = True
+        elif ch == "," and self._depth == 1:
+            if self._state == "value" and self._token_start is not None:
+                self._finish_value(pos)
+            self._state = "key"
+            self._token_start = None
+        elif not ch.isspace() and self._depth == 1 and self._state == "value" and self._token_start is None:
+            # 数字 / true / false / null 的起点
+            self._token_start = pos
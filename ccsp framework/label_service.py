@@ -0,0 +1,114 @@
+# label_service.py
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from persistent_cache import JsonFileStore
+
+logger = logging.getLogger(__name__)
+
+WIKIDATA_API = os.getenv("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
+
+
+class LabelService:
+    """
+    QID -> 英文 Label 的批量查询服务。
+    - 先查本地 Store (持久化的 JSON)，只有缺失的 QID 才走 wbgetentities，每批最多 batch_size 个。
+    - 多个线程同时请求同一个 QID 时只发一次请求，其余调用方等待结果。
+    - 没有英文 Label 的实体记为空字符串，返回时回退为 QID 本身，避免反复查询。
+    """
+
+    def __init__(self, store: Optional[JsonFileStore] = None, batch_size: int = 50,
+                 user_agent: str = "CCSP-Bot/1.0 (Research Project)", proxies: Optional[Dict[str, str]] = None,
+                 timeout: float = 15, language: str = "en", pause: float = 0.0, session=None,
+                 api_url: str = WIKIDATA_API):
+        self.store = store if store is not None else JsonFileStore()
+        self.batch_size = batch_size
+        self.headers = {"User-Agent": user_agent}
+        self.proxies = proxies
+        self.timeout = timeout
+        self.language = language
+        self.pause = pause  # 批次之间的间隔 (秒)，批量构建数据集时用来降低被限流的概率
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.fetched = 0  # 实际通过网络获取的 QID 数
+        # session: 可复用调用方的 requests.Session (如 WikidataService.session)，保持连接常驻；
+        # 未提供时在第一次联网时才导入 requests
+        self.session = session
+        self.api_url = api_url
+
+    def get_label(self, qid: str) -> str:
+        return self.get_labels([qid]).get(qid, qid)
+
+    def get_labels(self, qids: Iterable[str]) -> Dict[str, str]:
+        """返回 {qid: label}；获取失败的 QID 回退为自身"""
+        wanted = list(dict.fromkeys(q for q in qids if q))
+        result = {}
+        to_fetch, to_wait = [], []
+
+        with self._lock:
+            for qid in wanted:
+                cached = self.store.get(qid)
+                if cached is not None:
+                    result[qid] = cached or qid
+                elif qid in self._inflight:
+                    to_wait.append((qid, self._inflight[qid]))
+                else:
+                    self._inflight[qid] = threading.Event()
+                    to_fetch.append(qid)
+
+        try:
+            for i in range(0, len(to_fetch), self.batch_size):
+                if i and self.pause:
+                    time.sleep(self.pause)
+                batch = to_fetch[i:i + self.batch_size]
+                for qid, label in self._fetch_batch(batch).items():
+                    self.store.put(qid, label)
+                    result[qid] = label or qid
+        finally:
+            with self._lock:
+                for qid in to_fetch:
+                    event = self._inflight.pop(qid, None)
+                    if event:
+                        event.set()
+
+        for qid, event in to_wait:
+            event.wait(self.timeout * 2)
+            cached = self.store.get(qid)
+            result[qid] = cached or qid
+
+        for qid in wanted:
+            result.setdefault(qid, qid)
+        return result
+
+    def _fetch_batch(self, qids: List[str]) -> Dict[str, str]:
+        params = {
+            "action": "wbgetentities",
+            "ids": "|".join(qids),
+            "format": "json",
+            "props": "labels",
+            "languages": self.language,
+        }
+        if self.session is None:
+            import requests
+            self.session = requests
+        for attempt in range(3):
+            try:
+                response = self.session.get(self.api_url, params=params, headers=self.headers,
+                                            proxies=self.proxies, timeout=self.timeout)
+                data = response.json()
+                labels = {}
+                for qid, entity in data.get("entities", {}).items():
+                    label = entity.get("labels", {}).get(self.language, {}).get("value")
+                    labels[qid] = label or ""
+                self.fetched += len(labels)
+                return labels
+            except Exception as e:
+                logger.warning(f"[Labels] Batch of {len(qids)} failed (attempt {attempt + 1}): {e}")
+                time.sleep(attempt + 1)
+        return {}
+
+    def save(self):
+        self.store.save()
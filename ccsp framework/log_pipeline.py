@@ -0,0 +1,236 @@
+# log_pipeline.py
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterable, Optional
+
+from tracing import current_span
+
+
+class _Event:
+    """
+    结构化事件的消息体：模板与字段分开保存，只有真正输出时 (在后台线程里) 才调用 format。
+    级别被过滤或被采样丢弃的事件不产生任何字符串开销。
+    """
+    __slots__ = ("name", "template", "fields")
+
+    def __init__(self, name: str, template: Optional[str], fields: Dict):
+        self.name = name
+        self.template = template
+        self.fields = fields
+
+    def __str__(self):
+        if self.template:
+            try:
+                return self.template.format(**self.fields)
+            except (KeyError, IndexError, ValueError):
+                pass
+        return self.name + " " + " ".join(f"{k}={v}" for k, v in self.fields.items())
+
+
+def log_event(logger: logging.Logger, event: str, template: str = None, level: int = logging.INFO, **fields):
+    """
+    记录结构化事件：event 为点分事件名 (用于采样与检索)，fields 为 JSON 字段，
+    template 为可选的人类可读模板 (str.format，引用 fields)。
+    字段值在输出时才序列化，调用方应传入不会再被修改的值 (计数、ID、字符串)，而不是候选集本身。
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, _Event(event, template, fields), extra={"event": event, "fields": fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """一行一个 JSON 事件：时间、级别、logger、线程、trace_id、事件名、消息与字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+        entry["msg"] = record.getMessage()
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    高频消息采样：rates 为 {事件名或 logger 名前缀: 保留比例}，按计数确定性地每 round(1/rate) 条保留一条。
+    WARNING 及以上级别从不采样。在调用线程中执行，被丢弃的记录不会进入队列。
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 长前缀优先匹配
+        self.rules = sorted(((prefix, max(1, round(1 / rate))) for prefix, rate in rates.items() if rate > 0),
+                            key=lambda r: -len(r[0]))
+        self.dropped_all = {prefix for prefix, rate in rates.items() if rate <= 0}
+        self._counters: Dict[str, itertools.count] = {}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = getattr(record, "event", None) or record.name
+        for prefix in self.dropped_all:
+            if key.startswith(prefix):
+                self.sampled_out += 1
+                return False
+        for prefix, every in self.rules:
+            if key.startswith(prefix):
+                counter = self._counters.get(prefix)
+                if counter is None:
+                    counter = self._counters.setdefault(prefix, itertools.count())
+                if next(counter) % every:
+                    self.sampled_out += 1
+                    return False
+                return True
+        return True
+
+
+class _TraceContextFilter(logging.Filter):
+    """在调用线程中记下当前 trace_id (格式化在后台线程进行，拿不到调用方的上下文)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = current_span()
+        record.trace_id = getattr(span, "trace_id", None)
+        return True
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    不在调用线程里格式化消息 (标准 QueueHandler.prepare 会先 format 一遍)，只把异常栈转成文本；
+    队列满时丢弃 INFO 及以下的记录并计数，而不是阻塞调用方；WARNING 及以上从不丢弃 (阻塞等待入队)。
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """队列 + 后台监听线程：调用方只做级别判断、采样和入队，格式化与文件 / 控制台 I/O 都在后台线程完成"""
+
+    def __init__(self, handlers: Iterable[logging.Handler], queue_size: int = 10000,
+                 sample_rates: Dict[str, float] = None):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = _LazyQueueHandler(self.queue)
+        self.handler.addFilter(_TraceContextFilter())
+        self.sampler = SamplingFilter(sample_rates or {})
+        self.handler.addFilter(self.sampler)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self.listener.start()
+                self._started = True
+
+    def stop(self):
+        """把队列中剩余的记录写完后停止后台线程"""
+        with self._lock:
+            if self._started:
+                self.listener.stop()
+                self._started = False
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "dropped": self.handler.dropped,
+                "sampled_out": self.sampler.sampled_out}
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """'tool.=0.1,optimizer.probe=0.5' -> {'tool.': 0.1, 'optimizer.probe': 0.5}"""
+    rates = {}
+    for part in (spec or "").split(","):
+        prefix, _, rate = part.partition("=")
+        if prefix.strip() and rate.strip():
+            try:
+                rates[prefix.strip()] = float(rate)
+            except ValueError:
+                pass
+    return rates
+
+
+def configure_logging(log_file: Optional[str] = None, file_level: int = logging.INFO,
+                      console_level: int = logging.INFO, sample_rates: Dict[str, float] = None,
+                      queue_size: int = 10000, console_filters: Iterable[logging.Filter] = ()) -> LogPipeline:
+    """
+    把根 logger 换成非阻塞管线：文件输出为 JSONL (结构化事件)，控制台只输出消息文本。
+    根 logger 的级别取两者中较低的一个，更低级别的调用在 isEnabledFor 处直接返回。
+    重复调用会先停掉上一条管线。
+    """
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+
+    handlers = []
+    if log_file:
+        log_dir = os.path.dirname(log_file)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+        file_handler.setLevel(file_level)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(console_level)
+    for f in console_filters:
+        console_handler.addFilter(f)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+    handlers.append(console_handler)
+
+    pipeline = LogPipeline(handlers, queue_size=queue_size, sample_rates=sample_rates)
+    root_logger = logging.getLogger()
+    if root_logger.hasHandlers():
+        root_logger.handlers.clear()
+    root_logger.setLevel(min(h.level for h in handlers))
+    root_logger.addHandler(pipeline.handler)
+    pipeline.start()
+
+    if _pipeline is None:
+        atexit.register(lambda: _pipeline and _pipeline.stop())
+    _pipeline = pipeline
+    return pipeline
+
+
+def get_pipeline() -> Optional[LogPipeline]:
+    return _pipeline
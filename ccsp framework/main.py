@@ -1,16 +1,27 @@
-import sys
+import asyncio
 import json
+import hashlib
+import time
 import logging
 import re
 import os
 from unit_utils import UnitNormalizer
-import requests
 from typing import List, Dict, Any, Set
 
 # === 引入自定义模块 (保持原有引用 + 新增 Agent 模块) ===
 from data_model import Constraint
 from wikidata_service import WikidataService
 from optimizer import ConstraintOptimizer
+from property_stats import PropertyStatistics
+from anchor_ranker import AnchorRanker
+from property_linker import PropertyLinker
+from entity_linker import EntityLinker
+from fast_parser import FastPathParser, fast_parser_from_env
+from label_service import LabelService
+from budget import current_budget, record_llm_usage
+from persistent_cache import JsonFileStore, get_shared_store
+from tracing import tracer, traced, current_span
+from log_pipeline import configure_logging, parse_sample_rates, log_event
 
 # === [NEW] 引入 Agent 架构组件 ===
 # 请确保这些文件已创建并在同一目录下
@@ -19,29 +30,10 @@ from environment import GraphEnvironment
 from critic import StatisticalCritic
 from agent_brain import GoTAgent
 
-from openai import OpenAI
+from json_stream import IncrementalJSONParser
 
-os.makedirs("info_debug", exist_ok=True)
-LOG_FILE = os.path.join("info_debug", "execution.log")
-# ==============================================================================
-# [配置日志]
-# ==============================================================================
-LOG_FILE = r"D:\GitHub\CCSP\info_debug\execution.log"
-
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
-
-if root_logger.hasHandlers():
-    root_logger.handlers.clear()
-
-file_handler = logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8')
-file_handler.setLevel(logging.DEBUG)
-file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(file_formatter)
-root_logger.addHandler(file_handler)
-
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
+# 日志文件 (JSONL 结构化事件) 默认写到当前目录下的 info_debug/，可用环境变量 CCSP_LOG_FILE 覆盖
+LOG_FILE = os.getenv("CCSP_LOG_FILE", os.path.join("info_debug", "execution.jsonl"))
 
 
 class NoisyLibFilter(logging.Filter):
@@ -52,63 +44,358 @@ class NoisyLibFilter(logging.Filter):
         return True
 
 
-console_handler.addFilter(NoisyLibFilter())
-console_formatter = logging.Formatter('%(message)s')
-console_handler.setFormatter(console_formatter)
-root_logger.addHandler(console_handler)
+# ==============================================================================
+# [配置日志]
+# 只在入口 (main / evaluate / solver_server) 显式调用；导入本模块不产生任何副作用。
+# 日志经队列交给后台线程格式化和写盘，求解线程不等待 I/O。
+# CCSP_LOG_LEVEL: 文件日志级别 (默认 INFO，DEBUG 会记录完整的 LLM 原始输出)
+# CCSP_LOG_SAMPLE: 高频事件采样，如 "tool.=0.1,optimizer.probe=0.5" (事件名或 logger 名前缀=保留比例)
+# ==============================================================================
+def setup_logging(log_file: str = LOG_FILE):
+    return configure_logging(log_file,
+                             file_level=logging.getLevelName(os.getenv("CCSP_LOG_LEVEL", "INFO").upper()),
+                             console_level=logging.INFO,
+                             sample_rates=parse_sample_rates(os.getenv("CCSP_LOG_SAMPLE")),
+                             console_filters=[NoisyLibFilter()])
+
 
 logger = logging.getLogger("CCSP-AgentLauncher")
 
+# 离线属性统计 (download_Wiki.py 生成，包含数值/日期直方图)
+METADATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "property_metadata_final.json")
+# (pid, object) 频次 Sketch (download_Wiki.py 生成，可选)
+SKETCH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pair_sketch.cms")
+# 跨查询 / 跨进程共享的约束探测结果
+PROBE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "probe_cache.json")
+# 属性 Label / 别名快照 (download_wiki2.py build_property_index 生成，可选)
+PROPERTY_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "property_index.json")
+# 实体英文 Label / 别名的 SQLite 索引 (download_Wiki.py 生成，可选)
+ENTITY_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "entity_index.sqlite")
+# QID -> Label 持久化表，报告阶段和数据集构建脚本共用
+LABEL_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_store.json")
+
+
+def load_anchor_ranker(stats: PropertyStatistics):
+    """
+    加载 model_train/train_anchor_ranker.py 训练的本地锚点模型。
+    通过环境变量 ANCHOR_RANKER_PATH 显式开启：开启后 Optimizer 不再在线探测无法本地估算的约束。
+    """
+    path = os.getenv("ANCHOR_RANKER_PATH")
+    if not path:
+        return None
+    try:
+        ranker = AnchorRanker.load(path, properties=stats.properties)
+        logger.info(f"Anchor ranker loaded from {path}.")
+        return ranker
+    except Exception as e:
+        logger.warning(f"Failed to load anchor ranker from {path}: {e}")
+        return None
+
+
+def load_property_linker(stats: PropertyStatistics):
+    """属性索引存在时启用离线 Relation Linking，同名冲突按属性三元组数排序"""
+    if not os.path.exists(PROPERTY_INDEX_PATH):
+        return None
+    try:
+        popularity = {pid: (meta.get("stats") or {}).get("total", 0) for pid, meta in stats.properties.items()}
+        return PropertyLinker.load(PROPERTY_INDEX_PATH, popularity=popularity)
+    except Exception as e:
+        logger.warning(f"Failed to load property index from {PROPERTY_INDEX_PATH}: {e}")
+        return None
+
+
+def load_entity_linker():
+    """实体索引存在时启用离线 Entity Linking，未命中的实体仍走 wbsearchentities"""
+    if not os.path.exists(ENTITY_INDEX_PATH):
+        return None
+    try:
+        return EntityLinker(ENTITY_INDEX_PATH)
+    except Exception as e:
+        logger.warning(f"Failed to open entity index {ENTITY_INDEX_PATH}: {e}")
+        return None
+
+
+def init_services(llm_cache_path: str = None):
+    """
+    显式初始化入口：创建 LLM 服务、WikidataService (含离线索引) 与 Optimizer (含离线统计与探测缓存)。
+    main / evaluate / solver_server 共用；LLM 与 HTTP 客户端本身仍在第一次调用时才创建。
+    返回 (llm_service, wiki_service, optimizer)。
+    """
+    llm_service = LLMService(os.getenv("LLM_API_KEY"), os.getenv("LLM_BASE_URL"), os.getenv("model_name"),
+                             cache_path=llm_cache_path)
+    # 离线统计用于本地估算范围约束
+    stats = PropertyStatistics.load(METADATA_PATH, SKETCH_PATH)
+    wiki_service = WikidataService(property_linker=load_property_linker(stats),
+                                   entity_linker=load_entity_linker())
+    optimizer = ConstraintOptimizer(wiki_service, stats=stats, probe_store=get_shared_store(PROBE_CACHE_PATH),
+                                    ranker=load_anchor_ranker(stats))
+    return llm_service, wiki_service, optimizer
 
 
 # ==============================================================================
 # 2. LLM 服务 (保留，作为 Agent 的大脑接口)
 # ==============================================================================
 class LLMService:
-    def __init__(self, api_key: str, base_url: str, model: str):
+    def __init__(self, api_key: str, base_url: str, model: str, cache_path: str = None,
+                 cache_max_entries: int = 5000, cache_text: bool = False):
         self.model = model
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.api_key = api_key
+        self.base_url = base_url
+        # OpenAI 客户端在第一次调用时才创建 (导入 openai 需要数百毫秒)
+        self._client = None
+        self._async_client = None
+        self._async_loop = None  # 异步客户端所属的事件循环
+
+        # 可选的磁盘响应缓存 (opt-in)：key = hash(model, temperature, prompt)
+        # 默认只缓存低温度的 JSON 调用；generate_text (temperature=0.7) 需显式打开 cache_text
+        self.cache = JsonFileStore(cache_path, max_entries=cache_max_entries) if cache_path else None
+        self.cache_text = cache_text
+        self.cache_stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+        # 每次调用的 token 用量与延迟记到调用方的 budget.usage_scope (按请求隔离)，服务对象上不保存
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    @property
+    def async_client(self):
+        """
+        流式异步客户端 (achat_json 使用)。连接池绑定在创建它的事件循环上，
+        换了事件循环 (同步入口每次 asyncio.run 都是新循环) 时重新创建，不复用已关闭循环上的连接。
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+            self._async_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        """关闭当前的异步客户端 (在它所属的事件循环结束前调用)"""
+        client, self._async_client, self._async_loop = self._async_client, None, None
+        if client is not None:
+            await client.close()
+
+    def _cache_key(self, payload: str, temperature: float) -> str:
+        raw = f"{self.model}|{temperature}|{payload}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cache_lookup(self, key: str):
+        entry = self.cache.get(key)
+        if entry is None:
+            self.cache_stats["misses"] += 1
+            return None
+        self.cache_stats["hits"] += 1
+        self.cache_stats["tokens_saved"] += entry.get("tokens", 0)
+        return entry["content"]
+
+    @traced("llm.complete")
+    def _complete(self, messages: List[Dict[str, str]], temperature: float, **kwargs):
+        """调用 API，返回 (content, total_tokens)，用量记到当前的 usage_scope"""
+        budget = current_budget()
+        if budget:
+            # token 已用完或已超时则直接放弃；请求超时不超过剩余时间
+            budget.check_llm()
+            if budget.time_left() is not None:
+                kwargs.setdefault("timeout", budget.time_left())
+        start_time = time.time()
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            **kwargs
+        )
+        usage = self._record_usage(getattr(response, "usage", None), start_time)
+        content = response.choices[0].message.content
+        current_span().set(model=self.model, bytes=len(content or ""), **usage)
+        return content, usage["tokens"]
+
+    @staticmethod
+    def _record_usage(usage, start_time: float) -> Dict[str, int]:
+        """把本次调用的用量记到 usage_scope 并计入预算，返回 {tokens, prompt_tokens, completion_tokens}"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        # 服务端 Prompt Caching 命中的前缀 token (部分兼容接口不返回)
+        record_llm_usage(prompt_tokens, completion_tokens, getattr(details, "cached_tokens", 0) or 0,
+                         time.time() - start_time)
+        tokens = (getattr(usage, "total_tokens", 0) or 0) if usage else 0
+        budget = current_budget()
+        if budget:
+            budget.charge_tokens(tokens)
+        return {"tokens": tokens, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    @staticmethod
+    def _parse_json(text: str) -> Dict[str, Any]:
+        # 简单的清洗逻辑 (现在的模型通常能很好地遵循 json_object 模式)
+        cleaned = re.sub(r'```json\s*', '', text, flags=re.IGNORECASE)
+        cleaned = re.sub(r'```', '', cleaned)
+        return json.loads(cleaned)
+
+    @staticmethod
+    def _cache_payload(messages: List[Dict[str, str]]) -> str:
+        # 单条 user 消息直接用 Prompt 本身做 key，与 generate_json 共用缓存
+        if len(messages) == 1 and messages[0].get("role") == "user":
+            return messages[0]["content"]
+        return json.dumps(messages, ensure_ascii=False)
 
     def generate_text(self, prompt: str) -> str:
         """生成自然语言回复"""
+        temperature = 0.7
+        use_cache = self.cache is not None and self.cache_text
+        key = self._cache_key(prompt, temperature) if use_cache else None
+        if use_cache:
+            cached = self._cache_lookup(key)
+            if cached is not None:
+                return cached
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-            )
-            return response.choices[0].message.content
+            text, tokens = self._complete([{"role": "user", "content": prompt}], temperature)
+            if use_cache:
+                self.cache.put(key, {"content": text, "tokens": tokens})
+            return text
         except Exception as e:
             logger.error(f"LLM Text Gen Error: {e}")
             return "Error generating response."
 
     def generate_json(self, prompt: str) -> Dict[str, Any]:
         """增强版 JSON 生成：自动清洗"""
+        return self._generate_json([{"role": "user", "content": prompt}])
+
+    def chat_json(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """多轮对话版 JSON 生成：messages 为完整的对话历史 (system 前缀 + 增量 user/assistant 消息)"""
+        return self._generate_json(messages)
+
+    @traced("llm.json")
+    def _generate_json(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        temperature = 0.1
+        key = self._cache_key(self._cache_payload(messages), temperature) if self.cache is not None else None
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                response_format={"type": "json_object"}  # 显式要求 JSON
-            )
-            text = response.choices[0].message.content
+            text = self._cache_lookup(key) if key else None
+            from_cache = text is not None
+            current_span().set(cache_hit=from_cache)
+            tokens = 0
+            if from_cache:
+                record_llm_usage()
+            else:
+                text, tokens = self._complete(
+                    messages, temperature,
+                    response_format={"type": "json_object"}  # 显式要求 JSON
+                )
 
-            # 简单的清洗逻辑 (现在的模型通常能很好地遵循 json_object 模式)
-            text = re.sub(r'```json\s*', '', text, flags=re.IGNORECASE)
-            text = re.sub(r'```', '', text)
+            data = self._parse_json(text)
 
-            return json.loads(text)
+            # 只缓存能成功解析的响应，避免把坏结果固化下来
+            if key and not from_cache:
+                self.cache.put(key, {"content": text, "tokens": tokens})
+            return data
         except Exception as e:
             logger.error(f"LLM JSON Error: {e}")
             return {}
 
+    async def achat_json(self, messages: List[Dict[str, str]], on_fields=None,
+                         early_fields=(("action", "params"), ("actions",)), timeout: float = None) -> Dict[str, Any]:
+        """
+        异步流式 JSON 生成。
+        - 边接收边增量解析；early_fields 中任意一组字段全部解析完成时立即回调 on_fields(已完成字段)，
+          调用方可以不等后面较长的 reasoning 就开始执行。
+        - timeout 覆盖整个流 (并截断到当前查询预算的剩余时间)；超时或被取消时关闭连接。
+        """
+        budget = current_budget()
+        if budget:
+            timeout = budget.clip_timeout(timeout)
+        if timeout is not None:
+            try:
+                return await asyncio.wait_for(self._astream_json(messages, on_fields, early_fields), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"LLM JSON Stream timed out after {timeout}s")
+                return {}
+        return await self._astream_json(messages, on_fields, early_fields)
+
+    @traced("llm.stream")
+    async def _astream_json(self, messages, on_fields, early_fields) -> Dict[str, Any]:
+        temperature = 0.1
+        key = self._cache_key(self._cache_payload(messages), temperature) if self.cache is not None else None
+        if key:
+            cached = self._cache_lookup(key)
+            if cached is not None:
+                record_llm_usage()
+                current_span().set(cache_hit=True)
+                data = self._parse_json(cached)
+                if on_fields:
+                    on_fields(data)
+                return data
+
+        start_time = time.time()
+        parser = IncrementalJSONParser()
+        chunks = []
+        usage = None
+        notified = False
+        stream = None
+        try:
+            budget = current_budget()
+            if budget:
+                budget.check_llm()
+            stream = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                chunks.append(delta)
+                fields = parser.feed(delta)
+                if on_fields and not notified and any(
+                        all(f in fields for f in group) for group in early_fields):
+                    notified = True
+                    current_span().set(early_fields_ms=round((time.time() - start_time) * 1000, 1))
+                    on_fields(dict(fields))
+
+            text = "".join(chunks)
+            usage = self._record_usage(usage, start_time)
+            current_span().set(model=self.model, bytes=len(text), **usage)
+            data = self._parse_json(text)
+            if key:
+                self.cache.put(key, {"content": text, "tokens": usage["tokens"]})
+            return data
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"LLM JSON Stream Error: {e}")
+            return {}
+        finally:
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception:
+                    pass
+
+    def flush_cache(self):
+        if self.cache is not None:
+            self.cache.save()
+
 
 # ==============================================================================
 # 3. Parsing (保留，作为 Agent 的任务输入)
 # ==============================================================================
-def parse_query_to_constraints(user_query: str, llm: LLMService, wiki_service: WikidataService) -> List[Constraint]:
+@traced("parse")
+def parse_query_to_constraints(user_query: str, llm: LLMService, wiki_service: WikidataService,
+                               fast_parser: FastPathParser = None) -> List[Constraint]:
     logger.info("Phase 1: Parsing natural language to constraints...")
 
+    # 快速通道：常见句式由规则直接解析 (PID 已确定)，只有规则不能完整覆盖的问题才调用 LLM
+    fast_items = fast_parser.parse(user_query) if fast_parser is not None else None
+    current_span().set(fast_path=fast_items is not None)
+
     # === 修改点 1: Prompt 明确要求 LLM 只提取语义标签，不要猜测 ID ===
     prompt = f"""
         Role: You are a Semantic Parser for Knowledge Graphs.
@@ -142,10 +429,15 @@ def parse_query_to_constraints(user_query: str, llm: LLMService, wiki_service: W
         }}
     """
     try:
-        data = llm.generate_json(prompt)
+        if fast_items is not None:
+            log_event(logger, "parse.fast_path", "[FastPath] Parsed {count} constraints without LLM.",
+                      count=len(fast_items))
+            data = {"constraints": fast_items}
+        else:
+            data = llm.generate_json(prompt)
 
-        # === 调试日志：打印 LLM 到底返回了什么 ===
-        logger.info(f"DEBUG: Raw Parsed JSON: {json.dumps(data, ensure_ascii=False)}")
+        # === 调试日志：LLM 到底返回了什么 (DEBUG 级别，只在输出时才序列化) ===
+        log_event(logger, "parse.raw", "Raw parsed JSON: {data}", level=logging.DEBUG, data=data)
 
         constraints = []
 
@@ -189,26 +481,30 @@ def parse_query_to_constraints(user_query: str, llm: LLMService, wiki_service: W
 
             # 2. [关键] Relation Linking: 标签 -> P-ID
             # 我们不再信任 LLM 的 ID，即使它输出了 (通常是错的)
-            # 强制调用 WikiService 进行搜索
-            linked_pid = wiki_service.search_property(raw_label)
+            # 强制调用 WikiService 进行搜索 (快速通道的 PID 来自规则本身，可以直接使用)
+            linked_pid = item.get("property_id") if fast_items is not None else None
+            if not linked_pid:
+                linked_pid = wiki_service.search_property(raw_label)
 
             if not linked_pid:
                 logger.warning(
                     f"  [Linker Failed] Could not map label '{raw_label}' to a Property ID. Dropping this constraint.")
                 continue  # 丢弃无法链接的属性，防止后续查询报错
 
-            logger.info(f"  [Linker] '{raw_label}' -> {linked_pid}")
+            log_event(logger, "parse.link_property", "  [Linker] '{label}' -> {pid}", label=raw_label, pid=linked_pid)
 
             # 3. Entity Linking: 值 -> Q-ID
             # 如果不是数值/日期，且不是 QID，尝试链接实体
             if not is_quantity and not re.match(r'^Q\d+$', str(final_value)):
                 linked_qid = wiki_service.search_entity(final_value)
                 if linked_qid:
-                    logger.info(f"  [Entity Linker] '{final_value}' -> {linked_qid}")
+                    log_event(logger, "parse.link_entity", "  [Entity Linker] '{value}' -> {qid}",
+                              value=final_value, qid=linked_qid)
                     final_value = linked_qid
                 else:
                     # 如果搜不到实体，可能它本身就是字符串值（如名字），保留原值
-                    logger.info(f"  [Entity Linker] Could not find QID for '{final_value}', keeping as string.")
+                    log_event(logger, "parse.link_entity", "  [Entity Linker] Could not find QID for '{value}', "
+                              "keeping as string.", value=final_value, qid=None)
 
             # 4. 构建约束对象
             c = Constraint(
@@ -235,27 +531,21 @@ def parse_query_to_constraints(user_query: str, llm: LLMService, wiki_service: W
 # 4. Final Response Generation (适配 Agent 结果)
 # ==============================================================================
 def generate_final_report(user_query: str, agent_history: List[str], final_candidates: Set[str], llm: LLMService,
-                          wiki_service: WikidataService):
+                          wiki_service: WikidataService, label_service: LabelService = None):
     """
     Phase 3: 让 LLM 基于 Agent 的思考过程生成最终报告。
     """
     logger.info("Phase 3: Generating Final Report...")
 
-    # 1. 获取最终实体的 Label
+    # 1. 获取最终实体的 Label (优先读本地 Label 表，缺失的才批量请求 wbgetentities)
     entity_labels = []
     if final_candidates:
-        # 只取前 20 个避免溢出
-        target_qids = list(final_candidates)[:20]
-        values_str = " ".join([f"wd:{qid}" for qid in target_qids])
-        sparql = f"""
-        SELECT ?itemLabel WHERE {{
-            VALUES ?item {{ {values_str} }}
-            SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }}
-        }}
-        """
-        results = wiki_service.execute_sparql(sparql)
-        for r in results:
-            entity_labels.append(r.get('itemLabel', {}).get('value', 'Unknown'))
+        if label_service is None:
+            label_service = LabelService(get_shared_store(LABEL_STORE_PATH))
+        # 只取前 20 个避免溢出；排序保证多次运行的报告输入一致
+        target_qids = sorted(final_candidates)[:20]
+        labels = label_service.get_labels(target_qids)
+        entity_labels = [labels[qid] for qid in target_qids]
 
     # 2. 格式化上下文
     history_str = "\n".join([f"- {h}" for h in agent_history])
@@ -287,20 +577,15 @@ def generate_final_report(user_query: str, agent_history: List[str], final_candi
 # 5. 主流程 (The New Agentic Main)
 # ==============================================================================
 def main():
+    setup_logging()
     print("=== CCSP Framework: Agentic Graph of Thoughts ===\n")
 
-    # 1. 配置
-    api_key = os.getenv("LLM_API_KEY")
-    base_url = os.getenv("LLM_BASE_URL")
-    model_name = os.getenv("model_name")  # 确保模型名正确
+    # 1. 配置 (LLM_API_KEY / LLM_BASE_URL / model_name 由 init_services 读取)
+    llm_cache_path = os.getenv("LLM_CACHE_PATH")  # 可选：LLM 响应磁盘缓存
 
     # 2. 基础设施初始化
     try:
-        llm_service = LLMService(api_key, base_url, model_name)
-        wiki_service = WikidataService()
-
-        # [CHANGE] 初始化优化器，传入 wiki_service，不再需要 metadata_path
-        optimizer = ConstraintOptimizer(wiki_service)
+        llm_service, wiki_service, optimizer = init_services(llm_cache_path)
 
         logger.info("Infrastructure initialized.")
 
@@ -312,36 +597,42 @@ def main():
     user_query = "Which comedy film starring Taylor Lautner was released after 2009 and has a runtime of less than 122.5 minutes?"
     print(f"Query: {user_query}\n")
 
-    # 4. Phase 1: Parsing (将自然语言转为 Agent 的待办事项)
-    constraints = parse_query_to_constraints(user_query, llm_service, wiki_service)
-
-    print("\n--- Normalizing Units ---")
-    normalizer = UnitNormalizer()
-    constraints = normalizer.normalize(constraints)
-
-    print("\n[System] Probing database for optimal execution path...")
-    constraints = optimizer.optimize(constraints)
-
-    if not constraints:
-        logger.error("No constraints parsed. Exiting.")
-        return
-
-    print(f"Parsed {len(constraints)} constraints.")
-    for c in constraints:
-        print(f" - {c.property_label}: {c.value} (Op: {c.operator})")
-
-    # 5. Phase 2: Agent Assembly & Execution (Agent 组装与执行)
-    print("\n--- Handing over to GoT Agent ---")
-
-    # 组装部件
-    env = GraphEnvironment(wiki_service)  # 工具箱
-    critic = StatisticalCritic(optimizer)
-    agent = GoTAgent(llm_service, env, critic)
-    # Agent 开始自主解题
-    final_candidates = agent.solve(user_query, constraints)
-
-    # 6. Phase 3: Reporting
-    generate_final_report(user_query, agent.state.history, final_candidates, llm_service, wiki_service)
+    # 设置 CCSP_TRACE_FILE 时记录各阶段 / 各次调用的 span (JSONL)，用 `python tracing.py <file>` 转成 Chrome trace
+    tracer.configure(os.getenv("CCSP_TRACE_FILE"))
+    with tracer.trace("query", query=user_query):
+        # 4. Phase 1: Parsing (将自然语言转为 Agent 的待办事项)
+        constraints = parse_query_to_constraints(user_query, llm_service, wiki_service, fast_parser=fast_parser_from_env())
+
+        print("\n--- Normalizing Units ---")
+        normalizer = UnitNormalizer()
+        constraints = normalizer.normalize(constraints)
+
+        print("\n[System] Probing database for optimal execution path...")
+        constraints = optimizer.optimize(constraints)
+
+        if not constraints:
+            logger.error("No constraints parsed. Exiting.")
+            return
+
+        print(f"Parsed {len(constraints)} constraints.")
+        for c in constraints:
+            print(f" - {c.property_label}: {c.value} (Op: {c.operator})")
+
+        # 5. Phase 2: Agent Assembly & Execution (Agent 组装与执行)
+        print("\n--- Handing over to GoT Agent ---")
+
+        # 组装部件
+        env = GraphEnvironment(wiki_service)  # 工具箱
+        critic = StatisticalCritic(optimizer)
+        agent = GoTAgent(llm_service, env, critic)
+        # Agent 开始自主解题
+        final_candidates = agent.solve(user_query, constraints)
+        log_event(logger, "agent.metrics", "Agent metrics: {metrics}", metrics=dict(agent.metrics))
+
+        # 6. Phase 3: Reporting
+        generate_final_report(user_query, agent.state.history, final_candidates, llm_service, wiki_service)
+    llm_service.flush_cache()
+    tracer.flush()  # 根 span 结束后才完成的 span (如被放弃的推测执行)
 
 
 if __name__ == "__main__":
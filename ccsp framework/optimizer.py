@@ -1,54 +1,279 @@
 import math
+import re
 import logging
-from typing import List
+from typing import Dict, List, Optional
 from data_model import Constraint
+from property_stats import PropertyStatistics
+from persistent_cache import JsonFileStore
+from anchor_ranker import AnchorRanker
+from budget import BudgetExceeded, QueryBudget, current_budget
+from tracing import traced
+from log_pipeline import log_event
+from unit_utils import NORMALIZED_PROPERTIES, PROPERTY_UNITS, quantity_triple, to_storage_unit
 
 logger = logging.getLogger(__name__)
 
 
 class ConstraintOptimizer:
-    def __init__(self, wiki_service):
+    def __init__(self, wiki_service, stats: Optional[PropertyStatistics] = None,
+                 probe_store: Optional[JsonFileStore] = None, ranker: Optional[AnchorRanker] = None):
         self.wiki_service = wiki_service
+        # 离线统计 (直方图等)，为 None 时所有约束都走在线探测
+        self.stats = stats
+        # 跨查询共享的探测结果 (Constraint.signature() -> {"rows", "limit"})
+        self.probe_store = probe_store
+        # 本地锚点模型：提供时，本地统计无法判定的约束直接由模型打分，不再在线探测
+        self.ranker = ranker
         # [SETTING] 阈值：如果数量超过这个数，就认为不适合做 Anchor
         self.PROBE_LIMIT = 1000
+        # [SETTING] 本地估算的置信边界：只有估算值离阈值足够远时才跳过在线探测
+        self.LOCAL_ESTIMATE_MARGIN = 10
+        # [SETTING] 渐进式探测的 (LIMIT, timeout) 阶段：先用小 LIMIT 快速判定，
+        # 只有处于边界的约束才升级到 PROBE_LIMIT
+        self.PROBE_STAGES = [(self.PROBE_LIMIT // 10, 1.0), (self.PROBE_LIMIT, 2.0)]
+        # [SETTING] UNION 合并探测的超时倍数 (相对单个探测)，超时后回退为逐个探测
+        self.BATCH_TIMEOUT_FACTOR = 1.5
 
-    def optimize(self, constraints: List[Constraint]) -> List[Constraint]:
-        logger.info("--- Starting Dynamic Probing (Limit-based) ---")
+    @traced("optimize")
+    def optimize(self, constraints: List[Constraint], budget: Optional[QueryBudget] = None) -> List[Constraint]:
+        logger.info("--- Starting Dynamic Probing (Progressive, Limit-based) ---")
+        budget = budget or current_budget()
 
+        pending, decided = [], []
         for c in constraints:
-            # 1. 构造 LIMIT 查询 (不再是 COUNT)
-            sparql = self._build_probe_query(c, limit=self.PROBE_LIMIT + 1)
+            # 0. 先尝试用离线统计估算，结论明确时无需探测
+            if self._apply_local_estimate(c):
+                decided.append(c)
+            else:
+                pending.append(c)
+
+        if self.ranker and pending:
+            self._apply_ranker(pending)
+            pending = []
+        elif budget and budget.is_short() and pending:
+            # 预算不足：不再在线探测，未知约束排在本地已判定的约束之后
+            for c in pending:
+                c.estimated_rows = 999_999_999
+                c.priority_score = 0.0
+            logger.warning(f"Probe: budget running short, skipped probing {len(pending)} constraints")
+            pending = []
 
-            # 2. 执行探测
-            # 这里的 timeout 可以设短一点 (比如 2s)，因为 LIMIT 查询通常极快
-            # 如果 2s 还没返回前 1000 个，那网络肯定有问题或者查询太复杂
-            rows_found = self.wiki_service.probe_query_count(sparql, timeout_sec=2.0)
+        # 实体等值约束通常最有选择性，先探测它们，后面的约束更容易提前终止
+        pending.sort(key=lambda x: 0 if x.operator == "=" and self._is_qid(x.value) else 1)
 
-            # 3. 逻辑判定
+        # 当前已知的最小行数：其他约束一旦确定比它大，排序就已确定，无需继续升级探测
+        best_rows = min((c.estimated_rows for c in decided), default=None)
+
+        for c, (rows_found, is_lower_bound) in self._progressive_probe(pending, best_rows, budget):
+            # 逻辑判定
             if rows_found > self.PROBE_LIMIT:
                 # 超过阈值，说明是个大集合
                 c.estimated_rows = 999_999_999  # 标记为极大，强迫排在后面
                 c.priority_score = 0.0
-                logger.info(f"Probe: {c.property_label} -> Hit Limit (> {self.PROBE_LIMIT})")
+                log_event(logger, "optimizer.probe", "Probe: {label} -> Hit Limit (> {limit})",
+                          label=c.property_label, pid=c.property_id, outcome="limit", limit=self.PROBE_LIMIT)
             elif rows_found == -1:
                 # 超时或错误
                 c.estimated_rows = 999_999_999
                 c.priority_score = 0.0
-                logger.info(f"Probe: {c.property_label} -> Timeout/Error")
+                log_event(logger, "optimizer.probe", "Probe: {label} -> Timeout/Error",
+                          label=c.property_label, pid=c.property_id, outcome="error")
             else:
-                # 小于阈值，这是精确的具体数量，适合做 Anchor
+                # rows_found 是精确数量，或者 (提前终止时) 是一个下界：下界只用于排序，不能当作锚点的规模
                 c.estimated_rows = rows_found
+                c.rows_lower_bound = is_lower_bound
                 # +2 防止 log(0) 或 log(1)
                 c.priority_score = 1.0 / math.log10(rows_found + 2)
-                logger.info(f"Probe: {c.property_label} -> {rows_found} rows (Anchor Candidate!)")
+                if is_lower_bound:
+                    log_event(logger, "optimizer.probe", "Probe: {label} -> >= {rows} rows (ranking decided, stop)",
+                              label=c.property_label, pid=c.property_id, outcome="lower_bound", rows=rows_found)
+                else:
+                    log_event(logger, "optimizer.probe", "Probe: {label} -> {rows} rows (Anchor Candidate!)",
+                              label=c.property_label, pid=c.property_id, outcome="exact", rows=rows_found)
+
+        if self.probe_store:
+            self.probe_store.save()
 
-        # 4. 排序
-        sorted_constraints = sorted(constraints, key=lambda x: x.priority_score, reverse=True)
+        # 排序
+        sorted_constraints = sorted(constraints, key=self._sort_key)
         return sorted_constraints
 
-    def _build_probe_query(self, c: Constraint, limit: int) -> str:
+    def _sort_key(self, c: Constraint):
+        """
+        行数 (探测 / 本地统计) 与模型概率不在同一个量纲上，分组排序而不是混在 priority_score 里比较：
+        0. 已知规模不超过 PROBE_LIMIT 的约束，按 priority_score；
+        1. 模型判定为好锚点的约束，按 anchor_score；
+        2. 模型判定不是好锚点的约束，按 anchor_score；
+        3. 已知的大集合 / 超时 / 探测下界等其余约束，按 priority_score。
+        """
+        if c.estimated_rows == -1 and c.anchor_score is not None:
+            confident = self.ranker is not None and c.anchor_score >= self.ranker.threshold
+            return (1 if confident else 2, -c.anchor_score)
+        if 0 <= c.estimated_rows <= self.PROBE_LIMIT and not c.rows_lower_bound:
+            return (0, -c.priority_score)
+        return (3, -c.priority_score)
+
+    def _apply_ranker(self, constraints: List[Constraint]):
         """
-        构造带 LIMIT 的 SELECT 查询
+        用本地模型代替在线探测：estimated_rows 保持未知 (-1)，anchor_score 为好锚点概率。
+        priority_score 不写入概率 (排序见 _sort_key)。
+        """
+        for c, score in self.ranker.rank(constraints):
+            c.anchor_score = score
+            logger.info(f"Model: {c.property_label} -> anchor score {score:.3f}"
+                        f"{' (Anchor Candidate!)' if score >= self.ranker.threshold else ''}")
+
+    def _progressive_probe(self, constraints: List[Constraint], best_rows: Optional[int],
+                           budget: Optional[QueryBudget] = None):
+        """
+        逐级放大 LIMIT 的有界 COUNT 探测，每个阶段把所有待探测约束合并为一次 UNION 请求。
+        返回 [(constraint, (rows, is_lower_bound))]：
+          - rows <= 当前阶段 limit：精确行数
+          - rows > PROBE_LIMIT：大集合
+          - is_lower_bound=True：已有更小的候选 Anchor，提前终止，rows 只是下界
+          - rows == -1：超时/错误 (小 LIMIT 都跑不完，直接视为代价无穷大)
+        预算不足时不再升级到下一阶段，未决约束按下界返回；探测时预算耗尽 (BudgetExceeded) 则未探测的约束按 -1 返回。
+        """
+        results = []
+        active = list(constraints)
+
+        for stage_idx, (limit, timeout_sec) in enumerate(self.PROBE_STAGES):
+            if not active:
+                break
+
+            # 其他查询探测过相同签名的约束时直接复用，剩下的合并探测
+            counts = {}
+            to_probe = []
+            for c in active:
+                cached = self._lookup_probe(c, limit=limit)
+                if cached is None:
+                    to_probe.append(c)
+                else:
+                    counts[id(c)] = cached
+            try:
+                counts.update(self._probe_batch(to_probe, limit, timeout_sec))
+            except BudgetExceeded as e:
+                # 探测途中预算耗尽：停止探测，未探测到的约束按超时处理 (排在后面)，超过本阶段 limit 的只是下界
+                logger.warning(f"Probe: budget exhausted at LIMIT {limit} ({e}), stop probing {len(to_probe)} constraints")
+                for c in active:
+                    rows_found = counts.get(id(c), -1)
+                    results.append((c, (rows_found, rows_found > limit)))
+                break
+
+            escalate = []
+            for c in active:
+                rows_found = counts[id(c)]
+                if rows_found == -1 or rows_found <= limit:
+                    results.append((c, (rows_found, False)))
+                    if rows_found >= 0:
+                        best_rows = rows_found if best_rows is None else min(best_rows, rows_found)
+                else:
+                    escalate.append(c)
+
+            is_last_stage = stage_idx == len(self.PROBE_STAGES) - 1
+            budget_short = budget is not None and budget.is_short()
+            if is_last_stage or budget_short or (best_rows is not None and best_rows <= limit):
+                results.extend((c, (counts[id(c)], not is_last_stage)) for c in escalate)
+                break
+            active = escalate
+
+        return results
+
+    def _probe_batch(self, constraints: List[Constraint], limit: int, timeout_sec: float) -> Dict[int, int]:
+        """
+        把多个约束的有界探测合并为一个带标签的 UNION 查询，一次往返拿到所有计数。
+        合并查询超时/出错时自动回退为逐个探测。返回 {id(constraint): rows}。
+        """
+        counts = {}
+        if len(constraints) > 1:
+            tags = {f"t{i}": c for i, c in enumerate(constraints)}
+            sparql = self._build_batch_probe_query(tags, limit=limit + 1)
+            tagged = self.wiki_service.probe_tagged_counts(sparql, timeout_sec=timeout_sec * self.BATCH_TIMEOUT_FACTOR)
+            if tagged is not None:
+                for tag, c in tags.items():
+                    # GROUP BY 不会返回 0 行的分支
+                    counts[id(c)] = tagged.get(tag, 0)
+                    self._record_probe(c, counts[id(c)], limit=limit)
+                logger.info(f"Probe: batched {len(constraints)} constraints in one request (LIMIT {limit + 1})")
+                return counts
+            logger.info(f"Probe: batched request failed, falling back to {len(constraints)} single probes")
+
+        for c in constraints:
+            sparql = self._build_probe_query(c, limit=limit + 1, count_only=True)
+            counts[id(c)] = self.wiki_service.probe_bounded_count(sparql, timeout_sec=timeout_sec)
+            self._record_probe(c, counts[id(c)], limit=limit)
+        return counts
+
+    @staticmethod
+    def _is_qid(value) -> bool:
+        val_str = str(value)
+        return val_str.startswith("Q") and val_str[1:].isdigit()
+
+    def _lookup_probe(self, c: Constraint, limit: int) -> Optional[int]:
+        """
+        查询共享探测结果。
+        存储的 rows <= limit 表示精确行数；rows > limit 表示"超过 limit"，只能回答不超过该 limit 的问题。
+        """
+        if not self.probe_store:
+            return None
+        entry = self.probe_store.get(c.signature())
+        if not entry:
+            return None
+        rows, stored_limit = entry["rows"], entry["limit"]
+        if rows <= stored_limit:
+            return rows
+        if stored_limit >= limit:
+            return limit + 1
+        return None
+
+    def _record_probe(self, c: Constraint, rows_found: int, limit: int):
+        # 超时/错误不缓存，下次仍然重试
+        if self.probe_store is None or rows_found < 0:
+            return
+        self.probe_store.put(c.signature(), {"rows": rows_found, "limit": limit})
+
+    def _apply_local_estimate(self, c: Constraint) -> bool:
+        """
+        用离线统计 (范围约束用直方图，实体等值约束用 Count-Min Sketch) 估算约束基数。
+        Sketch 对长尾二元组给出的是上界，上界远小于 PROBE_LIMIT 时可以不探测直接判定为 Anchor。
+        返回 True 表示估算结论足够明确 (远大于或远小于 PROBE_LIMIT)，已写入 c。
+        """
+        if not self.stats:
+            return False
+
+        value = c.value
+        if c.property_id in NORMALIZED_PROPERTIES:
+            # 直方图由 wdt: 原始数值构建，按存储单位解释；约束值是 SI 单位，查表前换算回去
+            try:
+                value = to_storage_unit(c.property_id, float(value))
+            except (TypeError, ValueError):
+                return False
+        result = self.stats.estimate_rows(c.property_id, c.operator, value)
+        if result is None:
+            return False
+        est, exact = result
+
+        if est > self.PROBE_LIMIT and (exact or est > self.PROBE_LIMIT * self.LOCAL_ESTIMATE_MARGIN):
+            c.estimated_rows = 999_999_999
+            c.priority_score = 0.0
+            log_event(logger, "optimizer.estimate", "Estimate: {label} -> ~{rows} rows (local stats, skip probe)",
+                      label=c.property_label, pid=c.property_id, rows=est, anchor=False)
+            return True
+
+        if exact or est < self.PROBE_LIMIT / self.LOCAL_ESTIMATE_MARGIN:
+            c.estimated_rows = est
+            c.rows_lower_bound = False
+            c.priority_score = 1.0 / math.log10(est + 2)
+            log_event(logger, "optimizer.estimate",
+                      "Estimate: {label} -> ~{rows} rows (local stats, Anchor Candidate!)", label=c.property_label, pid=c.property_id, rows=est, anchor=True)
+            return True
+
+        # 处于阈值附近，估算误差可能影响排序，交给在线探测
+        return False
+
+    def _build_probe_pattern(self, c: Constraint) -> str:
+        """
+        构造探测用的图模式 (三元组 + FILTER)
         """
         pid = c.property_id if c.property_id else "P0"
 
@@ -65,8 +290,13 @@ class ConstraintOptimizer:
         elif c.operator in [">", "<"]:
             val_str = str(c.value)
 
+            # Case 0: 数值属性 (已由 UnitNormalizer 换算，物理量取 SI 归一化值)，4 位数也不当作年份
+            if pid in PROPERTY_UNITS and re.match(r'^-?\d+(\.\d+)?$', val_str):
+                triple = quantity_triple(pid)
+                filter_clause = f"FILTER(?v {c.operator} {val_str})"
+
             # Case 1: 年份 (2020)
-            if val_str.isdigit() and len(val_str) == 4:
+            elif val_str.isdigit() and len(val_str) == 4:
                 filter_clause = f"FILTER(YEAR(?v) {c.operator} {val_str})"
 
             # Case 2: [FIX] 完整日期 (YYYY-MM-DD) -> 必须加引号和类型
@@ -82,13 +312,51 @@ class ConstraintOptimizer:
         elif c.operator == "contains":
             filter_clause = f"FILTER(CONTAINS(LCASE(STR(?v)), LCASE('{c.value}')))"
 
+        return f"""
+            {triple} 
+            {filter_clause}
+        """
+
+    def _build_probe_query(self, c: Constraint, limit: int, count_only: bool = False) -> str:
+        """
+        构造带 LIMIT 的 SELECT 查询。
+        count_only=True 时在外层包一层 COUNT，服务端只返回 min(行数, limit) 这一个数字。
+        """
         # === [Change] 使用 LIMIT ===
         # 我们只查 ?item，不需要 ?v，且加上 DISTINCT
         query = f"""
         SELECT DISTINCT ?item WHERE {{
-            {triple} 
-            {filter_clause}
+            {self._build_probe_pattern(c)}
         }}
         LIMIT {limit}
         """
-        return query
\ No newline at end of file
+        if count_only:
+            query = f"""
+            SELECT (COUNT(*) AS ?c) WHERE {{
+                {{ {query} }}
+            }}
+            """
+        return query
+
+    def _build_batch_probe_query(self, tagged_constraints: Dict[str, Constraint], limit: int) -> str:
+        """
+        多约束合并探测：每个约束是一个带 LIMIT 的子查询分支，用 BIND 打上标签后 UNION，
+        外层按标签 GROUP BY 计数。
+        """
+        branches = []
+        for tag, c in tagged_constraints.items():
+            branches.append(f"""
+            {{
+                {{ SELECT DISTINCT ?item WHERE {{
+                    {self._build_probe_pattern(c)}
+                }} LIMIT {limit} }}
+                BIND("{tag}" AS ?tag)
+            }}""")
+
+        union_body = "\n            UNION".join(branches)
+        return f"""
+        SELECT ?tag (COUNT(?item) AS ?c) WHERE {{
+            {union_body}
+        }}
+        GROUP BY ?tag
+        """
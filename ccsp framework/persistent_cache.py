@@ -0,0 +1,108 @@
+# persistent_cache.py
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFileStore:
+    """
+    线程安全的 Key-Value 缓存，可选持久化到 JSON 文件。
+    - path 为 None 时只在内存中生效。
+    - max_entries 不为 None 时按 LRU 淘汰最久未访问的条目。
+    - 每新增 autosave_every 条自动落盘一次，进程退出时再保存一次。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None, autosave_every: int = 50):
+        self.path = path
+        self.max_entries = max_entries
+        self.autosave_every = autosave_every
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._data.update(data)
+            logger.info(f"[Cache] Loaded {len(self._data)} entries from {self.path}")
+        except Exception as e:
+            logger.warning(f"[Cache] Failed to load {self.path}: {e}")
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+            self._dirty += 1
+            should_save = self.path and self._dirty >= self.autosave_every
+        if should_save:
+            self.save()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def save(self):
+        """原子写入：先写临时文件再替换，避免中途崩溃留下半个 JSON"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._data)
+            self._dirty = 0
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"[Cache] Failed to save {self.path}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# === 进程级共享：同一路径只创建一个 Store，所有 Optimizer / Agent 实例共用 ===
+_SHARED_STORES: Dict[str, JsonFileStore] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared_store(path: str, **kwargs) -> JsonFileStore:
+    key = os.path.abspath(path)
+    with _SHARED_LOCK:
+        store = _SHARED_STORES.get(key)
+        if store is None:
+            store = JsonFileStore(path, **kwargs)
+            _SHARED_STORES[key] = store
+            atexit.register(store.save)
+        return store
@@ -0,0 +1,173 @@
+# property_linker.py
+import heapq
+import json
+import logging
+import math
+import re
+import time
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+
+
+def normalize_label(text: str) -> str:
+    """小写、去标点、合并空白：'Date of Birth' / 'date-of-birth' -> 'date of birth'"""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", str(text).lower()).split())
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Dict[str, int]:
+    padded = f" {text} "
+    grams: Dict[str, int] = defaultdict(int)
+    for i in range(max(len(padded) - n + 1, 1)):
+        grams[padded[i:i + n]] += 1
+    return grams
+
+
+class PropertyLinker:
+    """
+    离线 Relation Linker：属性 Label + 别名快照上的字符 n-gram TF-IDF 检索。
+    - 规范化后完全匹配 Label / 别名时直接命中 (哈希查找)；
+    - 否则用倒排索引计算余弦相似度。模糊结果只有同时满足以下条件才采纳，否则交给调用方走在线 API：
+      得分不低于 min_score、领先第二名 PID 至少 min_margin、查询中的词全部出现在命中的名称里 (min_coverage)。
+    同名冲突时 Label 优先于别名，再按属性三元组数 (popularity) 排序。
+    """
+
+    def __init__(self, properties: Dict[str, Dict], popularity: Optional[Dict[str, float]] = None,
+                 min_score: float = 0.6, max_df_ratio: float = 0.05, min_margin: float = 0.1,
+                 min_coverage: float = 1.0):
+        self.properties = properties
+        self.popularity = popularity or {}
+        self.min_score = min_score
+        # 字符 n-gram 相似度对近义 / 反义属性 (如 "place of birth" 与 "place of death") 区分度不够，
+        # 模糊命中还要求领先第二名足够多，并覆盖查询中的全部词
+        self.min_margin = min_margin
+        self.min_coverage = min_coverage
+        # 出现在超过该比例名称中的 n-gram (如 " of") 区分度很低，检索时不遍历其倒排表，只计入查询向量的模长
+        self.max_df_ratio = max_df_ratio
+        # 名称表：(pid, 规范化名称, 是否为 Label)
+        self.names: List[Tuple[str, str, bool]] = []
+        self.exact: Dict[str, List[int]] = defaultdict(list)
+        for pid, entry in properties.items():
+            label = normalize_label(entry.get("label") or "")
+            if label:
+                self._add_name(pid, label, True)
+            for alias in entry.get("aliases") or []:
+                alias = normalize_label(alias)
+                if alias and alias != label:
+                    self._add_name(pid, alias, False)
+        # n-gram 倒排索引在第一次模糊匹配时再构建，只做完全匹配时不付这部分启动开销
+        self._postings: Optional[Dict[str, List[Tuple[int, float]]]] = None
+        self._idf: Dict[str, float] = {}
+
+    def _add_name(self, pid: str, name: str, is_label: bool):
+        self.exact[name].append(len(self.names))
+        self.names.append((pid, name, is_label))
+
+    def _rank_key(self, idx: int):
+        pid, _, is_label = self.names[idx]
+        return is_label, self.popularity.get(pid, 0.0)
+
+    def _build_index(self):
+        start = time.time()
+        doc_grams = [char_ngrams(name) for _, name, _ in self.names]
+        df: Dict[str, int] = defaultdict(int)
+        for grams in doc_grams:
+            for g in grams:
+                df[g] += 1
+        n_docs = len(doc_grams)
+        self._idf = {g: math.log((n_docs + 1) / (c + 1)) + 1.0 for g, c in df.items()}
+
+        postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for idx, grams in enumerate(doc_grams):
+            weights = {g: tf * self._idf[g] for g, tf in grams.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for g, w in weights.items():
+                postings[g].append((idx, w / norm))
+        self._postings = dict(postings)
+        logger.info(f"[PropertyLinker] Indexed {n_docs} names ({len(self._postings)} n-grams) "
+                    f"in {time.time() - start:.2f}s.")
+
+    def search(self, label: str, top_k: int = 5) -> List[Tuple[str, float]]:
+        """返回 [(pid, 相似度)]，按相似度降序，每个 PID 只保留其最佳名称"""
+        query = normalize_label(label)
+        if not query:
+            return []
+        hits = self.exact.get(query)
+        if hits:
+            best = max(hits, key=self._rank_key)
+            return [(self.names[best][0], 1.0)]
+        return [(pid, score) for pid, score, _ in self._fuzzy(query, top_k)]
+
+    def _fuzzy(self, query: str, top_k: int) -> List[Tuple[str, float, int]]:
+        """n-gram 余弦检索，返回 [(pid, 相似度, 最佳名称下标)]"""
+        if self._postings is None:
+            self._build_index()
+        grams = char_ngrams(query)
+        weights = {g: tf * self._idf[g] for g, tf in grams.items() if g in self._idf}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        if not norm:
+            return []
+
+        scores: Dict[int, float] = defaultdict(float)
+        max_df = max(int(len(self.names) * self.max_df_ratio), 1)
+        for g, w in weights.items():
+            postings = self._postings[g]
+            if len(postings) > max_df:
+                continue
+            qw = w / norm
+            for idx, dw in postings:
+                scores[idx] += qw * dw
+
+        # 只对得分最高的一小部分名称计算排序键 (Label 优先 / popularity)，避免对所有候选做 Python 级排序
+        best_by_pid: Dict[str, Tuple[Tuple[float, Tuple], int]] = {}
+        for idx, score in heapq.nlargest(top_k * 8, scores.items(), key=itemgetter(1)):
+            pid = self.names[idx][0]
+            key = (round(score, 6), self._rank_key(idx))
+            if pid not in best_by_pid or key > best_by_pid[pid][0]:
+                best_by_pid[pid] = (key, idx)
+        ranked = sorted(best_by_pid.items(), key=lambda x: x[1][0], reverse=True)[:top_k]
+        return [(pid, key[0], idx) for pid, (key, idx) in ranked]
+
+    def link(self, label: str) -> Optional[str]:
+        """
+        完全匹配 Label / 别名时直接返回 PID；模糊结果需满足 min_score、min_margin 与 min_coverage，
+        否则返回 None (调用方应回退到在线搜索)。
+        """
+        query = normalize_label(label)
+        if not query:
+            return None
+        hits = self.exact.get(query)
+        if hits:
+            return self.names[max(hits, key=self._rank_key)][0]
+
+        results = self._fuzzy(query, top_k=2)
+        if not results:
+            return None
+        pid, score, idx = results[0]
+        if score < self.min_score:
+            return None
+        if len(results) > 1 and score - results[1][1] < self.min_margin:
+            return None
+        query_tokens = set(query.split())
+        name_tokens = set(self.names[idx][1].split())
+        if len(query_tokens & name_tokens) / len(query_tokens) < self.min_coverage:
+            return None
+        return pid
+
+    # --- 持久化 ---
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"generated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "properties": self.properties},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, popularity: Optional[Dict[str, float]] = None, **kwargs) -> "PropertyLinker":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        linker = cls(data.get("properties", {}), popularity=popularity, **kwargs)
+        logger.info(f"[PropertyLinker] Loaded {len(linker.properties)} properties, {len(linker.names)} names.")
+        return linker
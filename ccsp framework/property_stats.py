@@ -0,0 +1,370 @@
+# property_stats.py
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import struct
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EquiDepthHistogram:
+    """
+    等深直方图：bounds 为 N+1 个分位点，每个桶包含约 total/N 个值。
+    kind = "numeric" 时值域为原始数值；kind = "date" 时值域为小数年份 (1981.25 = 1981 年 4 月初)。
+    """
+
+    def __init__(self, kind: str, total: int, bounds: List[float]):
+        self.kind = kind
+        self.total = total
+        self.bounds = bounds
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Optional["EquiDepthHistogram"]:
+        bounds = [float(b) for b in data.get("bounds", []) if b is not None]
+        if len(bounds) < 2 or not data.get("total"):
+            return None
+        return cls(data.get("kind", "numeric"), int(data["total"]), sorted(bounds))
+
+    def to_dict(self) -> Dict:
+        return {"kind": self.kind, "total": self.total, "bounds": self.bounds}
+
+    def _cdf(self, x: float, inclusive: bool) -> float:
+        """返回 <= x (inclusive) 或 < x 的值所占比例，桶内线性插值"""
+        bounds = self.bounds
+        n_buckets = len(bounds) - 1
+        if x < bounds[0] or (x == bounds[0] and not inclusive):
+            return 0.0
+        if x > bounds[-1] or (x == bounds[-1] and inclusive):
+            return 1.0
+
+        # 重复的分位点 (如大量 1月1日 的日期) 用 bisect_left / bisect_right 区分严格与非严格比较
+        if inclusive:
+            i = bisect.bisect_right(bounds, x) - 1
+        else:
+            i = bisect.bisect_left(bounds, x) - 1
+        i = min(max(i, 0), n_buckets - 1)
+
+        lo, hi = bounds[i], bounds[i + 1]
+        frac = (x - lo) / (hi - lo) if hi > lo else 1.0
+        return min(max((i + frac) / n_buckets, 0.0), 1.0)
+
+    def selectivity(self, operator: str, x: float) -> Optional[float]:
+        if operator == "<":
+            return self._cdf(x, inclusive=False)
+        if operator == ">":
+            return 1.0 - self._cdf(x, inclusive=True)
+        if operator == ">=":
+            return 1.0 - self._cdf(x, inclusive=False)
+        return None
+
+    def estimate_rows(self, operator: str, x: float) -> Optional[int]:
+        sel = self.selectivity(operator, x)
+        if sel is None:
+            return None
+        return int(round(self.total * sel))
+
+
+def to_decimal_year(val_str: str, operator: str = "<") -> Optional[float]:
+    """
+    把约束值转换为直方图的日期值域 (小数年份)。
+    注意：纯年份会被翻译成 YEAR(?v) 过滤，"> 2009" 等价于 ">= 2010-01-01"，
+    因此返回 2010.0 时调用方应按 ">=" (不含边界的 CDF) 计算，见 PropertyStatistics.estimate_range_rows。
+    """
+    val_str = str(val_str).strip()
+    if re.match(r'^-?\d{4}$', val_str):
+        year = int(val_str)
+        return float(year + 1) if operator == ">" else float(year)
+
+    m = re.match(r'^(-?\d{4})-(\d{2})-(\d{2})', val_str)
+    if m:
+        year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        return year + max(month - 1, 0) / 12.0 + max(day - 1, 0) / 365.25
+
+    try:
+        return float(val_str)
+    except ValueError:
+        return None
+
+
+# === 离线统计脚本 (download_Wiki.py / download_wiki2.py) 共用的直方图构建 ===
+def parsed_values_sql(source: str, where: str = "") -> str:
+    """
+    DuckDB CTE：从三元组中提取 pid，并把数值 (xsd:decimal/double/float/integer) 与日期 (xsd:dateTime)
+    解析为 num_val / date_val。日期换算为小数年份，与 to_decimal_year 保持一致。
+    source 为 FROM 子句 (如 read_parquet([...]))，where 为可选的 WHERE 条件。
+    """
+    where_clause = f"WHERE {where}" if where else ""
+    return fr"""
+    parsed AS (
+        SELECT
+            regexp_extract(predicate, 'P\d+', 0) as pid,
+            "object",
+            CASE WHEN regexp_matches("object", 'XMLSchema#(decimal|double|float|integer)')
+                 THEN TRY_CAST(regexp_extract("object", '^"?([+-]?[0-9][0-9.eE+-]*)', 1) AS DOUBLE)
+            END as num_val,
+            CASE WHEN regexp_matches("object", 'XMLSchema#dateTime')
+                 THEN TRY_CAST(regexp_extract("object", '^"?([+-]?\d+)-\d{{2}}-\d{{2}}', 1) AS DOUBLE)
+                      + GREATEST(TRY_CAST(regexp_extract("object", '^"?[+-]?\d+-(\d{{2}})', 1) AS DOUBLE) - 1, 0) / 12.0
+                      + GREATEST(TRY_CAST(regexp_extract("object", '^"?[+-]?\d+-\d{{2}}-(\d{{2}})', 1) AS DOUBLE) - 1, 0) / 365.25
+            END as date_val
+        FROM {source}
+        {where_clause}
+    )"""
+
+
+def histogram_columns_sql(buckets: int) -> str:
+    """在 parsed CTE 上按 pid 聚合时使用的直方图列：数值 / 日期的计数与 buckets+1 个等深分位点"""
+    quantiles = [round(i / buckets, 6) for i in range(buckets + 1)]
+    return (f"COUNT(num_val) as num_count,\n"
+            f"        approx_quantile(num_val, {quantiles}) as num_bounds,\n"
+            f"        COUNT(date_val) as date_count,\n"
+            f"        approx_quantile(date_val, {quantiles}) as date_bounds")
+
+
+def build_histogram(row, min_values: int) -> Optional[Dict]:
+    """
+    从聚合结果中选出数值或日期分位点 (取样本更多的一种)，生成紧凑的等深直方图 (EquiDepthHistogram.to_dict 格式)。
+    样本少于 min_values 时返回 None。
+    """
+    num_count = int(row['num_count'] or 0)
+    date_count = int(row['date_count'] or 0)
+
+    if date_count >= num_count:
+        kind, total, bounds = "date", date_count, row['date_bounds']
+    else:
+        kind, total, bounds = "numeric", num_count, row['num_bounds']
+
+    if total < min_values or bounds is None:
+        return None
+
+    bounds = [round(float(b), 4) for b in bounds if b is not None]
+    if len(bounds) < 2:
+        return None
+
+    return {"kind": kind, "total": total, "bounds": bounds}
+
+
+# === Count-Min Sketch 的哈希参数 ===
+# 必须与 download_Wiki.py 中 DuckDB 侧的计算保持一致：
+#   key   = (pid_num * 2^32 + qid_num) mod P
+#   col_i = ((a_i * key + b_i) mod P) mod width
+SKETCH_PRIME = 2147483647  # 2^31 - 1
+SKETCH_SEEDS = [
+    (1103515245, 12345),
+    (214013, 2531011),
+    (1664525, 1013904223),
+    (22695477, 1),
+    (134775813, 7),
+    (69069, 362437),
+]
+
+
+def pair_key(pid: str, qid: str) -> Optional[int]:
+    """(P161, Q23359) -> 整数键；非 PID/QID 返回 None"""
+    m_p = re.match(r'^P(\d+)$', str(pid))
+    m_q = re.match(r'^Q(\d+)$', str(qid))
+    if not m_p or not m_q:
+        return None
+    return (int(m_p.group(1)) * 4294967296 + int(m_q.group(1))) % SKETCH_PRIME
+
+
+class CountMinSketch:
+    """
+    (pid, object QID) 频次的 Count-Min Sketch + 精确的 Heavy Hitter 表。
+    - Heavy Hitter：频次超过 heavy_min 的二元组，精确计数。
+    - Sketch：其余长尾二元组，估计值只会偏大 (上界)，且不超过 heavy_min。
+    相同 width/depth 的 Sketch 可以按元素相加合并 (分片统计后 merge)。
+    """
+
+    MAGIC = b"CMS1"
+
+    def __init__(self, width: int, depth: int, heavy_min: int,
+                 table: array = None, heavy_hitters: Dict[int, int] = None, with_table: bool = True):
+        if depth > len(SKETCH_SEEDS):
+            raise ValueError(f"depth must be <= {len(SKETCH_SEEDS)}")
+        self.width = width
+        self.depth = depth
+        self.heavy_min = heavy_min
+        # with_table=False 时只保留 Heavy Hitter 表 (只读查询用)，不分配计数表
+        if table is None and with_table:
+            table = array('I', bytes(4 * width * depth))
+        self.table = table
+        self.heavy_hitters = heavy_hitters or {}
+
+    def _columns(self, key: int):
+        for i in range(self.depth):
+            a, b = SKETCH_SEEDS[i]
+            yield i * self.width + ((a * key + b) % SKETCH_PRIME) % self.width
+
+    def add(self, pid: str, qid: str, count: int = 1):
+        key = pair_key(pid, qid)
+        if key is None:
+            return
+        for idx in self._columns(key):
+            self.table[idx] += count
+
+    def add_heavy_hitter(self, pid: str, qid: str, count: int):
+        key = pair_key(pid, qid)
+        if key is not None:
+            self.heavy_hitters[key] = self.heavy_hitters.get(key, 0) + count
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge sketches with different shapes.")
+        for i, v in enumerate(other.table):
+            if v:
+                self.table[i] += v
+        for key, cnt in other.heavy_hitters.items():
+            self.heavy_hitters[key] = self.heavy_hitters.get(key, 0) + cnt
+        return self
+
+    def estimate(self, pid: str, qid: str) -> Optional[Tuple[int, bool]]:
+        """
+        返回 (估计频次, 是否精确)。只有 Heavy Hitter 是精确值；其余二元组返回计数表给出的上界 (不超过 heavy_min)，
+        exact 为 False。只加载了 Heavy Hitter 表时，长尾二元组直接返回 heavy_min。
+        """
+        key = pair_key(pid, qid)
+        if key is None:
+            return None
+        if key in self.heavy_hitters:
+            return self.heavy_hitters[key], True
+        if self.table is None:
+            return self.heavy_min, False
+        est = min(self.table[idx] for idx in self._columns(key))
+        # 不在 Heavy Hitter 表中，说明 (快照中的) 真实频次不超过 heavy_min
+        return min(est, self.heavy_min), False
+
+    def save(self, path: str):
+        header = json.dumps({
+            "width": self.width,
+            "depth": self.depth,
+            "heavy_min": self.heavy_min,
+            "heavy_hitters": [[k, v] for k, v in self.heavy_hitters.items()],
+        }).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            f.write(self.table.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, with_table: bool = True) -> "CountMinSketch":
+        """
+        with_table=False 时只读取文件头部的 Heavy Hitter 表，不解压后面的计数表 (width * depth * 4 字节)。
+        """
+        with gzip.open(path, "rb") as f:
+            if f.read(4) != cls.MAGIC:
+                raise ValueError(f"{path} is not a count-min sketch file.")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            table = None
+            if with_table:
+                table = array('I')
+                table.frombytes(f.read())
+        return cls(header["width"], header["depth"], header["heavy_min"], table=table,
+                   heavy_hitters={int(k): int(v) for k, v in header["heavy_hitters"]}, with_table=with_table)
+
+
+class PropertyStatistics:
+    """
+    离线属性统计：从 download_Wiki.py / download_wiki2.py 生成的元数据中加载，
+    供 ConstraintOptimizer 在本地估算约束的基数，避免不必要的在线探测。
+    """
+
+    def __init__(self, properties: Dict[str, Dict] = None, sketch: Optional[CountMinSketch] = None,
+                 sketch_path: Optional[str] = None):
+        self.properties = properties or {}
+        self._sketch = sketch
+        # 提供 sketch_path 时，第一次遇到实体等值约束才加载 (计数表约 width * depth * 4 字节，只加载一次)
+        self._sketch_path = sketch_path if sketch is None else None
+        self._sketch_lock = threading.Lock()
+        self.histograms: Dict[str, EquiDepthHistogram] = {}
+        for pid, meta in self.properties.items():
+            hist_data = meta.get("histogram")
+            if hist_data:
+                hist = EquiDepthHistogram.from_dict(hist_data)
+                if hist:
+                    self.histograms[pid] = hist
+
+    @classmethod
+    def load(cls, metadata_path: str, sketch_path: Optional[str] = None) -> "PropertyStatistics":
+        if sketch_path and not os.path.exists(sketch_path):
+            sketch_path = None
+
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"[Stats] Failed to load property metadata from {metadata_path}: {e}")
+            return cls(sketch_path=sketch_path)
+
+        stats = cls(data.get("properties", {}), sketch_path=sketch_path)
+        logger.info(f"[Stats] Loaded {len(stats.properties)} properties, {len(stats.histograms)} histograms.")
+        return stats
+
+    @property
+    def sketch(self) -> Optional[CountMinSketch]:
+        """(pid, QID) 频次 Sketch：启动时不加载，第一次使用时读入 Heavy Hitter 表和计数表"""
+        if self._sketch_path is not None:
+            with self._sketch_lock:
+                if self._sketch_path is not None:
+                    path, self._sketch_path = self._sketch_path, None
+                    try:
+                        self._sketch = CountMinSketch.load(path)
+                        logger.info(f"[Stats] Loaded pair sketch {self._sketch.width}x{self._sketch.depth} "
+                                    f"with {len(self._sketch.heavy_hitters)} heavy hitters (> {self._sketch.heavy_min}).")
+                    except Exception as e:
+                        logger.warning(f"[Stats] Failed to load pair sketch from {path}: {e}")
+        return self._sketch
+
+    def get_histogram(self, pid: str) -> Optional[EquiDepthHistogram]:
+        return self.histograms.get(pid)
+
+    def estimate_range_rows(self, pid: str, operator: str, value) -> Optional[int]:
+        """估算 '?item wdt:pid ?v . FILTER(?v op value)' 的行数；无法估算时返回 None"""
+        if operator not in (">", "<"):
+            return None
+        hist = self.histograms.get(pid)
+        if not hist:
+            return None
+
+        if hist.kind == "date":
+            x = to_decimal_year(value, operator)
+            # 纯年份的 ">" 已被换算为下一年的 1 月 1 日，该日期本身满足条件 (大量日期精度为年的值都落在这里)
+            if operator == ">" and re.match(r'^-?\d{4}$', str(value).strip()):
+                operator = ">="
+        else:
+            try:
+                x = float(value)
+            except (TypeError, ValueError):
+                x = None
+        if x is None:
+            return None
+        return hist.estimate_rows(operator, x)
+
+    def estimate_rows(self, pid: str, operator: str, value) -> Optional[Tuple[int, bool]]:
+        """
+        统一的本地基数估算入口。
+        返回 (估计行数, 是否精确)；无法估算时返回 None。
+        """
+        if operator == "=" and re.match(r'^Q\d+$', str(value)):
+            sketch = self.sketch
+            result = sketch.estimate(pid, str(value)) if sketch else None
+            # Heavy Hitter 是精确计数；长尾二元组返回上界 (exact=False)，调用方只在上界远小于阈值时据此判定为 Anchor。
+            # 估计为 0 说明快照中没有这个二元组 (新实体或链接有误)，不能据此判断，交给在线探测
+            if not result or result[0] == 0:
+                return None
+            return result
+
+        est = self.estimate_range_rows(pid, operator, value)
+        if est is None:
+            return None
+        return est, False
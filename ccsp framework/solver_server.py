@@ -0,0 +1,281 @@
+# solver_server.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from agent_brain import GoTAgent
+from budget import QueryBudget, budget_scope, run_in_context
+from critic import StatisticalCritic
+from environment import GraphEnvironment
+from fast_parser import FastPathParser, fast_parser_from_env
+from label_service import LabelService
+from log_pipeline import get_pipeline
+from optimizer import ConstraintOptimizer
+from persistent_cache import get_shared_store
+from tracing import tracer
+from unit_utils import UnitNormalizer
+from wikidata_service import WikidataService
+
+logger = logging.getLogger(__name__)
+
+# ================= 配置区域 =================
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_CONCURRENT = 16  # 同时求解的请求数上限，超出的请求排队
+WORKER_THREADS = 32  # 解析 / 探测 / 工具调用所用的常驻线程数
+ACTION_THREADS = 16  # 所有 Agent 共用的批量动作线程池
+DEFAULT_TIMEOUT = 120.0  # 单个请求的求解时间上限 (秒)
+LATENCY_WINDOW = 1000  # 延迟分位数统计的滑动窗口
+MAX_BODY = 1 << 20
+# ===========================================
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class SolverService:
+    """
+    常驻求解服务：LLM 客户端、Wikidata 连接 (keep-alive Session)、属性统计、离线索引、探测缓存、
+    工具备忘和线程池在进程启动时初始化一次，之后所有请求共用，避免每次查询重新加载。
+    每个请求使用独立的 GoTAgent (即独立的 GraphState) 和独立的 QueryBudget，可以并发求解。
+    组件均可注入：测试时传入本地替身 LLM / WikidataService 即可，无需访问外部服务。
+    """
+
+    def __init__(self, llm, wiki_service: WikidataService, optimizer: ConstraintOptimizer,
+                 env: GraphEnvironment = None, label_service: LabelService = None,
+                 fast_parser: FastPathParser = None, max_concurrent: int = MAX_CONCURRENT,
+                 worker_threads: int = WORKER_THREADS, action_threads: int = ACTION_THREADS,
+                 agent_options: Dict[str, Any] = None, budget_limits: Dict[str, Any] = None):
+        self.llm = llm
+        self.wiki = wiki_service
+        self.optimizer = optimizer
+        self.env = env if env is not None else GraphEnvironment(wiki_service)
+        self.critic = StatisticalCritic(optimizer)
+        self.normalizer = UnitNormalizer()
+        # 规则快速通道默认关闭 (CCSP_FAST_PARSER=1 或显式传入 fast_parser 时启用)
+        self.fast_parser = fast_parser if fast_parser is not None else fast_parser_from_env()
+        self.labels = label_service if label_service is not None else LabelService(session=wiki_service.session)
+        self.agent_options = agent_options or {}
+        self.budget_limits = budget_limits
+        self.max_concurrent = max_concurrent
+        self.worker_threads = worker_threads
+        # 解析 / 优化等阻塞步骤走 worker 线程池；Agent 的批量动作走独立的 action 线程池，
+        # 两者分开，避免 worker 线程等待 action 任务时互相占满导致死锁
+        self.executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix="solver")
+        self.action_pool = ThreadPoolExecutor(max_workers=action_threads, thread_name_prefix="action")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.started = time.time()
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "SolverService":
+        """按 main.init_services 组装全部组件 (LLM_API_KEY / LLM_BASE_URL / model_name / LLM_CACHE_PATH)"""
+        from main import init_services, LABEL_STORE_PATH
+        llm, wiki, optimizer = init_services(os.getenv("LLM_CACHE_PATH"))
+        labels = LabelService(get_shared_store(LABEL_STORE_PATH), session=wiki.session)
+        return cls(llm, wiki, optimizer, label_service=labels, **kwargs)
+
+    # --- 求解 ---
+    async def solve(self, query: str, timeout: float = None, budget_limits: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        求解一个查询，返回答案、Label 与各阶段延迟 (毫秒)。
+        budget_limits 为本次请求的 QueryBudget 参数，缺省时使用服务级配置。
+        """
+        from main import parse_query_to_constraints
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        loop = asyncio.get_running_loop()
+        limits = budget_limits if budget_limits is not None else self.budget_limits
+        budget = QueryBudget(**limits) if limits else None
+        timeout = timeout or DEFAULT_TIMEOUT
+        latency: Dict[str, float] = {}
+
+        def lap(name, since):
+            now = time.perf_counter()
+            latency[name] = round((now - since) * 1000, 1)
+            return now
+
+        received = time.perf_counter()
+        self.stats["requests"] += 1
+        try:
+            async with self._semaphore:
+                self.stats["in_flight"] += 1
+                try:
+                    t = lap("queue", received)
+                    with budget_scope(budget), tracer.trace("query", query=query) as root:
+                        constraints = await loop.run_in_executor(self.executor, run_in_context(
+                            lambda: parse_query_to_constraints(query, self.llm, self.wiki,
+                                                               fast_parser=self.fast_parser)))
+                        constraints = self.normalizer.normalize(constraints)
+                        t = lap("parse", t)
+                        constraints = await loop.run_in_executor(self.executor, run_in_context(
+                            lambda: self.optimizer.optimize(constraints, budget=budget)))
+                        t = lap("optimize", t)
+
+                        agent = GoTAgent(self.llm, self.env, self.critic, pool=self.action_pool,
+                                         **self.agent_options)
+                        answers = set()
+                        if constraints:
+                            answers = await agent.solve_async(query, constraints, timeout=timeout, budget=budget)
+                        answers = sorted(answers or [])
+                        t = lap("solve", t)
+                        root.set(answers=len(answers), latency_ms=dict(latency))
+
+                    labels = await loop.run_in_executor(self.executor, self.labels.get_labels, answers[:50])
+                    lap("labels", t)
+                finally:
+                    self.stats["in_flight"] -= 1
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+        latency["total"] = round((time.perf_counter() - received) * 1000, 1)
+        self.latencies.append(latency["total"])
+        return {
+            "query": query,
+            "constraints": [{"property_id": c.property_id, "property_label": c.property_label,
+                             "operator": c.operator, "value": c.value, "unit": c.unit} for c in constraints],
+            "answers": answers,
+            "labels": labels,
+            "latency_ms": latency,
+            "metrics": agent.metrics,
+            "llm_steps": agent.step_metrics,
+            "budget": budget.summary() if budget else None,
+        }
+
+    def service_stats(self) -> Dict[str, Any]:
+        window = list(self.latencies)
+        return {
+            **self.stats,
+            "uptime_sec": round(time.time() - self.started, 1),
+            "latency_ms": {"p50": _percentile(window, 0.5), "p95": _percentile(window, 0.95),
+                           "p99": _percentile(window, 0.99), "window": len(window)},
+            "tool_memo": self.env.memo_stats(),
+            "labels_fetched": self.labels.fetched,
+            "fast_parser": dict(self.fast_parser.stats) if self.fast_parser is not None else None,
+            "logging": get_pipeline().stats() if get_pipeline() else None,
+        }
+
+    def close(self):
+        self.action_pool.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+        self.labels.save()
+        tracer.flush()
+        if hasattr(self.llm, "flush_cache"):
+            self.llm.flush_cache()
+
+    # --- HTTP 接口 ---
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        极简 HTTP/1.1 (keep-alive)：
+        POST /solve  {"query": ..., "timeout": 秒, "budget": {QueryBudget 参数}}
+        GET  /health, GET /stats
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.service_stats()
+        if method == "POST" and path == "/solve":
+            try:
+                request = json.loads(body or b"{}")
+                query = request["query"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "expected JSON body with 'query'"}
+            try:
+                return 200, await self.solve(query, timeout=request.get("timeout"),
+                                             budget_limits=request.get("budget"))
+            except Exception as e:
+                logger.exception(f"[Server] Solve failed for '{query}'")
+                return 500, {"error": str(e)}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool = True):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                   500: "Internal Server Error"}
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, host: str = HOST, port: int = PORT, unix_path: str = None):
+        # 默认执行器 (Agent 内部 run_in_executor(None, ...)) 也换成常驻线程池
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.worker_threads, thread_name_prefix="agent"))
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+            logger.info(f"[Server] Listening on unix:{unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            logger.info(f"[Server] Listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CCSP long-running solver service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT)
+    args = parser.parse_args()
+
+    from main import setup_logging
+    setup_logging()
+    tracer.configure(os.getenv("CCSP_TRACE_FILE"))
+    service = SolverService.from_env(max_concurrent=args.max_concurrent)
+    logger.info("[Server] Infrastructure warmed up.")
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# speculation.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from wikidata_service import cancellable
+from budget import run_in_context
+
+logger = logging.getLogger(__name__)
+
+# 只推测没有副作用的动作 (RELAX_CONSTRAINT 会修改约束，不能提前执行)
+SPECULATIVE_ACTIONS = ("SEARCH_ANCHOR", "FILTER")
+
+
+def action_key(action: Dict[str, Any]) -> Tuple:
+    """用于比较两个动作是否等价：动作类型 + 约束 + 父节点"""
+    params = action.get("params") or {}
+    return action.get("action"), params.get("constraint_id"), params.get("parent_node_id")
+
+
+class SpeculativeExecutor:
+    """
+    推测执行：LLM 思考期间，在后台线程中提前执行最可能被选中的动作。
+    - 决策与某个推测一致时，直接复用 (或等待) 该结果；
+    - 其余推测被丢弃：未开始的直接取消，正在运行的通过取消事件阻止其继续发出 SPARQL 请求。
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        # key -> (future, cancel_event, start_time, finish_time holder)
+        self._pending: Dict[Tuple, Tuple[Future, threading.Event, float, list]] = {}
+        self.stats = {"started": 0, "hits": 0, "misses": 0, "cancelled": 0, "time_saved": 0.0}
+
+    def start(self, actions: List[Dict[str, Any]], run: Callable[[Dict[str, Any]], Any]):
+        """为每个预测动作提交后台任务 (最多 max_workers 个)"""
+        for action in actions[:self.max_workers]:
+            key = action_key(action)
+            if action.get("action") not in SPECULATIVE_ACTIONS or key in self._pending:
+                continue
+            event = threading.Event()
+            finished = []
+
+            def task(action=action, event=event, finished=finished):
+                try:
+                    with cancellable(event):
+                        return run(action)
+                finally:
+                    finished.append(time.time())
+
+            started = time.time()
+            self._pending[key] = (self._pool.submit(run_in_context(task)), event, started, finished)
+            self.stats["started"] += 1
+            logger.info(f"[Speculate] Started {key[0]} on {key[1]} (parent={key[2]}).")
+
+    def take(self, action: Dict[str, Any]) -> Optional[Future]:
+        """
+        取出与决策一致的推测任务；没有命中时返回 None。
+        命中节省的时间 = 决策到达时推测任务已经运行的时长。
+        """
+        entry = self._pending.pop(action_key(action), None)
+        if entry is None:
+            if self._pending:
+                self.stats["misses"] += 1
+            return None
+        future, _, start, finished = entry
+        self.stats["hits"] += 1
+        self.stats["time_saved"] += (finished[0] if finished else time.time()) - start
+        logger.info(f"[Speculate] Hit: {action.get('action')} on {action_key(action)[1]} "
+                    f"({'done' if future.done() else 'running'}).")
+        return future
+
+    def discard(self):
+        """丢弃所有未被采用的推测"""
+        for future, event, _, _ in self._pending.values():
+            event.set()
+            future.cancel()
+            self.stats["cancelled"] += 1
+        self._pending.clear()
+
+    def shutdown(self):
+        self.discard()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data_model import Constraint  # noqa: E402
+from unit_utils import UnitNormalizer  # noqa: E402
+
+
+def _normalize(pid, value, unit=None):
+    c = Constraint(id="c1", property_id=pid, property_label=pid, operator="<", value=value, unit=unit)
+    UnitNormalizer().normalize([c])
+    return c
+
+
+def test_unitless_duration_is_read_in_storage_unit():
+    # 片长存储单位为分钟：不带单位的 122.5 与 "122.5 minutes" 一样换算成秒
+    assert _normalize("P2047", "122.5").value == _normalize("P2047", "122.5", "minutes").value == "7350"
+
+
+def test_unitless_length_is_read_in_storage_unit():
+    # 河流长度存储单位为公里
+    c = _normalize("P2043", "12")
+    assert (c.value, c.unit) == ("12000", "Q11573")
+
+
+def test_normalize_is_idempotent():
+    c = _normalize("P2047", "90", "minutes")
+    UnitNormalizer().normalize([c])
+    assert c.value == "5400"
@@ -0,0 +1,259 @@
+# tracing.py
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("ccsp_current_span", default=None)
+# perf_counter -> 墙钟时间 (微秒) 的偏移，保证同一进程内的 span 时间戳单调且可与其他进程对齐
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+# 记住最近多少条已落盘的 trace：它们的迟到 span (根 span 结束后才结束的后台任务) 直接写文件，不再进缓冲区
+FLUSHED_TRACES = 10000
+
+
+class Span:
+    """一次计时区间：名称、父子关系、线程与属性 (行数、字节数、token 数等)"""
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attrs", "tid", "thread")
+
+    def __init__(self, name: str, trace_id: str, span_id: int, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attrs = attrs
+        current = threading.current_thread()
+        self.tid = current.ident
+        self.thread = current.name
+        self.start = time.perf_counter()
+        self.end = None
+
+    def set(self, **attrs) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+            "ts_us": int((self.start + _EPOCH_OFFSET) * 1e6), "dur_us": int((self.end - self.start) * 1e6),
+            "tid": self.tid, "thread": self.thread, "attrs": self.attrs,
+        }
+
+
+class _NoopSpan:
+    """未启用追踪时返回的占位 span：set() 什么都不做"""
+
+    def set(self, **attrs) -> "_NoopSpan":
+        return self
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    进程内追踪器。span 的父子关系通过 contextvars 传递，因此在 budget.run_in_context 提交到线程池的任务中
+    同样能挂到发起方的 span 下。默认关闭 (span() 直接返回 NOOP_SPAN)；configure(path) 后启用，
+    每个根 span (一次查询) 结束时把整棵 span 追加写入 JSONL 文件，再用 `python tracing.py` 转成 Chrome trace。
+    根 span 结束后才结束的 span (被取消的后台探测、推测执行等) 直接追加写入，不会滞留在缓冲区。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path: Optional[str] = None
+        self._ids = itertools.count(1)
+        self._traces = itertools.count(1)
+        self._buffer: List[Span] = []
+        self._flushed: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, path: Optional[str]):
+        """path 为 JSONL 输出文件；传 None 关闭追踪"""
+        self.path = path
+        self.enabled = bool(path)
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        parent = _current_span.get()
+        if parent is None:
+            trace_id = f"{os.getpid()}-{next(self._traces)}"
+            span = Span(name, trace_id, next(self._ids), None, attrs)
+        else:
+            span = Span(name, parent.trace_id, next(self._ids), parent.span_id, attrs)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            self._finish(span)
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """开始一条新的 trace (一次查询)：不挂到当前 span 下，结束时落盘"""
+        token = _current_span.set(None)
+        try:
+            with self.span(name, **attrs) as span:
+                yield span
+        finally:
+            _current_span.reset(token)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            late = span.trace_id in self._flushed
+            if not late:
+                self._buffer.append(span)
+        if late:
+            self._write([span])
+        elif span.parent_id is None:
+            self.flush(span.trace_id)
+
+    def flush(self, trace_id: Optional[str] = None):
+        """把已结束的 span 追加写入 JSONL；trace_id 不为空时只写该 trace 的 span，并把它记为已落盘"""
+        with self._lock:
+            if trace_id is None:
+                spans, self._buffer = self._buffer, []
+            else:
+                spans = [s for s in self._buffer if s.trace_id == trace_id]
+                self._buffer = [s for s in self._buffer if s.trace_id != trace_id]
+                self._flushed[trace_id] = None
+                while len(self._flushed) > FLUSHED_TRACES:
+                    self._flushed.popitem(last=False)
+        self._write(spans)
+
+    def _write(self, spans: List[Span]):
+        if not spans or not self.path:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for s in sorted(spans, key=lambda s: s.start):
+                    f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"[Tracing] Failed to write {self.path}: {e}")
+
+
+tracer = Tracer()
+
+
+def current_span():
+    """当前 span (未启用追踪或不在 span 内时返回 NOOP_SPAN)，用于在函数体内补充属性"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def _result_attrs(result) -> Dict[str, Any]:
+    if isinstance(result, (set, frozenset, list, dict)):
+        return {"rows": len(result)}
+    return {}
+
+
+def traced(name: str, **attrs):
+    """装饰器：把函数调用包在名为 name 的 span 中；返回集合 / 列表时自动记录 rows"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await fn(*args, **kwargs)
+                with tracer.span(name, **attrs) as span:
+                    result = await fn(*args, **kwargs)
+                    span.set(**_result_attrs(result))
+                    return result
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name, **attrs) as span:
+                result = fn(*args, **kwargs)
+                span.set(**_result_attrs(result))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+# --- 导出 ---
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def to_chrome_trace(spans: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    转成 Chrome trace event 格式 (chrome://tracing / Perfetto 可直接打开)。
+    每个 trace (查询) 对应一个 pid，进程名为根 span 的名称与查询文本，线程按原线程分行。
+    """
+    events, pids = [], {}
+    for s in spans:
+        pid = pids.setdefault(s["trace_id"], len(pids) + 1)
+        if s["parent_id"] is None:
+            label = s["name"] + (f": {s['attrs']['query']}" if "query" in s["attrs"] else "")
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": label}})
+        events.append({"name": s["name"], "cat": s["name"].split(".")[0], "ph": "X", "ts": s["ts_us"],
+                       "dur": s["dur_us"], "pid": pid, "tid": s["tid"], "args": s["attrs"]})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summarize(spans: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按 span 名称汇总：次数、总耗时、自身耗时 (扣除子 span)"""
+    spans = list(spans)
+    child_time: Dict[tuple, int] = {}
+    for s in spans:
+        if s["parent_id"] is not None:
+            key = (s["trace_id"], s["parent_id"])
+            child_time[key] = child_time.get(key, 0) + s["dur_us"]
+    totals: Dict[str, Dict[str, Any]] = {}
+    for s in spans:
+        t = totals.setdefault(s["name"], {"name": s["name"], "count": 0, "total_ms": 0.0, "self_ms": 0.0})
+        t["count"] += 1
+        t["total_ms"] += s["dur_us"] / 1e3
+        t["self_ms"] += max(s["dur_us"] - child_time.get((s["trace_id"], s["span_id"]), 0), 0) / 1e3
+    return sorted(totals.values(), key=lambda t: -t["self_ms"])
+
+
+def main():
+    """python tracing.py trace.jsonl [out.json] [--trace TRACE_ID]：导出 Chrome trace 并打印各 span 的耗时汇总"""
+    args = sys.argv[1:]
+    trace_id = None
+    if "--trace" in args:
+        i = args.index("--trace")
+        trace_id = args[i + 1]
+        del args[i:i + 2]
+    if not args:
+        print(main.__doc__)
+        return
+    spans = load_spans(args[0])
+    if trace_id:
+        spans = [s for s in spans if s["trace_id"] == trace_id]
+    out = args[1] if len(args) > 1 else os.path.splitext(args[0])[0] + ".chrome.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(spans), f, ensure_ascii=False)
+    print(f"Wrote {len(spans)} spans from {len({s['trace_id'] for s in spans})} traces to {out}")
+    for t in summarize(spans)[:20]:
+        print(f"   {t['name']:<28} x{t['count']:<5} total {t['total_ms']:10.1f} ms   self {t['self_ms']:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
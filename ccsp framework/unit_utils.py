@@ -1,53 +1,204 @@
-class UnitNormalizer:
-    def __init__(self):
-        # ... (映射字典部分保持不变) ...
-        self.property_unit_map = {
-
-            "runtime": "seconds",
-            "elevation": "meters",
-            "height": "meters",
-            "mass": "kilograms",
-            "weight": "kilograms"
-        }
-        self.conversion_factors = {
-            "seconds": {"minute": 60, "min": 60, "hour": 3600, "hr": 3600, "day": 86400},
-            "meters": {"km": 1000, "kilometer": 1000, "cm": 0.01, "foot": 0.3048},
-            "kilograms": {"tonne": 1000, "gram": 0.001, "lb": 0.453592, "pound": 0.453592}
-        }
+# unit_utils.py
+import logging
+import re
+from typing import Dict, Optional, Tuple
 
-    def normalize(self, constraints):
-        """
-        [修改版] 支持 Constraint 对象操作
-        """
-        for c in constraints:
-            # 使用 getattr 或点号访问对象属性
-            prop = c.property_label.lower() if c.property_label else ""
-            unit = c.unit
-            value = c.value
+from tracing import traced
 
-            if not unit or prop not in self.property_unit_map:
-                continue
+logger = logging.getLogger(__name__)
+
+# === 单位表：Wikidata 单位 QID -> (量纲, 换算到该量纲基准单位的系数) ===
+UNITS: Dict[str, Tuple[str, float]] = {
+    # 时间 (基准: 秒)
+    "Q11574": ("time", 1.0),  # second
+    "Q7727": ("time", 60.0),  # minute
+    "Q25235": ("time", 3600.0),  # hour
+    "Q573": ("time", 86400.0),  # day
+    # 长度 (基准: 米)
+    "Q11573": ("length", 1.0),  # metre
+    "Q828224": ("length", 1000.0),  # kilometre
+    "Q174728": ("length", 0.01),  # centimetre
+    "Q174789": ("length", 0.001),  # millimetre
+    "Q3710": ("length", 0.3048),  # foot
+    "Q218593": ("length", 0.0254),  # inch
+    "Q253276": ("length", 1609.344),  # mile
+    # 面积 (基准: 平方米)
+    "Q25343": ("area", 1.0),  # square metre
+    "Q712226": ("area", 1e6),  # square kilometre
+    "Q35852": ("area", 1e4),  # hectare
+    "Q81292": ("area", 4046.8564224),  # acre
+    "Q232291": ("area", 2589988.110336),  # square mile
+    # 质量 (基准: 千克)
+    "Q11570": ("mass", 1.0),  # kilogram
+    "Q41803": ("mass", 0.001),  # gram
+    "Q191118": ("mass", 1000.0),  # tonne
+    "Q100995": ("mass", 0.45359237),  # pound
+    # 货币：不同币种之间没有固定汇率，只在同币种内 "换算" (系数 1)
+    "Q4917": ("currency:USD", 1.0),  # United States dollar
+    "Q4916": ("currency:EUR", 1.0),  # euro
+    "Q25224": ("currency:GBP", 1.0),  # pound sterling
+    # 无量纲计数
+    "Q199": ("count", 1.0),  # 1
+}
+
+# 自然语言 / 缩写 -> 单位 QID (小写，匹配前去掉复数 s)
+UNIT_ALIASES: Dict[str, str] = {
+    "second": "Q11574", "sec": "Q11574", "s": "Q11574",
+    "minute": "Q7727", "min": "Q7727",
+    "hour": "Q25235", "hr": "Q25235", "h": "Q25235",
+    "day": "Q573",
+    "metre": "Q11573", "meter": "Q11573", "m": "Q11573",
+    "kilometre": "Q828224", "kilometer": "Q828224", "km": "Q828224",
+    "centimetre": "Q174728", "centimeter": "Q174728", "cm": "Q174728",
+    "millimetre": "Q174789", "millimeter": "Q174789", "mm": "Q174789",
+    "foot": "Q3710", "feet": "Q3710", "ft": "Q3710",
+    "inch": "Q218593", "inche": "Q218593", "in": "Q218593",
+    "mile": "Q253276", "mi": "Q253276",
+    "square metre": "Q25343", "square meter": "Q25343", "m2": "Q25343", "m²": "Q25343",
+    "square kilometre": "Q712226", "square kilometer": "Q712226", "sq km": "Q712226", "km2": "Q712226",
+    "km²": "Q712226",
+    "hectare": "Q35852", "ha": "Q35852",
+    "acre": "Q81292",
+    "square mile": "Q232291", "sq mi": "Q232291",
+    "kilogram": "Q11570", "kg": "Q11570",
+    "gram": "Q41803", "g": "Q41803",
+    "tonne": "Q191118", "ton": "Q191118",
+    "pound": "Q100995", "lb": "Q100995", "lbs": "Q100995",
+    "usd": "Q4917", "dollar": "Q4917", "us dollar": "Q4917", "$": "Q4917",
+    "eur": "Q4916", "euro": "Q4916", "€": "Q4916",
+    "gbp": "Q25224", "pound sterling": "Q25224", "£": "Q25224",
+    "people": "Q199", "person": "Q199", "inhabitant": "Q199", "resident": "Q199", "employee": "Q199",
+}
+
+# 单位字符串里的数量级词 ("million USD")
+SCALE_WORDS = {"thousand": 1e3, "million": 1e6, "billion": 1e9, "trillion": 1e12}
+
+# 属性 -> Wikidata 中该属性最常用的存储单位。同一属性实际存储的单位并不统一 (片长有分钟也有秒、面积有平方公里也有公顷)，
+# wdt: 返回的是原始数值，因此只有离线统计 (由 wdt: 数值构建的直方图) 按这个单位解释
+STORAGE_UNITS: Dict[str, str] = {
+    "P2047": "Q7727",  # duration: minute
+    "P2048": "Q11573",  # height: metre
+    "P2049": "Q11573",  # width: metre
+    "P2043": "Q828224",  # length: kilometre (河流、道路)
+    "P2044": "Q11573",  # elevation above sea level: metre
+    "P2386": "Q11573",  # diameter: metre
+    "P2046": "Q712226",  # area: square kilometre
+    "P2067": "Q11570",  # mass: kilogram
+    "P2142": "Q4917",  # box office: US dollar
+    "P2130": "Q4917",  # budget: US dollar
+    "P2218": "Q4917",  # net worth: US dollar
+    "P1082": "Q199",  # population
+    "P1128": "Q199",  # employees
+}
+
+# Wikidata 为这些量纲提供 SI 归一化值 (wikibase:quantityNormalized)，查询时比较归一化值，不受原始单位影响
+SI_UNITS: Dict[str, str] = {
+    "time": "Q11574",  # second
+    "length": "Q11573",  # metre
+    "area": "Q25343",  # square metre
+    "mass": "Q11570",  # kilogram
+}
+
+# 需要按 SI 归一化值查询的属性；货币与计数没有归一化值，仍用 wdt: 原始数值
+NORMALIZED_PROPERTIES = frozenset(pid for pid, unit in STORAGE_UNITS.items() if UNITS[unit][0] in SI_UNITS)
+
+# 属性 -> 约束值在查询中比较时所用的单位：可归一化的属性用 SI 单位，其余用存储单位
+PROPERTY_UNITS: Dict[str, str] = {pid: SI_UNITS.get(UNITS[unit][0], unit) for pid, unit in STORAGE_UNITS.items()}
+
+
+def quantity_triple(pid: str, subject: str = "?item", var: str = "?v") -> str:
+    """数值属性的三元组：可归一化的属性取 SI 归一化值 (p:/psv:/wikibase:quantityNormalized)，否则取 wdt: 原始值"""
+    if pid in NORMALIZED_PROPERTIES:
+        return (f"{subject} p:{pid}/psv:{pid}/wikibase:quantityNormalized/wikibase:quantityAmount {var} .")
+    return f"{subject} wdt:{pid} {var} ."
+
+
+def to_storage_unit(pid: str, value: float) -> float:
+    """把按 PROPERTY_UNITS 换算过的约束值转回存储单位，用于查离线直方图"""
+    source, target = PROPERTY_UNITS.get(pid), STORAGE_UNITS.get(pid)
+    if source is None or source == target:
+        return value
+    return convert(value, source, target)
 
-            target_standard = self.property_unit_map[prop]
 
-            if target_standard in self.conversion_factors:
-                factors = self.conversion_factors[target_standard]
-                clean_unit = unit.lower().rstrip('s')
+def resolve_unit(unit: Optional[str]) -> Tuple[Optional[str], float]:
+    """
+    把单位 (QID、缩写或自然语言，可带数量级词) 解析为 (单位 QID, 数量级系数)。
+    无法识别时返回 (None, 系数)。
+    """
+    if not unit:
+        return None, 1.0
+    text = str(unit).strip()
+    if re.match(r'^Q\d+$', text):
+        return (text if text in UNITS else None), 1.0
 
-                if clean_unit in factors:
-                    factor = factors[clean_unit]
-                    try:
-                        original_val = float(value)
-                        new_val = original_val * factor
+    text = text.lower().replace("sq.", "sq")
+    scale = 1.0
+    for word, factor in SCALE_WORDS.items():
+        if re.search(rf"\b{word}\b", text):
+            scale *= factor
+            text = re.sub(rf"\b{word}\b", " ", text)
+    text = " ".join(text.split())
+    if not text:
+        return None, scale
 
-                        print(
-                            f"[UnitNormalizer] Converting {prop}: {original_val} {unit} -> {new_val} {target_standard}")
+    for candidate in (text, text.rstrip("s"), re.sub(r"s\b", "", text)):
+        if candidate in UNIT_ALIASES:
+            return UNIT_ALIASES[candidate], scale
+    return None, scale
 
-                        # === 直接修改对象属性 ===
-                        c.value = str(new_val)
-                        c.unit = None  # 转换完成后清空，避免干扰后续逻辑
 
-                    except ValueError:
-                        print(f"[Error] Could not convert value {value} to float.")
+def convert(value: float, from_unit: str, to_unit: str) -> Optional[float]:
+    """同量纲单位之间换算；量纲不同或单位未知时返回 None"""
+    src, dst = UNITS.get(from_unit), UNITS.get(to_unit)
+    if not src or not dst or src[0] != dst[0]:
+        return None
+    return value * src[1] / dst[1]
+
+
+def _format_number(value: float) -> str:
+    value = round(value, 6)
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class UnitNormalizer:
+    """
+    单位换算引擎：按属性 ID 查出查询时比较所用的单位 (PROPERTY_UNITS，物理量为 SI 单位)，按单位 QID 查换算系数 (UNITS)，
+    在解析阶段把数值约束一次性换算到该单位。换算后 unit 记为该单位的 QID，
+    后续的探测和过滤 (见 quantity_triple) 直接用该数值比较，不再需要在线采样对齐数量级。
+    """
+
+    @traced("normalize")
+    def normalize(self, constraints):
+        for c in constraints:
+            if c.operator not in (">", "<", ">=", "<=", "="):
+                continue
+            target = PROPERTY_UNITS.get(c.property_id)
+            if not target:
+                continue
+            try:
+                value = float(str(c.value).replace(",", ""))
+            except ValueError:
+                continue
+
+            source, scale = resolve_unit(c.unit)
+            if source is None:
+                # 没写单位 (或单位无法识别) 时按属性的存储单位理解 ("runtime < 122.5" 是分钟而不是秒)，再换算到 SI
+                source = STORAGE_UNITS[c.property_id]
+                if c.unit and scale == 1.0:
+                    logger.warning(f"[UnitNormalizer] Unknown unit '{c.unit}' for {c.property_id}; "
+                                   f"assuming {source}.")
+            converted = convert(value * scale, source, target)
+            if converted is None:
+                logger.warning(f"[UnitNormalizer] Cannot convert {c.unit} to {target} for {c.property_id}; "
+                               f"keeping {c.value}.")
+                continue
+
+            new_value = _format_number(converted)
+            if new_value != str(c.value):
+                logger.info(f"[UnitNormalizer] {c.property_label} ({c.property_id}): {c.value} {c.unit or ''} "
+                            f"-> {new_value} {target}")
+            c.value = new_value
+            c.unit = target
 
-        return constraints
\ No newline at end of file
+        return constraints
@@ -1,26 +1,100 @@
+import os
 import sys
 import time
-import requests
-from SPARQLWrapper import SPARQLWrapper, JSON
+import threading
+import json
+from contextlib import contextmanager
+from budget import current_budget
+from tracing import traced, current_span
 from urllib.error import HTTPError
 
 
+class QueryCancelled(Exception):
+    """查询在发出前被取消 (例如推测执行的结果已不再需要)"""
+
+
+_cancel_local = threading.local()
+
+
+@contextmanager
+def cancellable(event: threading.Event):
+    """在当前线程内生效：event 被 set 后，后续的 execute_sparql 调用直接抛出 QueryCancelled"""
+    previous = getattr(_cancel_local, "event", None)
+    _cancel_local.event = event
+    try:
+        yield
+    finally:
+        _cancel_local.event = previous
+
+
+def _check_cancelled():
+    event = getattr(_cancel_local, "event", None)
+    if event is not None and event.is_set():
+        raise QueryCancelled()
+
+
+def _charge_sparql(timeout_sec=None):
+    """按当前查询的预算记一次 SPARQL 调用，返回截断到剩余时间内的超时；预算用完时抛出 BudgetExceeded"""
+    budget = current_budget()
+    if budget is None:
+        return timeout_sec
+    budget.charge_sparql()
+    return budget.clip_timeout(timeout_sec)
+
+
 class WikidataService:
-    def __init__(self, user_agent="CCSP-Bot/1.0 (Research Project)"):
+    def __init__(self, user_agent="CCSP-Bot/1.0 (Research Project)", property_linker=None, entity_linker=None,
+                 endpoint_url=None, api_url=None, pool_size=16):
         """
         初始化 Wikidata SPARQL 服务
+        property_linker: 可选的离线属性索引 (property_linker.PropertyLinker)，命中时不再调用 wbsearchentities
+        entity_linker: 可选的离线实体索引 (entity_linker.EntityLinker)，同上
+        endpoint_url / api_url: SPARQL 端点与 wbsearchentities API，默认读环境变量
+            WIKIDATA_SPARQL_URL / WIKIDATA_API_URL (可指向本地替身服务)，否则使用 Wikidata 官方地址
         """
-        self.endpoint_url = "https://query.wikidata.org/sparql"
+        self.endpoint_url = endpoint_url or os.getenv("WIKIDATA_SPARQL_URL", "https://query.wikidata.org/sparql")
+        self.api_url = api_url or os.getenv("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
         self.user_agent = user_agent
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.property_linker = property_linker
+        self.entity_linker = entity_linker
+
+    @property
+    def session(self):
+        """
+        复用 HTTP 连接 (keep-alive)：探测请求很多且很短，每次新建 TLS 连接的开销比查询本身还大。
+        requests 在第一次发请求时才导入，导入本模块不加载 HTTP 栈。
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                            pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
 
+    @traced("link.entity")
     def search_entity(self, label: str) -> str:
+        if self.entity_linker is not None and label:
+            qid = self.entity_linker.link(label)
+            if qid:
+                current_span().set(source="offline")
+                return qid
+        current_span().set(source="api")
         return self._search_wikidata(label, "item")
 
     def search_property(self, label: str) -> str:
         return self._search_wikidata(label, "property")
 
+    @traced("wikidata.search")
     def _search_wikidata(self, label: str, type_filter: str) -> str:
-        url = "https://www.wikidata.org/w/api.php"
+        url = self.api_url
         params = {
             "action": "wbsearchentities",
             "search": label,
@@ -31,7 +105,8 @@ class WikidataService:
         }
         headers = {"User-Agent": self.user_agent}
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=5)
+            response = self.session.get(url, params=params, headers=headers, timeout=5)
+            current_span().set(bytes=len(response.content))
             data = response.json()
             if data.get("search"):
                 return data["search"][0]["id"]
@@ -39,43 +114,109 @@ class WikidataService:
             print(f"[Wikidata Search] Error: {e}")
         return None
 
+    @traced("sparql.probe")
     def probe_query_count(self, query: str, timeout_sec=2.0) -> int:
         """
         [NEW] 基于 LIMIT 的探测
         返回查到的行数。如果超时或出错，返回 -1。
         """
+        # 预算记账放在 try 之外：BudgetExceeded 必须传给调用方，不能被当成一次普通的超时 / 出错
+        timeout_sec = _charge_sparql(timeout_sec)
         try:
             params = {"query": query, "format": "json"}
             headers = {"User-Agent": self.user_agent}
 
             # 执行请求
-            response = requests.get(
+            response = self.session.get(
                 self.endpoint_url,
                 params=params,
                 headers=headers,
                 timeout=timeout_sec
             )
 
+            current_span().set(status=response.status_code, bytes=len(response.content))
             if response.status_code == 200:
                 data = response.json()
                 bindings = data["results"]["bindings"]
+                current_span().set(rows=len(bindings))
                 return len(bindings)  # 直接返回 List 长度
             else:
                 return -1  # HTTP Error
 
-        except requests.exceptions.Timeout:
-            # 超时意味着即便 LIMIT 1000 也没跑完（或者网络太差）
-            # 这种情况下绝对不能做 Anchor
-            return -1
         except Exception as e:
+            # 超时意味着即便 LIMIT 1000 也没跑完（或者网络太差）
+            # 这种情况下绝对不能做 Anchor；其他错误同样处理
             # print(f"[Probe Error] {e}")
             return -1
 
+    @traced("sparql.probe_bounded")
+    def probe_bounded_count(self, query: str, timeout_sec=1.0) -> int:
+        """
+        基于服务端 COUNT 的有界探测：query 形如 SELECT (COUNT(*) AS ?c) WHERE { { SELECT ... LIMIT n } }。
+        只传回一行计数，不传输候选实体本身。超时或出错返回 -1。
+        """
+        timeout_sec = _charge_sparql(timeout_sec)
+        try:
+            params = {"query": query, "format": "json"}
+            headers = {"User-Agent": self.user_agent}
+
+            response = self.session.get(
+                self.endpoint_url,
+                params=params,
+                headers=headers,
+                timeout=timeout_sec
+            )
+
+            current_span().set(status=response.status_code, bytes=len(response.content))
+            if response.status_code == 200:
+                bindings = response.json()["results"]["bindings"]
+                if not bindings:
+                    return 0
+                return int(bindings[0]["c"]["value"])
+            else:
+                return -1
+
+        except Exception as e:  # 超时或出错
+            return -1
+
+    @traced("sparql.probe_tagged")
+    def probe_tagged_counts(self, query: str, timeout_sec=2.0):
+        """
+        合并探测：query 返回 (?tag, ?c) 多行，解析为 {tag: count}。
+        超时或出错返回 None，由调用方回退为逐个探测。
+        """
+        timeout_sec = _charge_sparql(timeout_sec)
+        try:
+            params = {"query": query, "format": "json"}
+            headers = {"User-Agent": self.user_agent}
+
+            response = self.session.get(
+                self.endpoint_url,
+                params=params,
+                headers=headers,
+                timeout=timeout_sec
+            )
+
+            current_span().set(status=response.status_code, bytes=len(response.content))
+            if response.status_code == 200:
+                counts = {}
+                for row in response.json()["results"]["bindings"]:
+                    counts[row["tag"]["value"]] = int(row["c"]["value"])
+                return counts
+            else:
+                return None
+
+        except Exception as e:  # 超时或出错
+            return None
+
+    @traced("sparql.execute")
     def execute_sparql(self, query: str, retries=3):
         """
         执行 SPARQL 查询并返回结果 (JSON 格式)。
-        包含自动重试机制以应对 Wikidata 的网络波动。
+        包含自动重试机制以应对 Wikidata 的网络波动；重试耗尽 (包括一直被限流) 时抛出最后一次的异常，不返回空结果。
         """
+        from SPARQLWrapper import SPARQLWrapper, JSON  # 延迟导入，见 session
+
         sparql = SPARQLWrapper(self.endpoint_url)
         sparql.setQuery(query)
         sparql.setReturnFormat(JSON)
@@ -86,15 +227,23 @@ class WikidataService:
         sparql.setRequestMethod("postdirectly")
 
         for attempt in range(retries):
+            _check_cancelled()
+            timeout_sec = _charge_sparql()
+            if timeout_sec is not None:
+                sparql.setTimeout(max(int(timeout_sec), 1))
             try:
-                results = sparql.query().convert()
+                # 等价于 convert() 的 JSON 解析，先读出原始字节以便记录响应大小
+                body = sparql.query().response.read()
+                current_span().set(bytes=len(body), attempts=attempt + 1)
+                results = json.loads(body.decode("utf-8"))
                 return results["results"]["bindings"]
             except HTTPError as e:
-                if e.code == 429:  # Too Many Requests
+                if e.code == 429 and attempt < retries - 1:  # Too Many Requests
                     wait_time = (attempt + 1) * 2
                     print(f"[Wikidata] Rate limited. Waiting {wait_time}s...")
                     time.sleep(wait_time)
                 else:
+                    # 重试耗尽后仍被限流也要抛出：返回 [] 会被调用方当作"确实没有结果"写入工具备忘
                     print(f"[Wikidata] HTTP Error: {e}")
                     raise e
             except Exception as e:
@@ -104,8 +253,9 @@ class WikidataService:
                     raise e
                 time.sleep(1)
 
-        return []
+        raise ValueError(f"execute_sparql needs retries >= 1, got {retries}.")
 
+    @traced("link.property")
     def search_property(self, label: str) -> str:
         """
         [Relation Linker]
@@ -114,6 +264,14 @@ class WikidataService:
         if not label:
             return None
 
+        # 0. 离线索引 (Label + 别名的 n-gram 检索)，得分不够时才走网络
+        if self.property_linker is not None:
+            pid = self.property_linker.link(label)
+            if pid:
+                current_span().set(source="offline")
+                return pid
+        current_span().set(source="api")
+
         # 1. 尝试完全匹配搜索
         pid = self._search_wikidata_api(label, "property")
         if pid:
@@ -124,6 +282,7 @@ class WikidataService:
         # 这里为了严谨，我们暂时只做直接搜索。在论文中可以提到这里可以使用更高级的 Dense Retrieval (如 BERT-based linker)。
         return None
 
+    @traced("wikidata.search")
     def _search_wikidata_api(self, query: str, type_filter: str) -> str:
         """底层 API 调用"""
         try:
@@ -136,7 +295,8 @@ class WikidataService:
                 "limit": 1  # 科研 Baseline 通常取 Top-1，进阶版取 Top-5 配合 Re-ranking
             }
             headers = {"User-Agent": self.user_agent}
-            resp = requests.get("https://www.wikidata.org/w/api.php", params=params, headers=headers, timeout=5)
+            resp = self.session.get(self.api_url, params=params, headers=headers, timeout=5)
+            current_span().set(bytes=len(resp.content))
             data = resp.json()
 
             if data.get("search"):
@@ -174,6 +334,7 @@ class WikidataService:
         else:
             print("No bindings in results.")
 
+    @traced("sparql.count")
     def get_cardinality(self, query: str, timeout_sec=0.5) -> int:
         """
         [NEW] 探测专用：执行 COUNT 查询。
@@ -181,26 +342,26 @@ class WikidataService:
         数据库原则：如果是高选择率索引(High Selectivity)，COUNT 会瞬间返回。
         如果卡住了，说明它需要全表扫描，直接视为 Bad Path。
         """
+        timeout_sec = _charge_sparql(timeout_sec)
         try:
             params = {"query": query, "format": "json"}
             headers = {"User-Agent": self.user_agent}
 
-            response = requests.get(
+            response = self.session.get(
                 self.endpoint_url,
                 params=params,
                 headers=headers,
                 timeout=timeout_sec
             )
 
+            current_span().set(status=response.status_code, bytes=len(response.content))
             if response.status_code == 200:
                 data = response.json()
                 return int(data["results"]["bindings"][0]["c"]["value"])
             else:
                 return 999_999_999  # HTTP 错误视为高代价
 
-        except requests.exceptions.Timeout:
-            # print(f"[Probe] Timeout ({timeout_sec}s). Too expensive.")
-            return 999_999_999  # 超时视为高代价
         except Exception as e:
+            # 超时视为高代价 (出错同样处理)
             # print(f"[Probe] Error: {e}")
             return 999_999_999
@@ -1,6 +1,10 @@
 import json
-import requests
-import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ccsp framework"))
+from label_service import LabelService  # noqa: E402
+from persistent_cache import JsonFileStore  # noqa: E402
 
 # ================= 配置区域 =================
 # 如果您开启了 VPN，请在此处填写代理地址。
@@ -16,62 +20,20 @@ HEADERS = {
     "User-Agent": "MyDatasetLabelFetcher/1.0 (contact: your_email@example.com)"
 }
 
+# QID -> Label 持久化表，与 ccsp framework/main.py 的 LABEL_STORE_PATH 为同一文件
+LABEL_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ccsp framework", "label_store.json")
+
 
 # ===========================================
 
 def fetch_wikidata_labels(qids):
-    base_url = "https://www.wikidata.org/w/api.php"
-    qid_to_label = {}
-    unique_qids = list(set(qids))
-    batch_size = 50
-    total_batches = (len(unique_qids) + batch_size - 1) // batch_size
-
-    print(f"正在获取 {len(unique_qids)} 个实体的标签，共 {total_batches} 批...")
-
-    for i in range(0, len(unique_qids), batch_size):
-        batch = unique_qids[i:i + batch_size]
-        ids_str = "|".join(batch)
-
-        params = {
-            "action": "wbgetentities",
-            "ids": ids_str,
-            "format": "json",
-            "props": "labels",
-            "languages": "en"
-        }
-
-        try:
-            # 加入 proxies 和 headers 参数
-            response = requests.get(base_url, params=params, headers=HEADERS, proxies=PROXIES, timeout=15)
-
-            # 尝试解析 JSON
-            try:
-                data = response.json()
-            except json.JSONDecodeError:
-                print(f"\n[错误] 第 {i // batch_size + 1} 批返回的不是 JSON 数据。")
-                print(f"返回内容片段: {response.text[:200]}...")  # 打印前200个字符用于调试
-                continue
-
-            if "entities" in data:
-                for qid, entity in data["entities"].items():
-                    if "labels" in entity and "en" in entity["labels"]:
-                        qid_to_label[qid] = entity["labels"]["en"]["value"]
-                    else:
-                        qid_to_label[qid] = qid
-
-            print(f"第 {i // batch_size + 1}/{total_batches} 批获取成功")
-
-        except requests.exceptions.ProxyError:
-            print(f"\n[错误] 代理连接失败。请检查 PROXIES 设置中的端口是否正确。")
-            break
-        except requests.exceptions.ConnectionError:
-            print(f"\n[错误] 网络连接失败。请确认 VPN 已开启且可以访问 Wikidata。")
-            break
-        except Exception as e:
-            print(f"第 {i // batch_size + 1} 批请求发生未知异常: {e}")
-
-        time.sleep(1)  # 增加延迟以保持稳定
-
+    """标签通过 LabelService 获取：已查过的 QID 直接读 LABEL_STORE，重复运行不会再次请求"""
+    service = LabelService(JsonFileStore(LABEL_STORE), user_agent=HEADERS["User-Agent"], proxies=PROXIES, pause=1)
+    unique_qids = list(dict.fromkeys(qids))
+    print(f"正在获取 {len(unique_qids)} 个实体的标签...")
+    qid_to_label = service.get_labels(unique_qids)
+    service.save()
+    print(f"完成：本地命中 {len(unique_qids) - service.fetched} 个，网络获取 {service.fetched} 个")
     return qid_to_label
 
 
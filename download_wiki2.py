@@ -4,9 +4,14 @@ import time
 import os
 import requests
 import math
+import sys
 from huggingface_hub import list_repo_files, hf_hub_download
 from typing import List, Dict
 
+FRAMEWORK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ccsp framework")
+sys.path.insert(0, FRAMEWORK_DIR)
+from property_stats import build_histogram, histogram_columns_sql, parsed_values_sql
+
 # ================= 配置区域 =================
 # 1. 设置国内镜像
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
@@ -16,15 +21,24 @@ REPO_ID = "CleverThis/wikidata-truthy"
 # 注意：全量模式下这个变量虽然定义了但实际上被下面的逻辑忽略了，这是符合预期的
 SAMPLE_FILES_COUNT = 1600
 
-# [修复] 使用 raw string (r) 避免 Windows 路径转义错误
-OUTPUT_FILE = r"/ccsp framework/property_metadata.json"
+# 输出路径均相对于本脚本所在的仓库，与 main.py 加载的位置一致
+OUTPUT_FILE = os.path.join(FRAMEWORK_DIR, "property_metadata.json")
+# 服务端使用的属性元数据 (main.METADATA_PATH)，离线索引的 PID 列表取自这里
+METADATA_FILE = os.path.join(FRAMEWORK_DIR, "property_metadata_final.json")
+# 离线 Relation Linker 的属性快照 (python download_wiki2.py index 生成，即 main.PROPERTY_INDEX_PATH)
+PROPERTY_INDEX_FILE = os.path.join(FRAMEWORK_DIR, "property_index.json")
+
+# 数值/日期属性的等深直方图桶数 (每个属性存 N+1 个分位点)
+HISTOGRAM_BUCKETS = 32
+# 少于该数量的数值/日期三元组不生成直方图
+HISTOGRAM_MIN_VALUES = 100
 
 
 # ===========================================
 
 def fetch_property_details(pids: List[str]) -> Dict[str, Dict]:
     """
-    批量调用 Wikidata API 获取属性的 Label 和 Description。
+    批量调用 Wikidata API 获取属性的 Label、Description 和英文别名。
     增加重试机制，提高全量跑的稳定性。
     """
     print(f"   [API] 正在获取 {len(pids)} 个属性的语义描述...")
@@ -43,7 +57,7 @@ def fetch_property_details(pids: List[str]) -> Dict[str, Dict]:
             "action": "wbgetentities",
             "ids": ids_str,
             "languages": "en",
-            "props": "labels|descriptions",
+            "props": "labels|descriptions|aliases",
             "format": "json"
         }
 
@@ -62,7 +76,8 @@ def fetch_property_details(pids: List[str]) -> Dict[str, Dict]:
                     for pid, content in data["entities"].items():
                         label = content.get("labels", {}).get("en", {}).get("value", "Unknown")
                         desc = content.get("descriptions", {}).get("en", {}).get("value", "No description available.")
-                        results[pid] = {"label": label, "description": desc}
+                        aliases = [a["value"] for a in content.get("aliases", {}).get("en", [])]
+                        results[pid] = {"label": label, "description": desc, "aliases": aliases}
 
                 break  # 成功则跳出重试循环
 
@@ -121,13 +136,16 @@ def run_pipeline():
     # DuckDB支持直接传列表，但在SQL中需要格式化好。
     # 这里保持你的逻辑，因为通常几千个文件的路径字符串还是在限制内的。
 
-    query = fr"""
+    # 同一次扫描中解析数值和日期 (小数年份)，并计算等深直方图分位点
+    parsed = parsed_values_sql(f"read_parquet({local_paths})", where=r"regexp_matches(predicate, 'P\d+')")
+    query = f"""
+    WITH {parsed}
     SELECT 
-        regexp_extract(predicate, 'P\d+', 0) as pid,
+        pid,
         COUNT(*) as cnt,
-        APPROX_COUNT_DISTINCT("object") as unique_cnt
-    FROM read_parquet({local_paths})
-    WHERE regexp_matches(predicate, 'P\d+')
+        APPROX_COUNT_DISTINCT("object") as unique_cnt,
+        {histogram_columns_sql(HISTOGRAM_BUCKETS)}
+    FROM parsed
     GROUP BY pid
     HAVING cnt > 10
     ORDER BY cnt DESC
@@ -186,6 +204,10 @@ def run_pipeline():
             }
         }
 
+        histogram = build_histogram(row, HISTOGRAM_MIN_VALUES)
+        if histogram:
+            metadata["properties"][pid]["histogram"] = histogram
+
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
     with open(OUTPUT_FILE, 'w', encoding='utf-8') as out:
         json.dump(metadata, out, indent=2, ensure_ascii=False)
@@ -193,5 +215,31 @@ def run_pipeline():
     print(f"🎉 全量统计成功! 文件已保存至: {OUTPUT_FILE}")
 
 
+def build_property_index():
+    """
+    为 ccsp framework/property_linker.py 生成属性 Label + 别名快照。
+    只请求 API，不需要重新跑 DuckDB 聚合；属性集合与服务端加载的元数据 (METADATA_FILE) 保持一致。
+    """
+    with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+        pids = sorted((pid for pid in json.load(f).get("properties", {}) if pid.startswith("P")),
+                      key=lambda p: int(p[1:]) if p[1:].isdigit() else 0)
+    print(f"1. [索引] 共 {len(pids)} 个属性，开始获取 Label 与别名...")
+
+    details = fetch_property_details(pids)
+    properties = {pid: {"label": d["label"], "aliases": d.get("aliases", [])}
+                  for pid, d in details.items() if d["label"] != "Unknown"}
+
+    os.makedirs(os.path.dirname(PROPERTY_INDEX_FILE), exist_ok=True)
+    with open(PROPERTY_INDEX_FILE, 'w', encoding='utf-8') as out:
+        json.dump({"generated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "properties": properties},
+                  out, ensure_ascii=False)
+
+    n_aliases = sum(len(p["aliases"]) for p in properties.values())
+    print(f"🎉 属性索引已保存至: {PROPERTY_INDEX_FILE} ({len(properties)} 个属性, {n_aliases} 个别名)")
+
+
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        build_property_index()
+    else:
+        run_pipeline()
\ No newline at end of file
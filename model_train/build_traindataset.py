@@ -13,6 +13,11 @@ OUTPUT_FILE = "train_data_pointwise.jsonl"
 MIN_ANCHOR_SIZE = 1
 MAX_ANCHOR_SIZE = 1000
 
+# 渐进式探测的 (LIMIT, timeout 秒) 阶段：先用小 LIMIT 的服务端 COUNT 快速判定，
+# 只有结果超过第一阶段 LIMIT 或第一阶段超时的约束才升级。
+# 决定标签的超时只有最后一个阶段 (与原来的 15 秒上限一致)，短超时不会把慢查询直接标成坏锚点
+PROBE_STAGES = [(100, 5), (MAX_ANCHOR_SIZE, 15)]
+
 # SPARQL 端点
 SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
 
@@ -62,22 +67,39 @@ class DatasetBuilderFinal:
         return f"Frequency: {freq}, Diversity: {div} (CR:{cr:.2f})"
 
     def get_real_count_limit(self, query_sparql):
-        """[核心优化] 使用 LIMIT 检测法获取数量"""
+        """
+        [核心优化] 渐进式 LIMIT 检测法获取数量。
+        每个阶段只在服务端计算 COUNT(LIMIT n+1 子查询)，结果 <= n 即为精确值，立即返回。
+        """
+        for stage_idx, (stage_limit, timeout_sec) in enumerate(PROBE_STAGES):
+            count = self._bounded_count(query_sparql, stage_limit + 1, timeout_sec)
+            # 出错 (-1)：直接返回
+            if count < 0:
+                return count
+            # 超时 (999999)：只有最后一个阶段 (最长超时) 的超时才算坏锚点，前面的阶段升级重试
+            if count >= 999999:
+                if stage_idx == len(PROBE_STAGES) - 1:
+                    return count
+                continue
+            if count <= stage_limit:
+                return count
+
+        return 999999  # 溢出，Bad Anchor
+
+    def _bounded_count(self, query_sparql, limit_val, timeout_sec):
+        """服务端有界计数：SELECT (COUNT(*) AS ?c) WHERE { { <query> LIMIT n } }"""
         try:
-            limit_val = MAX_ANCHOR_SIZE + 1
-            if "LIMIT" not in query_sparql.upper():
-                query_sparql += f" LIMIT {limit_val}"
+            inner = query_sparql
+            if "LIMIT" not in inner.upper():
+                inner += f" LIMIT {limit_val}"
 
-            self.sparql.setQuery(query_sparql)
-            # 建议稍微放宽一点超时时间，或者保持 10s
-            self.sparql.setTimeout(15)
+            self.sparql.setQuery(f"SELECT (COUNT(*) AS ?c) WHERE {{ {{ {inner} }} }}")
+            self.sparql.setTimeout(timeout_sec)
 
             results = self.sparql.query().convert()["results"]["bindings"]
-            count = len(results)
-
-            if count >= limit_val:
-                return 999999  # 溢出，Bad Anchor
-            return count
+            if not results:
+                return 0
+            return int(results[0]["c"]["value"])
 
         except Exception as e:
             error_str = str(e).lower()  # 转小写，通杀所有大小写情况
@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FRAMEWORK_DIR = os.path.join(HERE, "..", "ccsp framework")
+sys.path.insert(0, FRAMEWORK_DIR)
+from anchor_ranker import AnchorRanker, extract_features, parse_training_text, prepare_properties  # noqa: E402
+
+# ================= 配置区域 =================
+INPUT_FILE = os.path.join(HERE, "train_data_pointwise.jsonl")  # build_traindataset.py 的输出
+METADATA_FILE = os.path.join(FRAMEWORK_DIR, "property_metadata.json")  # 与 build_traindataset.py 使用同一份统计表
+# 模型写到 ccsp framework/ 下，ANCHOR_RANKER_PATH 指向这个文件即可由 init_services 加载
+OUTPUT_FILE = os.path.join(FRAMEWORK_DIR, "anchor_ranker.json")
+
+# 按问题划分验证集，避免同一个问题的约束同时出现在训练和验证中
+VALID_RATIO = 0.2
+SEED = 13
+
+
+# ===========================================
+
+def load_samples(properties):
+    """返回 {query: [(features, label)]}"""
+    groups = defaultdict(list)
+    skipped = 0
+    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            parsed = parse_training_text(record["text"])
+            if not parsed:
+                skipped += 1
+                continue
+            pid, op, value = parsed
+            groups[record["query"]].append((extract_features(pid, op, value, properties), float(record["label"])))
+    if skipped:
+        print(f"[Warn] Skipped {skipped} records with unrecognized text.")
+    return groups
+
+
+def evaluate(model, groups):
+    tp = fp = fn = correct = total = 0
+    top1_hits = top1_total = 0
+    for samples in groups.values():
+        scores = [model.score_features(x) for x, _ in samples]
+        for (x, y), p in zip(samples, scores):
+            pred = p >= model.threshold
+            total += 1
+            correct += int(pred == (y >= 0.5))
+            tp += int(pred and y >= 0.5)
+            fp += int(pred and y < 0.5)
+            fn += int(not pred and y >= 0.5)
+        # 排序指标：问题中存在好锚点时，得分最高的约束是否就是好锚点
+        if any(y >= 0.5 for _, y in samples):
+            top1_total += 1
+            best = max(range(len(samples)), key=lambda i: scores[i])
+            top1_hits += int(samples[best][1] >= 0.5)
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    print(f"  Accuracy:  {correct / total:.4f} ({total} samples)")
+    print(f"  Precision: {precision:.4f}  Recall: {recall:.4f}")
+    if top1_total:
+        print(f"  Top-1 anchor hit rate: {top1_hits / top1_total:.4f} ({top1_total} questions)")
+
+
+def main():
+    with open(METADATA_FILE, 'r', encoding='utf-8') as f:
+        properties = prepare_properties(json.load(f).get("properties", {}))
+
+    groups = load_samples(properties)
+    if not groups:
+        print(f"[Error] No training data in {INPUT_FILE}. Run build_traindataset.py first.")
+        return
+
+    queries = sorted(groups)
+    random.Random(SEED).shuffle(queries)
+    n_valid = int(len(queries) * VALID_RATIO)
+    valid = {q: groups[q] for q in queries[:n_valid]}
+    train = {q: groups[q] for q in queries[n_valid:]}
+    train_samples = [s for samples in train.values() for s in samples]
+    print(f"Training on {len(train_samples)} samples from {len(train)} questions...")
+
+    start = time.time()
+    model = AnchorRanker.train(train_samples, properties=properties)
+    print(f"Trained in {time.time() - start:.1f}s")
+
+    print("Train:")
+    evaluate(model, train)
+    if valid:
+        print("Validation:")
+        evaluate(model, valid)
+
+    # 推理延迟 (特征已提取，只计打分)
+    features = [x for x, _ in train_samples[:1000]]
+    start = time.perf_counter()
+    for x in features:
+        model.score_features(x)
+    per_call = (time.perf_counter() - start) / len(features) * 1e6
+    print(f"Inference: {per_call:.1f} µs per constraint")
+
+    for name, w in sorted(zip(model.feature_names, model.weights), key=lambda t: -abs(t[1])):
+        print(f"  {name:<20} {w:+.3f}")
+
+    model.save(OUTPUT_FILE)
+    print(f"Done! Saved to {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()